@@ -0,0 +1,157 @@
+"""Benchmark of the thumbnail formats on a fixed corpus of generated wallpapers.
+
+Run it from the repository root with `python benchmarks/thumbnail_formats.py`. It measures the functions that
+waypaper itself uses: cache_image for the throughput of a single worker, save_thumbnail for encoding,
+load_thumbnail_file for decoding and load_packed_thumbnail for thumbnails read from the pack.
+The corpus is generated from a fixed seed, so every run works on the same images."""
+
+import argparse
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from waypaper.cache import ThumbnailPack
+from waypaper.common import ThumbnailFormat, cache_image, get_cached_image_path, import_gdk_pixbuf, \
+    load_packed_thumbnail, load_thumbnail_file, pack_thumbnails, save_thumbnail
+
+FORMATS = [
+    ThumbnailFormat("png", compression=1),
+    ThumbnailFormat("png", compression=6),
+    ThumbnailFormat("png", compression=9),
+    ThumbnailFormat("jpeg", quality=90),
+    ThumbnailFormat("jpeg", quality=75),
+    ThumbnailFormat("webp", quality=90),
+    ThumbnailFormat("webp", quality=75),
+]
+
+WIDTH, HEIGHT = 1920, 1080
+SEED = 2024
+
+
+def generate_corpus(folder: Path, count: int) -> list[str]:
+    """Save JPEG wallpapers made of a gradient, flat rectangles and patches of noise"""
+    GdkPixbuf, GLib = import_gdk_pixbuf()
+    rng = random.Random(SEED)
+    row_bytes = WIDTH * 3
+    tables = [bytes((value + shift) % 256 for value in range(256)) for shift in range(256)]
+    paths = []
+    for number in range(count):
+        # Each row is the same gradient with its colors shifted, which keeps generation fast:
+        step = rng.uniform(0.05, 0.5)
+        base_row = bytes(int(x * step + channel * 85) % 256 for x in range(WIDTH) for channel in range(3))
+        pixels = bytearray(b"".join(base_row.translate(tables[y * 256 // HEIGHT]) for y in range(HEIGHT)))
+
+        for _ in range(rng.randint(3, 12)):
+            width, height = rng.randint(50, WIDTH // 2), rng.randint(50, HEIGHT // 2)
+            left, top = rng.randint(0, WIDTH - width), rng.randint(0, HEIGHT - height)
+            noise = rng.random() < 0.3
+            color = bytes(rng.randrange(256) for _ in range(3)) * width
+            for y in range(top, top + height):
+                start = y * row_bytes + left * 3
+                pixels[start:start + width * 3] = rng.randbytes(width * 3) if noise else color
+
+        pixbuf = GdkPixbuf.Pixbuf.new_from_bytes(GLib.Bytes.new(bytes(pixels)), GdkPixbuf.Colorspace.RGB, False, 8,
+                                                 WIDTH, HEIGHT, row_bytes)
+        path = folder / f"{number:04}.jpg"
+        pixbuf.savev(str(path), "jpeg", ["quality"], ["90"])
+        paths.append(str(path))
+    return paths
+
+
+def milliseconds(durations: list[float]) -> float:
+    return statistics.mean(durations) * 1000
+
+
+def benchmark_format(image_paths: list[str], cache_dir: Path, thumbnail_format: ThumbnailFormat) -> dict:
+    # The whole thumbnail creation, as done by `waypaper --build-cache --jobs 1`:
+    start = time.perf_counter()
+    for image_path in image_paths:
+        cache_image(image_path, cache_dir, thumbnail_format)
+    throughput = len(image_paths) / (time.perf_counter() - start)
+
+    thumbnails = [get_cached_image_path(image_path, cache_dir, thumbnail_format=thumbnail_format)
+                  for image_path in image_paths]
+    decode_times, encode_times = [], []
+    encoded = cache_dir / "encoded.tmp"
+    for thumbnail in thumbnails:
+        start = time.perf_counter()
+        pixbuf = load_thumbnail_file(thumbnail)
+        decode_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        save_thumbnail(pixbuf, encoded, thumbnail_format)
+        encode_times.append(time.perf_counter() - start)
+    encoded.unlink()
+
+    return {
+        "encode": milliseconds(encode_times),
+        "decode": milliseconds(decode_times),
+        "size": statistics.mean(thumbnail.stat().st_size for thumbnail in thumbnails) / 1024,
+        "throughput": throughput,
+    }
+
+
+def benchmark_pack(image_paths: list[str], cache_dir: Path) -> dict:
+    """Pack the default thumbnails and read them back as the grid does"""
+    pack_thumbnails(image_paths, cache_dir)
+    pack = ThumbnailPack(cache_dir)
+    index = pack.load_index()
+    read_times = []
+    for name, record in index.items():
+        start = time.perf_counter()
+        load_packed_thumbnail(pack, name, record)
+        read_times.append(time.perf_counter() - start)
+    return {
+        "read": milliseconds(read_times),
+        "size": statistics.mean(record.length for record in index.values()) / 1024,
+    }
+
+
+def describe_format(thumbnail_format: ThumbnailFormat) -> str:
+    if thumbnail_format.codec == "png":
+        default = " (default)" if thumbnail_format == ThumbnailFormat() else ""
+        return f"`png`, compression {thumbnail_format.compression}{default}"
+    return f"`{thumbnail_format.codec}`, quality {thumbnail_format.quality}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare the thumbnail formats of waypaper")
+    parser.add_argument("--count", type=int, default=200, help="number of generated images")
+    parser.add_argument("--corpus", type=Path, help="folder to keep the generated images in between runs")
+    args = parser.parse_args()
+
+    GdkPixbuf, _ = import_gdk_pixbuf()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus = args.corpus or Path(tmp_dir) / "corpus"
+        corpus.mkdir(parents=True, exist_ok=True)
+        image_paths = sorted(str(path) for path in corpus.glob("*.jpg"))[:args.count]
+        if len(image_paths) < args.count:
+            image_paths = generate_corpus(corpus, args.count)
+        corpus_size = sum(os.path.getsize(path) for path in image_paths) / 1024 / 1024
+
+        print(f"{len(image_paths)} generated {WIDTH}×{HEIGHT} JPEG images ({corpus_size:.1f} MB), "
+              f"{platform.machine()} {platform.processor() or 'CPU'}, GdkPixbuf {GdkPixbuf.PIXBUF_VERSION}, "
+              f"Python {platform.python_version()}\n")
+        print("| Format | Encode (ms) | Decode (ms) | Size (KiB) | Throughput (images/s) |")
+        print("|---|---|---|---|---|")
+        for thumbnail_format in FORMATS:
+            cache_dir = Path(tmp_dir) / f"{thumbnail_format.codec}-{thumbnail_format.quality}-{thumbnail_format.compression}"
+            cache_dir.mkdir()
+            result = benchmark_format(image_paths, cache_dir, thumbnail_format)
+            print(f"| {describe_format(thumbnail_format)} | {result['encode']:.2f} | {result['decode']:.2f} | "
+                  f"{result['size']:.1f} | {result['throughput']:.0f} |")
+            if thumbnail_format == ThumbnailFormat():
+                pack_result = benchmark_pack(image_paths, cache_dir)
+
+        print(f"\nPacked thumbnails: {pack_result['size']:.1f} KiB, {pack_result['read']:.2f} ms to read")
+
+
+if __name__ == "__main__":
+    main()
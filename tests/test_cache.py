@@ -0,0 +1,384 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from waypaper.cache import ThumbnailCache, ThumbnailPack
+from waypaper.common import get_cached_image_path, collect_cache_garbage, record_cached_images, cache_video_frame, \
+    get_ffmpeg_codec_options, get_image_entries, cache_images, ThumbnailFormat
+
+
+class CachedImagePathTests(unittest.TestCase):
+    def test_path_changes_when_image_is_modified(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            image = Path(tmp_dir) / "a.jpg"
+            image.write_bytes(b"a")
+            os.utime(image, ns=(1_000_000_000, 1_000_000_000))
+            first = get_cached_image_path(str(image), Path(tmp_dir))
+            self.assertEqual(first, get_cached_image_path(str(image), Path(tmp_dir)))
+
+            image.write_bytes(b"b")
+            os.utime(image, ns=(2_000_000_000, 2_000_000_000))
+            self.assertNotEqual(first, get_cached_image_path(str(image), Path(tmp_dir)))
+
+    def test_known_stat_gives_same_path(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            image = Path(tmp_dir) / "a.jpg"
+            image.write_bytes(b"abc")
+            stat = image.stat()
+            self.assertEqual(get_cached_image_path(str(image), Path(tmp_dir)),
+                             get_cached_image_path(str(image), Path(tmp_dir), stat.st_size, stat.st_mtime_ns))
+
+    def test_path_follows_codec_and_lossy_quality(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            image = Path(tmp_dir) / "a.jpg"
+            image.write_bytes(b"a")
+            png = get_cached_image_path(str(image), Path(tmp_dir))
+            jpeg = get_cached_image_path(str(image), Path(tmp_dir), thumbnail_format=ThumbnailFormat("jpeg", 90))
+            self.assertEqual(png.suffix, ".png")
+            self.assertEqual(jpeg.suffix, ".jpg")
+            self.assertNotEqual(png.stem, jpeg.stem)
+            self.assertNotEqual(jpeg, get_cached_image_path(str(image), Path(tmp_dir),
+                                                            thumbnail_format=ThumbnailFormat("jpeg", 75)))
+            self.assertEqual(png, get_cached_image_path(str(image), Path(tmp_dir),
+                                                        thumbnail_format=ThumbnailFormat("png", compression=1)))
+
+    def test_listed_entries_find_thumbnail_of_image_overwritten_in_place(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            folder = Path(tmp_dir) / "wallpapers"
+            folder.mkdir()
+            image = folder / "a.jpg"
+            image.write_bytes(b"a" * 10)
+            os.utime(folder, (1_000_000_000, 1_000_000_000))
+            get_image_entries("swaybg", [folder], cache_dir=Path(tmp_dir))
+
+            image.write_bytes(b"b" * 20)
+            os.utime(folder, (1_000_000_000, 1_000_000_000))
+            entry, = get_image_entries("swaybg", [folder], cache_dir=Path(tmp_dir), revalidate_files=True)
+            self.assertEqual(entry.size, 20)
+            self.assertEqual(get_cached_image_path(entry.path, Path(tmp_dir), entry.size, entry.mtime_ns),
+                             get_cached_image_path(str(image), Path(tmp_dir)))
+
+
+class ThumbnailCacheTests(unittest.TestCase):
+    def make_image(self, folder: Path, name: str, cache_dir: Path, size: int = 10) -> Path:
+        """Create an image together with its thumbnail of the given size"""
+        image = folder / name
+        image.write_bytes(b"i")
+        get_cached_image_path(str(image), cache_dir).write_bytes(b"t" * size)
+        record_cached_images([str(image)], cache_dir)
+        return image
+
+    def test_removes_thumbnails_of_deleted_and_modified_images(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            folder, cache_dir = Path(tmp_dir), Path(tmp_dir) / "cache"
+            cache_dir.mkdir()
+            kept = self.make_image(folder, "kept.jpg", cache_dir)
+            deleted = self.make_image(folder, "deleted.jpg", cache_dir)
+            modified = self.make_image(folder, "modified.jpg", cache_dir)
+            deleted_thumbnail = get_cached_image_path(str(deleted), cache_dir)
+            modified_thumbnail = get_cached_image_path(str(modified), cache_dir)
+            deleted.unlink()
+            modified.write_bytes(b"new content")
+
+            result = collect_cache_garbage(cache_dir)
+
+            self.assertEqual(result.removed, 2)
+            self.assertEqual(result.kept, 1)
+            self.assertFalse(deleted_thumbnail.exists())
+            self.assertFalse(modified_thumbnail.exists())
+            self.assertTrue(get_cached_image_path(str(kept), cache_dir).exists())
+
+    def test_removes_thumbnails_of_previous_codec(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            folder, cache_dir = Path(tmp_dir), Path(tmp_dir) / "cache"
+            cache_dir.mkdir()
+            image = self.make_image(folder, "a.jpg", cache_dir)
+            webp = ThumbnailFormat("webp", 80)
+            webp_thumbnail = get_cached_image_path(str(image), cache_dir, thumbnail_format=webp)
+            webp_thumbnail.write_bytes(b"t")
+            record_cached_images([str(image)], cache_dir, webp)
+
+            result = collect_cache_garbage(cache_dir, thumbnail_format=webp)
+
+            self.assertEqual((result.removed, result.kept), (1, 1))
+            self.assertFalse(get_cached_image_path(str(image), cache_dir).exists())
+            self.assertTrue(webp_thumbnail.exists())
+
+    def test_thumbnail_moved_for_renamed_image_is_kept(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            folder, cache_dir = Path(tmp_dir), Path(tmp_dir) / "cache"
+            cache_dir.mkdir()
+            image = self.make_image(folder, "old.jpg", cache_dir)
+            old_thumbnail = get_cached_image_path(str(image), cache_dir)
+            renamed = image.rename(folder / "new.jpg")
+            new_thumbnail = get_cached_image_path(str(renamed), cache_dir)
+            os.replace(old_thumbnail, new_thumbnail)
+            ThumbnailCache(cache_dir).rename(old_thumbnail, str(renamed), new_thumbnail)
+            os.utime(new_thumbnail, (1_000_000_000, 1_000_000_000))
+
+            result = collect_cache_garbage(cache_dir)
+
+            self.assertEqual((result.removed, result.kept), (0, 1))
+            self.assertTrue(new_thumbnail.exists())
+
+    def test_evicts_least_recently_used_thumbnails_over_limits(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            folder, cache_dir = Path(tmp_dir), Path(tmp_dir) / "cache"
+            cache_dir.mkdir()
+            images = [self.make_image(folder, f"{i}.jpg", cache_dir, size=1024 * 1024) for i in range(4)]
+            time.sleep(0.01)
+            ThumbnailCache(cache_dir).touch([get_cached_image_path(str(images[0]), cache_dir)])
+
+            result = collect_cache_garbage(cache_dir, max_size=2)
+            self.assertEqual(result.kept, 2)
+            remaining = [image for image in images if get_cached_image_path(str(image), cache_dir).exists()]
+            self.assertEqual(remaining, [images[0], images[3]])
+
+            result = collect_cache_garbage(cache_dir, max_entries=1)
+            self.assertEqual(result.kept, 1)
+            self.assertTrue(get_cached_image_path(str(images[0]), cache_dir).exists())
+
+    def test_removes_old_thumbnails_missing_from_manifest(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_dir = Path(tmp_dir)
+            old_orphan = cache_dir / ("a" * 32 + ".png")
+            new_orphan = cache_dir / ("b" * 32 + ".png")
+            other_file = cache_dir / "used_wallpapers.txt"
+            for path in (old_orphan, new_orphan, other_file):
+                path.write_bytes(b"x")
+            os.utime(old_orphan, (1_000_000_000, 1_000_000_000))
+            os.utime(other_file, (1_000_000_000, 1_000_000_000))
+
+            collect_cache_garbage(cache_dir)
+            self.assertFalse(old_orphan.exists())
+            self.assertTrue(new_orphan.exists())
+            self.assertTrue(other_file.exists())
+
+    def test_garbage_collection_is_due_once_a_day(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = ThumbnailCache(Path(tmp_dir))
+            self.assertTrue(cache.is_gc_due())
+            collect_cache_garbage(Path(tmp_dir))
+            self.assertFalse(cache.is_gc_due())
+
+    def test_upgraded_manifest_keeps_thumbnails_and_records_aspects(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_dir = Path(tmp_dir)
+            connection = sqlite3.connect(cache_dir / "thumbnails.sqlite")
+            with connection:
+                connection.execute("CREATE TABLE thumbnails (name TEXT PRIMARY KEY, source TEXT, size INTEGER, atime REAL)")
+                connection.execute("CREATE TABLE state (key TEXT PRIMARY KEY, value REAL)")
+                connection.execute("CREATE TABLE pack (name TEXT PRIMARY KEY, offset INTEGER, length INTEGER, "
+                                   "width INTEGER, height INTEGER, rowstride INTEGER, has_alpha INTEGER)")
+                connection.execute("INSERT INTO thumbnails VALUES ('old.png', '/old.jpg', 1, 0)")
+                connection.execute("INSERT INTO pack VALUES ('old.png', 0, 1, 1, 1, 4, 1)")
+                connection.execute("PRAGMA user_version = 2")
+            connection.close()
+
+            (cache_dir / "new.png").write_bytes(b"t")
+            cache = ThumbnailCache(cache_dir)
+            cache.add([("/new.jpg", cache_dir / "new.png")], {"/new.jpg": 1.5})
+
+            self.assertEqual(cache.get_aspects(), {"/new.jpg": 1.5})
+            self.assertIn("old.png", ThumbnailPack(cache_dir).load_index())
+            cache.open()
+            self.assertEqual(cache.connection.execute("SELECT COUNT(*) FROM thumbnails").fetchone()[0], 2)
+            cache.close()
+
+
+class ThumbnailPackTests(unittest.TestCase):
+    def add_thumbnails(self, cache_dir: Path, names: list[str]) -> None:
+        """Record thumbnails in the manifest and add their pixels to the pack"""
+        for name in names:
+            (cache_dir / name).write_bytes(b"t")
+        ThumbnailCache(cache_dir).add([(name, cache_dir / name) for name in names])
+        ThumbnailPack(cache_dir).append([(name, 2, 1, 8, True, name.encode() * 4) for name in names])
+
+    def test_reads_appended_thumbnails(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_dir = Path(tmp_dir)
+            self.add_thumbnails(cache_dir, ["a" * 32 + ".png"])
+            self.add_thumbnails(cache_dir, ["b" * 32 + ".png"])
+            pack = ThumbnailPack(cache_dir)
+            index = pack.load_index()
+
+            for name in index:
+                self.assertEqual(pack.read(name, index[name]), name.encode() * 4)
+            self.assertEqual(index["b" * 32 + ".png"][2:], (2, 1, 8, True))
+            pack.unmap()
+
+    def test_clear_keeps_locks_and_history(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_dir = Path(tmp_dir)
+            names = ["a" * 32 + ".png", "b" * 32 + ".jpg"]
+            self.add_thumbnails(cache_dir, names)
+            for name in ["history.lock", "history.log", "folder_index.sqlite"]:
+                (cache_dir / name).write_bytes(b"kept")
+            lock_inode = (cache_dir / "thumbnails.pack.lock").stat().st_ino
+
+            self.assertEqual(ThumbnailPack(cache_dir).clear(), 2)
+
+            self.assertFalse(any((cache_dir / name).exists() for name in names))
+            self.assertFalse((cache_dir / "thumbnails.pack").exists())
+            self.assertEqual(ThumbnailPack(cache_dir).load_index(), {})
+            self.assertEqual((cache_dir / "thumbnails.pack.lock").stat().st_ino, lock_inode)
+            for name in ["history.lock", "history.log", "folder_index.sqlite"]:
+                self.assertEqual((cache_dir / name).read_bytes(), b"kept")
+
+    def test_compaction_drops_removed_thumbnails(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_dir = Path(tmp_dir)
+            names = [letter * 32 + ".png" for letter in "abc"]
+            self.add_thumbnails(cache_dir, names)
+            pack = ThumbnailPack(cache_dir)
+            old_index = pack.load_index()
+            old_size = pack.pack_file.stat().st_size
+
+            # Thumbnails that are no longer in the manifest are garbage in the pack:
+            connection = sqlite3.connect(cache_dir / "thumbnails.sqlite")
+            with connection:
+                connection.execute("DELETE FROM thumbnails WHERE name != ?", (names[2],))
+            connection.close()
+            pack.compact()
+
+            new_index = pack.load_index()
+            self.assertEqual(list(new_index), [names[2]])
+            self.assertLess(pack.pack_file.stat().st_size, old_size)
+            self.assertEqual(pack.read(names[2], new_index[names[2]]), names[2].encode() * 4)
+            # Records found through an outdated index are detected instead of returning wrong pixels:
+            self.assertIsNone(pack.read(names[0], old_index[names[0]]))
+            pack.unmap()
+
+    def test_mapping_follows_compacted_pack(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_dir = Path(tmp_dir)
+            names = [letter * 32 + ".png" for letter in "abc"]
+            self.add_thumbnails(cache_dir, names)
+            pack = ThumbnailPack(cache_dir)
+            self.assertIsNotNone(pack.read(names[2], pack.load_index()[names[2]]))
+
+            connection = sqlite3.connect(cache_dir / "thumbnails.sqlite")
+            with connection:
+                connection.execute("DELETE FROM thumbnails WHERE name != ?", (names[2],))
+            connection.close()
+            ThumbnailPack(cache_dir).compact()
+
+            self.assertEqual(pack.read(names[2], pack.load_index()[names[2]]), names[2].encode() * 4)
+            pack.unmap()
+
+    def test_packed_thumbnails_count_against_size_limit(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_dir = Path(tmp_dir)
+            names = [letter * 32 + ".png" for letter in "abc"]
+            self.add_thumbnails(cache_dir, names)
+            sources = {str(cache_dir / f"{name}.jpg"): cache_dir / name for name in names}
+            for source in sources:
+                Path(source).write_bytes(b"i")
+            connection = sqlite3.connect(cache_dir / "thumbnails.sqlite")
+            with connection:
+                connection.executemany("UPDATE thumbnails SET source = ? WHERE name = ?",
+                                       [(source, thumbnail.name) for source, thumbnail in sources.items()])
+            connection.close()
+            record_size = 1 + ThumbnailPack(cache_dir).load_index()[names[0]].length
+
+            result = ThumbnailCache(cache_dir, max_bytes=2 * record_size).collect_garbage(
+                lambda source, _: sources[source])
+
+            self.assertEqual((result.removed, result.kept), (1, 2))
+            self.assertFalse((cache_dir / names[0]).exists())
+
+
+class BrokenExecutor:
+    """Process pool whose worker processes die before caching anything"""
+
+    def __init__(self, *args, **kwargs) -> None:
+        pass
+
+    def submit(self, *args) -> Future:
+        future = Future()
+        future.set_exception(BrokenProcessPool("A process in the process pool was terminated abruptly"))
+        return future
+
+    def shutdown(self, *args, **kwargs) -> None:
+        pass
+
+
+class CacheImagesTests(unittest.TestCase):
+    image_paths = ["/wallpapers/a.jpg", "/wallpapers/b.jpg", "/wallpapers/c.jpg"]
+
+    def test_caches_in_this_process_with_one_worker(self):
+        cached = []
+        with patch("waypaper.common.cache_image", side_effect=lambda path, *args: cached.append(path)), \
+                patch("waypaper.common.record_cached_images") as record, \
+                patch("concurrent.futures.ProcessPoolExecutor", side_effect=AssertionError("pool started")):
+            yielded = list(cache_images(self.image_paths, Path("/cache"), workers=1))
+
+        self.assertEqual(cached, self.image_paths)
+        self.assertEqual(yielded, self.image_paths)
+        record.assert_called_once_with(self.image_paths, Path("/cache"), ThumbnailFormat())
+
+    def test_caches_remaining_images_in_this_process_if_pool_breaks(self):
+        cached = []
+        with patch("waypaper.common.cache_image", side_effect=lambda path, *args: cached.append(path)), \
+                patch("waypaper.common.record_cached_images") as record, \
+                patch("concurrent.futures.ProcessPoolExecutor", BrokenExecutor):
+            yielded = list(cache_images(self.image_paths, Path("/cache"), workers=3))
+
+        self.assertEqual(cached, self.image_paths)
+        self.assertEqual(yielded, self.image_paths)
+        record.assert_called_once_with(self.image_paths, Path("/cache"), ThumbnailFormat())
+
+    def test_records_cached_images_when_consumer_stops_early(self):
+        with patch("waypaper.common.cache_image"), patch("waypaper.common.record_cached_images") as record:
+            images = cache_images(self.image_paths, Path("/cache"), workers=1)
+            self.assertEqual(next(images), self.image_paths[0])
+            images.close()
+
+        record.assert_called_once_with(self.image_paths[:1], Path("/cache"), ThumbnailFormat())
+
+
+class VideoFrameTests(unittest.TestCase):
+    def test_seeks_to_start_if_video_is_too_short(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_file = Path(tmp_dir) / "frame.tmp"
+            commands = []
+
+            def fake_run(command, **kwargs):
+                commands.append(command)
+                self.assertIn("timeout", kwargs)
+                # Only the second attempt, from the start of the video, produces a frame:
+                if len(commands) == 2:
+                    output_file.write_bytes(b"frame")
+                return SimpleNamespace(returncode=0, stderr="")
+
+            with patch("waypaper.common.get_ffmpeg_executable", return_value="ffmpeg"), \
+                    patch("waypaper.common.subprocess.run", side_effect=fake_run):
+                cache_video_frame("video.mp4", output_file, 240)
+
+        self.assertEqual(len(commands), 2)
+        self.assertEqual(commands[1][commands[1].index("-ss") + 1], "0")
+        self.assertIn("scale=240:-2", commands[0])
+
+    def test_fails_if_no_frame_is_extracted(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with patch("waypaper.common.get_ffmpeg_executable", return_value="ffmpeg"), \
+                    patch("waypaper.common.subprocess.run", return_value=SimpleNamespace(returncode=1, stderr="error")):
+                with self.assertRaises(RuntimeError):
+                    cache_video_frame("video.mp4", Path(tmp_dir) / "frame.tmp", 240)
+
+
+    def test_codec_options_follow_thumbnail_format(self):
+        self.assertEqual(get_ffmpeg_codec_options(ThumbnailFormat("png", 90, 1)), ["-c:v", "png", "-compression_level", "1"])
+        self.assertEqual(get_ffmpeg_codec_options(ThumbnailFormat("jpeg", 100, 6)), ["-c:v", "mjpeg", "-q:v", "2"])
+        self.assertEqual(get_ffmpeg_codec_options(ThumbnailFormat("jpeg", 0, 6))[-1], "31")
+
+
+if __name__ == "__main__":
+    unittest.main()
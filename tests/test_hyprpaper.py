@@ -0,0 +1,44 @@
+import subprocess
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from waypaper.changer import change_with_hyprpaper
+
+
+def change_and_get_unloads(shown: dict, image_path: str, monitor: str) -> list:
+    """Change the wallpaper with a fake hyprctl that tracks the shown wallpapers, and return the unloaded ones"""
+    unloads = []
+
+    def fake_check_output(command, **kwargs):
+        if command[:3] == ["hyprctl", "hyprpaper", "listactive"]:
+            return "".join(f"{name} = {path}\n" for name, path in shown.items())
+        return "ok"
+
+    def fake_run(command, **kwargs):
+        if command[2] == "wallpaper":
+            name, path = command[3].split(",", 1)
+            shown[name] = path
+        elif command[2] == "unload":
+            unloads.append(command[3])
+        return subprocess.CompletedProcess(command, 0, stdout="ok")
+
+    with patch("waypaper.changer.subprocess.check_output", fake_check_output), \
+            patch("waypaper.changer.subprocess.run", fake_run), patch("waypaper.changer.time.sleep"):
+        change_with_hyprpaper(Path(image_path), None, monitor)
+    return unloads
+
+
+class HyprpaperTests(unittest.TestCase):
+    def test_unloads_only_the_replaced_wallpaper(self):
+        shown = {"DP-1": "/wallpapers/old.jpg", "HDMI-A-1": "/wallpapers/other.jpg"}
+        self.assertEqual(change_and_get_unloads(shown, "/wallpapers/new.jpg", "DP-1"), ["/wallpapers/old.jpg"])
+        self.assertEqual(shown, {"DP-1": "/wallpapers/new.jpg", "HDMI-A-1": "/wallpapers/other.jpg"})
+
+    def test_keeps_a_replaced_wallpaper_that_another_monitor_shows(self):
+        shown = {"DP-1": "/wallpapers/same.jpg", "HDMI-A-1": "/wallpapers/same.jpg"}
+        self.assertEqual(change_and_get_unloads(shown, "/wallpapers/new.jpg", "DP-1"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
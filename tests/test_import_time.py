@@ -0,0 +1,79 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parents[1]
+
+# Modules that the command line does not need, since they are only used by the GUI or to create thumbnails:
+HEAVY_MODULES = ["gi", "PIL", "imageio", "screeninfo", "concurrent.futures", "waypaper.app"]
+
+# Config that changes wallpapers without any backend, so that the commands that set wallpapers run through here:
+CONFIG = """[Settings]
+backend = none
+folder = {folder}
+monitors = All
+wallpaper = {folder}/first.jpg
+post_command =
+slideshow_enabled = False
+"""
+
+
+def get_imported_modules(*args: str) -> tuple[int, dict[str, int]]:
+    """Run waypaper with `python -X importtime` on a temporary config and return its exit status
+    and the cumulative import time of each module in microseconds"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        folder = Path(tmp_dir) / "wallpapers"
+        folder.mkdir()
+        for name in ["first.jpg", "second.jpg"]:
+            (folder / name).write_bytes(b"\xff\xd8\xff")
+        config_file = Path(tmp_dir) / "config.ini"
+        config_file.write_text(CONFIG.format(folder=folder))
+        env = dict(os.environ, HOME=tmp_dir, FAKE_HOME=tmp_dir, XDG_CONFIG_HOME=tmp_dir, XDG_CACHE_HOME=tmp_dir,
+                   XDG_STATE_HOME=tmp_dir, XDG_RUNTIME_DIR=tmp_dir,
+                   PYTHONPATH=os.pathsep.join(filter(None, [str(REPO_DIR), os.environ.get("PYTHONPATH")])))
+        result = subprocess.run([sys.executable, "-X", "importtime", "-m", "waypaper",
+                                 "--config-file", str(config_file), *args],
+                                cwd=tmp_dir, env=env, capture_output=True, text=True, timeout=60)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                modules[name.strip()] = int(cumulative)
+    return result.returncode, modules
+
+
+class ImportTimeTests(unittest.TestCase):
+    def assert_light(self, *args: str) -> None:
+        returncode, modules = get_imported_modules(*args)
+        self.assertEqual(returncode, 0)
+        self.assertIn("waypaper.config", modules)
+        for module in HEAVY_MODULES:
+            self.assertNotIn(module, modules, f"waypaper {' '.join(args)} imports {module}")
+
+    def test_version_does_not_import_gui_or_image_libraries(self):
+        self.assert_light("--version")
+
+    def test_list_does_not_import_gui_or_image_libraries(self):
+        self.assert_light("--list")
+
+    def test_restore_does_not_import_gui_or_image_libraries(self):
+        self.assert_light("--restore")
+
+    def test_random_does_not_import_gui_or_image_libraries(self):
+        self.assert_light("--random")
+
+    def test_gui_does_not_import_image_libraries(self):
+        # Only the creation of thumbnails needs them, and it imports them itself:
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(REPO_DIR), os.environ.get("PYTHONPATH")])))
+        code = "import sys, waypaper.app; print(' '.join(m for m in ['PIL', 'imageio', 'numpy'] if m in sys.modules))"
+        result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
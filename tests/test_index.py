@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from waypaper.index import FolderIndex
+
+
+class FolderIndexTests(unittest.TestCase):
+    def make_tree(self, tmp_dir: str) -> Path:
+        root = Path(tmp_dir) / "wallpapers"
+        (root / "nature" / "deep").mkdir(parents=True)
+        (root / ".hidden").mkdir()
+        (root / "a.jpg").write_bytes(b"a")
+        (root / "notes.txt").write_bytes(b"text")
+        (root / ".b.png").write_bytes(b"b")
+        (root / "nature" / "c.png").write_bytes(b"cc")
+        (root / "nature" / "deep" / "d.gif").write_bytes(b"ddd")
+        (root / ".hidden" / "e.jpg").write_bytes(b"e")
+        return root
+
+    def age_directories(self, root: Path) -> None:
+        """Move mtimes to the past so that directories are not considered as recently modified"""
+        for path, _, _ in os.walk(root):
+            os.utime(path, (1_000_000_000, 1_000_000_000))
+
+    def names(self, entries) -> list[str]:
+        return sorted(os.path.basename(entry.path) for entry in entries)
+
+    def test_filters_match_folder_options(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root = self.make_tree(tmp_dir)
+            index = FolderIndex(Path(tmp_dir))
+
+            self.assertEqual(self.names(index.list_images([root])), ["a.jpg"])
+            self.assertEqual(self.names(index.list_images([root], True)), ["a.jpg", "c.png"])
+            self.assertEqual(self.names(index.list_images([root], True, True)), ["a.jpg", "c.png", "d.gif"])
+            self.assertEqual(self.names(index.list_images([root], True, True, True)),
+                             [".b.png", "a.jpg", "c.png", "d.gif", "e.jpg"])
+
+    def test_entries_store_size_and_mtime(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root = self.make_tree(tmp_dir)
+            entry = FolderIndex(Path(tmp_dir)).list_images([root / "nature" / "deep"])[0]
+            stat = os.stat(entry.path)
+            self.assertEqual((entry.size, entry.mtime_ns), (stat.st_size, stat.st_mtime_ns))
+
+    def test_unchanged_directories_are_not_rescanned(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root = self.make_tree(tmp_dir)
+            self.age_directories(root)
+            index = FolderIndex(Path(tmp_dir))
+            first = index.list_images([root], True, True)
+
+            with patch.object(FolderIndex, "scan_directory", side_effect=AssertionError) as scan_mock:
+                second = index.list_images([root], True, True)
+            scan_mock.assert_not_called()
+            self.assertEqual(first, second)
+
+    def test_changed_directory_is_rescanned(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root = self.make_tree(tmp_dir)
+            self.age_directories(root)
+            index = FolderIndex(Path(tmp_dir))
+            index.list_images([root], True, True)
+
+            (root / "nature" / "new.jpg").write_bytes(b"new")
+            (root / "nature" / "deep" / "d.gif").unlink()
+            (root / "nature" / "deep").rmdir()
+            self.assertEqual(self.names(index.list_images([root], True, True)), ["a.jpg", "c.png", "new.jpg"])
+
+    def test_files_overwritten_in_place_are_revalidated(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root = self.make_tree(tmp_dir)
+            self.age_directories(root)
+            index = FolderIndex(Path(tmp_dir))
+            index.list_images([root])
+            (root / "a.jpg").write_bytes(b"a" * 20)
+            self.age_directories(root)
+
+            self.assertEqual(index.list_images([root])[0].size, 1)
+            self.assertEqual(index.list_images([root], revalidate_files=True)[0].size, 20)
+            self.assertEqual(index.list_images([root])[0].size, 20)
+
+    def test_works_without_cache_dir(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root = self.make_tree(tmp_dir)
+            self.assertEqual(self.names(FolderIndex(None).list_images([root], True)), ["a.jpg", "c.png"])
+
+
+if __name__ == "__main__":
+    unittest.main()
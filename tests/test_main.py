@@ -0,0 +1,66 @@
+import contextlib
+import importlib
+import io
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from waypaper.common import ThumbnailFormat, get_cached_image_path
+
+
+def import_main():
+    """Import the command line module, which reads the config and the arguments on import, in a temporary home"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = {name: tmp_dir for name in ["HOME", "FAKE_HOME", "XDG_CONFIG_HOME", "XDG_CACHE_HOME", "XDG_STATE_HOME"]}
+        with patch.dict(os.environ, env), patch("sys.argv", ["waypaper"]):
+            return importlib.import_module("waypaper.__main__")
+
+
+class BuildCacheTests(unittest.TestCase):
+    def test_caches_missing_thumbnails_and_packs_unpacked_ones(self):
+        main = import_main()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            folder = Path(tmp_dir) / "wallpapers"
+            cache_dir = Path(tmp_dir) / "cache"
+            folder.mkdir()
+            cache_dir.mkdir()
+            for name, data in [("a.jpg", b"a"), ("b.jpg", b"bb"), ("c.jpg", b"ccc"), ("empty.jpg", b"")]:
+                (folder / name).write_bytes(data)
+            paths = {name: str(folder / name) for name in ["a.jpg", "b.jpg", "c.jpg"]}
+            get_cached_image_path(paths["a.jpg"], cache_dir).write_bytes(b"thumbnail")
+            packed_name = get_cached_image_path(paths["c.jpg"], cache_dir).name
+
+            cf = SimpleNamespace(backend="none", image_folder_list=[folder], include_subfolders=False,
+                                 include_all_subfolders=False, show_hidden=False, show_gifs_only=False,
+                                 cache_dir=cache_dir, thumbnail_workers=0, thumbnail_pack=True,
+                                 get_thumbnail_format=ThumbnailFormat)
+            calls = []
+
+            def fake_cache_images(image_paths, cache_dir, workers, thumbnail_format):
+                calls.append((sorted(image_paths), workers))
+                yield from image_paths
+
+            pack = SimpleNamespace(load_index=lambda: {packed_name: None})
+            output = io.StringIO()
+            with patch.object(main, "cf", cf), patch.object(main, "args", SimpleNamespace(jobs=2)), \
+                    patch.object(main, "cache_images", fake_cache_images), \
+                    patch.object(main, "ThumbnailPack", return_value=pack), \
+                    patch.object(main, "pack_thumbnails") as pack_thumbnails, contextlib.redirect_stdout(output):
+                main.build_cache()
+
+        self.assertEqual(calls, [([paths["b.jpg"], paths["c.jpg"]], 2)])
+        lines = output.getvalue().split("\n")
+        self.assertEqual(lines[0], "1 of 3 thumbnails are already cached")
+        self.assertIn("Caching images 2/2", lines[1])
+        self.assertTrue(lines[2].startswith("Cached 2 images in "))
+        self.assertIn("0.0 MB read", lines[2])
+        packed_paths, packed_cache_dir, _ = pack_thumbnails.call_args.args
+        self.assertCountEqual(packed_paths, [paths["a.jpg"], paths["b.jpg"]])
+        self.assertEqual(packed_cache_dir, cache_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from waypaper.randomizer import FenwickTree, SelectionWeights, ShuffleBag, WeightedPicker
+
+
+class ShuffleBagTests(unittest.TestCase):
+    def test_picks_every_wallpaper_once_before_repeating(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bag = ShuffleBag(Path(tmp_dir))
+            paths = [f"/wallpapers/{i}.jpg" for i in range(10)]
+            first_round = [bag.pick(paths) for _ in paths]
+            second_round = [bag.pick(paths) for _ in paths]
+
+        self.assertCountEqual(first_round, paths)
+        self.assertCountEqual(second_round, paths)
+        self.assertNotEqual(first_round[-1], second_round[0])
+
+    def test_pick_only_appends_to_history(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bag = ShuffleBag(Path(tmp_dir))
+            paths = [f"/wallpapers/{i}.jpg" for i in range(1000)]
+            bag.pick(paths)
+            bag_mtime = bag.bag_file.stat().st_mtime_ns
+            history_size = bag.history.log_file.stat().st_size
+            picked = bag.pick(list(reversed(paths)))
+
+            self.assertEqual(bag.bag_file.stat().st_mtime_ns, bag_mtime)
+            self.assertLess(bag.history.log_file.stat().st_size - history_size, 100)
+            self.assertEqual(bag.history.last().path, picked)
+
+    def test_used_wallpapers_are_kept_when_folder_changes(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bag = ShuffleBag(Path(tmp_dir))
+            paths = [f"/wallpapers/{i}.jpg" for i in range(6)]
+            used = [bag.pick(paths) for _ in range(3)]
+
+            new_paths = paths + ["/wallpapers/new.jpg"]
+            rest = [bag.pick(new_paths) for _ in range(4)]
+        self.assertCountEqual(used + rest, new_paths)
+
+    def test_picks_distinct_wallpapers_when_bag_starts_over(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bag = ShuffleBag(Path(tmp_dir))
+            paths = [f"/wallpapers/{i}.jpg" for i in range(5)]
+            bag.pick_many(paths, 3)
+            # Two wallpapers are left in the bag, the other two come from a new permutation:
+            picks = bag.pick_many(paths, 4)
+        self.assertEqual(len(set(picks)), 4)
+
+    def test_partially_written_history_is_ignored(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bag = ShuffleBag(Path(tmp_dir))
+            paths = [f"/wallpapers/{i}.jpg" for i in range(4)]
+            first = bag.pick_many(paths, 2)
+            with bag.history.log_file.open("ab") as file:
+                file.write(b"123.0\tbroken")
+            rest = bag.pick_many(paths, 2)
+        self.assertCountEqual(first + rest, paths)
+
+    def test_history_is_compacted(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bag = ShuffleBag(Path(tmp_dir))
+            paths = [f"/wallpapers/{i}.jpg" for i in range(10)]
+            with patch("waypaper.randomizer.HISTORY_MAX_BYTES", 1000), patch("waypaper.randomizer.HISTORY_KEEP_ENTRIES", 5):
+                picks = [bag.pick(paths) for _ in range(50)]
+            self.assertLessEqual(bag.history.log_file.stat().st_size, 1000)
+            self.assertEqual([entry.path for entry in bag.history.read_tail(3)], picks[-3:])
+
+    def test_empty_folder(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.assertIsNone(ShuffleBag(Path(tmp_dir)).pick([]))
+            self.assertEqual(ShuffleBag(Path(tmp_dir)).pick_many([], 2), [])
+
+
+class FenwickTreeTests(unittest.TestCase):
+    def test_finds_positions_by_prefix_sums(self):
+        tree = FenwickTree([1.0, 0.0, 2.0, 3.0, 0.5])
+        self.assertEqual(tree.total(), 6.5)
+        self.assertEqual([tree.find(value) for value in (0.0, 0.99, 1.0, 2.99, 3.0, 5.99, 6.0, 6.49)],
+                         [0, 0, 2, 2, 3, 3, 4, 4])
+
+    def test_changed_weights_are_never_found(self):
+        tree = FenwickTree([0.1] * 10)
+        for position in range(9):
+            tree.set(position, 0.0)
+        self.assertAlmostEqual(tree.total(), 0.1)
+        self.assertEqual(tree.find(0.0), 9)
+        self.assertEqual(tree.find(0.0999), 9)
+
+
+class WeightedPickerTests(unittest.TestCase):
+    def get_picker(self, cache_dir: Path, aspects: dict[str, float] | None = None, **kwargs) -> WeightedPicker:
+        weights = SelectionWeights(kwargs.pop("folder_weights", {}), kwargs.pop("favorites", frozenset()), **kwargs)
+        return WeightedPicker(cache_dir, weights, aspects)
+
+    def test_zero_folder_weight_excludes_folder(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            picker = self.get_picker(Path(tmp_dir), folder_weights={"/wallpapers/dark": 0.0}, recency_half_life=0)
+            paths = [f"/wallpapers/dark/{i}.jpg" for i in range(5)] + ["/wallpapers/light.jpg"]
+            picks = [picker.pick_many(paths, [None])[0] for _ in range(5)]
+        self.assertEqual(picks, ["/wallpapers/light.jpg"] * 5)
+
+    def test_nested_folder_weight_takes_precedence(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            picker = self.get_picker(Path(tmp_dir), folder_weights={"/wallpapers": 0.0, "/wallpapers/nature/": 1.0})
+        self.assertEqual(picker.get_folder_weight("/wallpapers/nature/a.jpg"), 1.0)
+        self.assertEqual(picker.get_folder_weight("/wallpapers/naturepark/a.jpg"), 0.0)
+        self.assertEqual(picker.get_folder_weight("/elsewhere/a.jpg"), 1.0)
+
+    def test_recently_shown_wallpapers_are_avoided(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            picker = self.get_picker(Path(tmp_dir))
+            paths = [f"/wallpapers/{i}.jpg" for i in range(4)]
+            picks = [picker.pick_many(paths, [None])[0] for _ in range(4)]
+            self.assertCountEqual(picks, paths)
+            self.assertEqual(picker.history.last().path, picks[-1])
+        self.assertEqual(picker.get_weight("/a.jpg", 24 * 3600), 0.5)
+
+    def test_kept_picker_reuses_weights_and_follows_history(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            picker = self.get_picker(Path(tmp_dir))
+            paths = [f"/wallpapers/{i}.jpg" for i in range(3)]
+            first = picker.pick_many(paths, [None])
+            tree = picker.trees[None]
+
+            # Another process picks from the same wallpapers listed in another order:
+            second = self.get_picker(Path(tmp_dir)).pick_many(list(reversed(paths)), [None])
+            third = picker.pick_many(list(reversed(paths)), [None])
+            self.assertIs(picker.trees[None], tree)
+            self.assertCountEqual(first + second + third, paths)
+
+            picker.pick_many(paths + ["/wallpapers/new.jpg"], [None])
+            self.assertEqual(len(picker.trees[None]), 4)
+
+    def test_favorites_and_aspect_fit_change_weights(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            picker = self.get_picker(Path(tmp_dir), favorites=frozenset({"/a.jpg"}), favorite_weight=3.0,
+                                     aspects={"/a.jpg": 16 / 9, "/b.jpg": 9 / 16})
+        self.assertEqual(picker.get_weight("/a.jpg", None), 3.0)
+        self.assertEqual(picker.get_aspect_fit("/a.jpg", 16 / 9), 1.0)
+        self.assertLess(picker.get_aspect_fit("/b.jpg", 16 / 9), 0.5)
+        self.assertEqual(picker.get_aspect_fit("/unknown.jpg", 16 / 9), 1.0)
+
+    def test_picks_distinct_wallpapers_for_monitors(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            picker = self.get_picker(Path(tmp_dir), aspects={"/wide.jpg": 2.0, "/tall.jpg": 0.5}, aspect_fit=20.0)
+            picks = picker.pick_many(["/wide.jpg", "/tall.jpg"], [0.5, 2.0, None])
+        self.assertEqual(picks[:2], ["/tall.jpg", "/wide.jpg"])
+        self.assertEqual(len(picks), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import select
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from waypaper.scheduler import DeadlineTimer, get_aligned_deadline, get_boottime, get_next_deadline
+
+
+class DeadlineTests(unittest.TestCase):
+    def test_next_deadline_does_not_drift(self):
+        self.assertEqual(get_next_deadline(100.0, 60.0, 103.5), (160.0, 0))
+
+    def test_missed_deadlines_are_coalesced(self):
+        # Suspended from before the deadline at 160 until after the one at 280:
+        self.assertEqual(get_next_deadline(100.0, 60.0, 290.0), (340.0, 3))
+
+    def test_aligned_deadline_is_on_wall_clock_boundary(self):
+        local_time = SimpleNamespace(tm_gmtoff=7200)
+        with patch("waypaper.scheduler.time.time", return_value=3600 * 1000 + 600.0), \
+                patch("waypaper.scheduler.time.localtime", return_value=local_time):
+            self.assertEqual(get_aligned_deadline(3600, 50.0), 50.0 + 3000.0)
+            self.assertEqual(get_aligned_deadline(900, 50.0), 50.0 + 300.0)
+
+
+class DeadlineTimerTests(unittest.TestCase):
+    def test_timer_wakes_select_at_deadline(self):
+        timer = DeadlineTimer()
+        try:
+            timer.set(get_boottime() + 0.05)
+            start = time.monotonic()
+            readable, _, _ = select.select([timer] if timer.fileno() >= 0 else [], [], [], timer.get_timeout() or 1)
+            self.assertGreaterEqual(time.monotonic() - start, 0.04)
+            if timer.fileno() >= 0:
+                self.assertEqual(readable, [timer])
+                timer.clear()
+
+            timer.set(None)
+            self.assertEqual(select.select([timer] if timer.fileno() >= 0 else [], [], [], 0.05)[0], [])
+        finally:
+            timer.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
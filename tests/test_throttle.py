@@ -0,0 +1,63 @@
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from waypaper.throttle import ThrottlePolicy, is_on_battery, run_skip_command
+
+
+class ThrottleTests(unittest.TestCase):
+    def make_supply(self, directory: Path, name: str, **values: str) -> None:
+        supply = directory / name
+        supply.mkdir()
+        for key, value in values.items():
+            (supply / key).write_text(value + "\n")
+
+    def test_is_on_battery(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            directory = Path(tmp_dir)
+            self.assertFalse(is_on_battery(directory))
+            self.make_supply(directory, "hidpp_battery_0", type="Battery", scope="Device", status="Discharging")
+            self.assertFalse(is_on_battery(directory))
+            self.make_supply(directory, "BAT0", type="Battery", status="Discharging")
+            self.make_supply(directory, "AC", type="Mains", online="0")
+            self.assertTrue(is_on_battery(directory))
+            (directory / "AC" / "online").write_text("1\n")
+            self.assertFalse(is_on_battery(directory))
+        self.assertFalse(is_on_battery(Path(tmp_dir)))
+
+    def test_skip_command_skips_on_zero_exit_status(self):
+        self.assertTrue(run_skip_command("true"))
+        self.assertFalse(run_skip_command("false"))
+
+    def test_missing_logind_is_not_asked_again(self):
+        policy = ThrottlePolicy()
+        with patch.object(policy, "get_logind_property", side_effect=RuntimeError("no bus")) as get_logind_property:
+            self.assertFalse(policy.is_idle())
+            self.assertFalse(policy.is_idle())
+        get_logind_property.assert_called_once()
+
+    def test_locked_session_is_idle(self):
+        policy = ThrottlePolicy()
+        properties = {"Display": ("2", "/org/freedesktop/login1/session/_32"), "LockedHint": True, "IdleHint": False}
+        with patch.object(policy, "get_logind_property", side_effect=lambda path, interface, name: properties[name]):
+            self.assertTrue(policy.is_idle())
+        self.assertEqual(policy.session_path, "/org/freedesktop/login1/session/_32")
+
+    def test_skip_reason_follows_config(self):
+        policy = ThrottlePolicy()
+        cf = SimpleNamespace(waypaperd_skip_on_battery=False, waypaperd_skip_when_idle=True,
+                             waypaperd_skip_command="true")
+        with patch("waypaper.throttle.is_on_battery", return_value=True), \
+                patch.object(policy, "is_idle", return_value=False):
+            self.assertEqual(policy.get_skip_reason(cf), "command")
+            cf.waypaperd_skip_on_battery = True
+            self.assertEqual(policy.get_skip_reason(cf), "battery")
+            cf.waypaperd_skip_on_battery = False
+            cf.waypaperd_skip_command = ""
+            self.assertIsNone(policy.get_skip_reason(cf))
+
+
+if __name__ == "__main__":
+    unittest.main()
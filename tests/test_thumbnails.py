@@ -0,0 +1,59 @@
+import unittest
+
+from waypaper.thumbnails import ThumbnailMemoryCache
+
+
+class FakePixbuf:
+    def __init__(self, size: int) -> None:
+        self.size = size
+
+    def get_rowstride(self) -> int:
+        return self.size
+
+    def get_height(self) -> int:
+        return 1
+
+
+class ThumbnailMemoryCacheTests(unittest.TestCase):
+    def test_evicts_least_recently_used_thumbnails_over_budget(self):
+        evicted = []
+        cache = ThumbnailMemoryCache(100, evicted.append)
+        cache.put("a", FakePixbuf(40))
+        cache.put("b", FakePixbuf(40))
+        cache.get("a")
+        cache.put("c", FakePixbuf(40))
+
+        self.assertEqual(evicted, ["b"])
+        self.assertIn("a", cache)
+        self.assertIn("c", cache)
+        self.assertEqual(cache.total_bytes, 80)
+
+    def test_peek_does_not_change_eviction_order(self):
+        evicted = []
+        cache = ThumbnailMemoryCache(100, evicted.append)
+        cache.put("a", FakePixbuf(40))
+        cache.put("b", FakePixbuf(40))
+        cache.peek("a")
+        cache.put("c", FakePixbuf(40))
+        self.assertEqual(evicted, ["a"])
+
+    def test_keeps_thumbnail_larger_than_budget(self):
+        cache = ThumbnailMemoryCache(10)
+        cache.put("a", FakePixbuf(5))
+        cache.put("b", FakePixbuf(50))
+        self.assertEqual(len(cache), 1)
+        self.assertIn("b", cache)
+
+    def test_replacing_and_removing_updates_size(self):
+        cache = ThumbnailMemoryCache(100)
+        cache.put("a", FakePixbuf(40))
+        cache.put("a", FakePixbuf(30))
+        self.assertEqual(cache.total_bytes, 30)
+        cache.remove("a")
+        cache.remove("missing")
+        self.assertEqual(cache.total_bytes, 0)
+        self.assertIsNone(cache.get("a"))
+
+
+if __name__ == "__main__":
+    unittest.main()
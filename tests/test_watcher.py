@@ -0,0 +1,108 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from waypaper.watcher import FolderWatcher, InotifyWatcher, PollingWatcher
+
+
+class FolderWatcherTests(unittest.TestCase):
+    def test_watchers_must_implement_run(self):
+        with self.assertRaises(TypeError):
+            FolderWatcher([], lambda *event: None)
+
+
+class PollingWatcherTests(unittest.TestCase):
+    def test_poll_reports_added_removed_and_renamed_files(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root = Path(tmp_dir)
+            (root / "a.jpg").write_bytes(b"a")
+            (root / "b.jpg").write_bytes(b"bb")
+            events = []
+            watcher = PollingWatcher([root], lambda *event: events.append(event))
+            snapshot = watcher.snapshot()
+
+            (root / "a.jpg").rename(root / "renamed.jpg")
+            (root / "b.jpg").unlink()
+            (root / "c.png").write_bytes(b"ccc")
+            watcher.poll(snapshot)
+
+        self.assertCountEqual(events, [
+            ("renamed", str(root / "a.jpg"), str(root / "renamed.jpg")),
+            ("removed", str(root / "b.jpg"), None),
+            ("added", str(root / "c.png"), None),
+        ])
+
+
+    def test_poll_reports_files_overwritten_in_place(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root = Path(tmp_dir) / "wallpapers"
+            root.mkdir()
+            (root / "a.jpg").write_bytes(b"a")
+            os.utime(root, (1_000_000_000, 1_000_000_000))
+            events = []
+            watcher = PollingWatcher([root], lambda *event: events.append(event), cache_dir=Path(tmp_dir))
+            snapshot = watcher.snapshot()
+
+            (root / "a.jpg").write_bytes(b"a" * 20)
+            os.utime(root, (1_000_000_000, 1_000_000_000))
+            # Polls between revalidations only look at the directories:
+            snapshot = watcher.poll(snapshot)
+            self.assertEqual(events, [])
+            watcher.poll(snapshot, revalidate_files=True)
+
+        self.assertEqual(events, [("added", str(root / "a.jpg"), None)])
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "inotify is only available on Linux")
+class InotifyWatcherTests(unittest.TestCase):
+    def wait_for(self, events: list, count: int) -> None:
+        deadline = time.monotonic() + 2
+        while len(events) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_reports_file_changes(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root = Path(tmp_dir)
+            (root / "sub").mkdir()
+            events = []
+            watcher = InotifyWatcher([root], lambda *event: events.append(event), True)
+            watcher.start()
+            try:
+                (root / "sub" / "a.jpg").write_bytes(b"a")
+                os.rename(root / "sub" / "a.jpg", root / "b.jpg")
+                (root / "b.jpg").unlink()
+                self.wait_for(events, 3)
+            finally:
+                watcher.stop()
+            # Removing the temporary directory afterwards must not be part of the result:
+            reported = list(events)
+
+        self.assertEqual(reported, [
+            ("added", str(root / "sub" / "a.jpg"), None),
+            ("renamed", str(root / "sub" / "a.jpg"), str(root / "b.jpg")),
+            ("removed", str(root / "b.jpg"), None),
+        ])
+
+    def test_reports_files_of_new_directory(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, tempfile.TemporaryDirectory() as other_dir:
+            root = Path(tmp_dir)
+            (Path(other_dir) / "folder").mkdir()
+            (Path(other_dir) / "folder" / "a.png").write_bytes(b"a")
+            events = []
+            watcher = InotifyWatcher([root], lambda *event: events.append(event), True)
+            watcher.start()
+            try:
+                os.rename(Path(other_dir) / "folder", root / "folder")
+                self.wait_for(events, 1)
+            finally:
+                watcher.stop()
+            reported = list(events)
+
+        self.assertEqual(reported, [("added", str(root / "folder" / "a.png"), None)])
+
+
+if __name__ == "__main__":
+    unittest.main()
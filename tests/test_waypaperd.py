@@ -1,9 +1,15 @@
 import argparse
-import sys
+import os
+import socket
+import tempfile
+import threading
 import unittest
-from unittest.mock import patch
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
 
 from waypaper import waypaperd
+from waypaper.changer import warm_up_file
 
 
 class WaypaperdTests(unittest.TestCase):
@@ -16,46 +22,287 @@ class WaypaperdTests(unittest.TestCase):
         self.assertEqual(args.interval, 600)
 
     def test_resolve_interval_uses_config_when_no_argument_is_given(self):
-        with patch("waypaper.waypaperd.read_config_interval", return_value=900):
-            self.assertEqual(waypaperd.resolve_interval(None), 900)
+        config = SimpleNamespace(waypaperd_cycle_length=900)
+        self.assertEqual(waypaperd.resolve_interval(None, config), 900)
 
     def test_resolve_interval_prefers_explicit_argument(self):
-        with patch("waypaper.waypaperd.read_config_interval") as read_config_interval:
-            self.assertEqual(waypaperd.resolve_interval(600), 600)
-            read_config_interval.assert_not_called()
+        config = SimpleNamespace(waypaperd_cycle_length=900)
+        self.assertEqual(waypaperd.resolve_interval(600, config), 600)
 
-    def test_read_config_interval_uses_waypaper_config(self):
-        with patch("waypaper.waypaperd.Config") as config_class:
-            config = config_class.return_value
-            config.waypaperd_cycle_length = 1200
+    def test_config_is_read_again_only_when_modified(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config = MagicMock()
+            config.config_file = Path(tmp_dir) / "config.ini"
+            config.state_file = Path(tmp_dir) / "state.ini"
+            config.config_file.write_text("[Settings]\n")
+            reloader = waypaperd.ConfigReloader(config)
 
-            self.assertEqual(waypaperd.read_config_interval(), 1200)
+            self.assertIs(reloader.load(), config)
+            reloader.load()
             config.read.assert_called_once_with()
             config.check_validity.assert_called_once_with()
 
+            os.utime(config.config_file, ns=(1, 1))
+            reloader.load()
+            self.assertEqual(config.read.call_count, 2)
+
+            # Wallpapers saved by the daemon itself do not count as a modification:
+            config.use_xdg_state = False
+            config.save.side_effect = lambda: os.utime(config.config_file, ns=(2, 2))
+            reloader.save()
+            reloader.load()
+            self.assertEqual(config.read.call_count, 2)
+
     def test_positive_interval_rejects_non_positive_values(self):
         with self.assertRaises(argparse.ArgumentTypeError):
             waypaperd.positive_interval("0")
 
-    def test_build_waypaper_command_uses_current_python(self):
-        self.assertEqual(
-            waypaperd.build_waypaper_command(),
-            [sys.executable, "-m", "waypaper", "--random"],
-        )
+    def test_trigger_random_wallpaper_changes_all_monitors_in_process(self):
+        config = SimpleNamespace(backend="swaybg", image_folder_list=[Path("/wallpapers")], include_subfolders=False,
+                                 include_all_subfolders=False, cache_dir=Path("/cache"), show_hidden=False,
+                                 monitors=["DP-1", "DP-2"], wallpapers=[Path("/old.jpg")],
+                                 get_selection_weights=lambda: None)
+        reloader = MagicMock()
+        reloader.load.return_value = config
+        with patch("waypaper.waypaperd.get_random_files", return_value=["/a.jpg", "/b.jpg"]) as get_random_files, \
+                patch("waypaper.waypaperd.change_wallpaper") as change_wallpaper:
+            self.assertTrue(waypaperd.trigger_random_wallpaper(reloader))
+
+        self.assertEqual(get_random_files.call_args.kwargs["count"], 2)
+        change_wallpaper.assert_any_call(Path("/a.jpg"), config, "DP-1")
+        change_wallpaper.assert_any_call(Path("/b.jpg"), config, "DP-2")
+        self.assertEqual(config.wallpapers, [Path("/a.jpg"), Path("/b.jpg")])
+        reloader.save.assert_called_once_with()
+
+    def test_trigger_random_wallpaper_without_wallpapers(self):
+        reloader = MagicMock()
+        reloader.load.return_value.monitors = ["All"]
+        with patch("waypaper.waypaperd.get_random_files", return_value=[]), \
+                patch("waypaper.waypaperd.change_wallpaper") as change_wallpaper:
+            self.assertFalse(waypaperd.trigger_random_wallpaper(reloader))
+        change_wallpaper.assert_not_called()
+        reloader.save.assert_not_called()
+
+    def test_prefetched_wallpapers_are_used_until_config_changes(self):
+        config = SimpleNamespace(monitors=["All"], wallpapers=[])
+        reloader = MagicMock(generation=1)
+        reloader.load.return_value = config
+        with tempfile.NamedTemporaryFile() as image, \
+                patch("waypaper.waypaperd.pick_random_wallpapers", return_value=["/picked.jpg"]), \
+                patch("waypaper.waypaperd.change_wallpaper") as change_wallpaper:
+            waypaperd.trigger_random_wallpaper(reloader, waypaperd.Prefetched(1, [image.name]))
+            change_wallpaper.assert_called_with(Path(image.name), config, "All")
+
+            waypaperd.trigger_random_wallpaper(reloader, waypaperd.Prefetched(0, [image.name]))
+            change_wallpaper.assert_called_with(Path("/picked.jpg"), config, "All")
+
+    def test_prefetch_reads_wallpapers_in_background(self):
+        reloader = MagicMock(generation=3)
+        with patch("waypaper.waypaperd.pick_random_wallpapers", return_value=["/a.jpg"]), \
+                patch("waypaper.waypaperd.preload_wallpaper") as preload_wallpaper:
+            prefetched = waypaperd.prefetch_random_wallpapers(reloader)
+            for thread in threading.enumerate():
+                if thread is not threading.current_thread() and thread.daemon:
+                    thread.join(1)
+        self.assertEqual(prefetched, waypaperd.Prefetched(3, ["/a.jpg"]))
+        preload_wallpaper.assert_called_once_with(Path("/a.jpg"), reloader.load.return_value)
 
-    def test_trigger_random_wallpaper_returns_subprocess_code(self):
-        with patch("waypaper.waypaperd.subprocess.run") as run_mock:
-            run_mock.return_value.returncode = 7
-            self.assertEqual(waypaperd.trigger_random_wallpaper(["waypaper"]), 7)
-            run_mock.assert_called_once_with(["waypaper"], check=False)
+    def test_warm_up_reads_file_up_to_limit(self):
+        with tempfile.NamedTemporaryFile() as image:
+            image.write(b"x" * 3000)
+            image.flush()
+            self.assertEqual(warm_up_file(Path(image.name)), 3000)
+            self.assertEqual(warm_up_file(Path(image.name), max_bytes=100), 100)
+        self.assertEqual(warm_up_file(Path("/nonexistent/image.jpg")), 0)
 
     def test_main_exits_cleanly_on_keyboard_interrupt(self):
-        with patch("waypaper.waypaperd.resolve_interval", return_value=60), patch(
-            "waypaper.waypaperd.trigger_random_wallpaper", return_value=0
-        ), patch(
-            "waypaper.waypaperd.time.sleep", side_effect=KeyboardInterrupt
-        ):
+        with tempfile.TemporaryDirectory() as tmp_dir, patch("waypaper.waypaperd.ConfigReloader") as reloader_class, \
+                patch("waypaper.waypaperd.resolve_interval", return_value=60), \
+                patch("waypaper.waypaperd.ThrottlePolicy.get_skip_reason", return_value=None), \
+                patch("waypaper.waypaperd.trigger_random_wallpaper", return_value=True) as trigger_random_wallpaper, \
+                patch("waypaper.waypaperd.select.select", side_effect=[([], [], []), KeyboardInterrupt]):
+            socket_path = Path(tmp_dir) / "waypaperd.sock"
+            reloader_class.return_value.load.return_value.control_socket = socket_path
             self.assertEqual(waypaperd.main([]), 0)
+            trigger_random_wallpaper.assert_called_once()
+            self.assertFalse(socket_path.exists())
+
+    def test_main_refuses_to_start_twice(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, patch("waypaper.waypaperd.ConfigReloader") as reloader_class, \
+                patch("waypaper.waypaperd.trigger_random_wallpaper") as trigger_random_wallpaper:
+            socket_path = Path(tmp_dir) / "waypaperd.sock"
+            reloader_class.return_value.load.return_value.control_socket = socket_path
+            lock_fd = waypaperd.lock_daemon(socket_path)
+            try:
+                self.assertEqual(waypaperd.main([]), 1)
+            finally:
+                os.close(lock_fd)
+        trigger_random_wallpaper.assert_not_called()
+
+    def test_busy_daemon_is_still_running(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            socket_path = Path(tmp_dir) / "waypaperd.sock"
+            self.assertIsNone(waypaperd.send_command(socket_path, "status", timeout=0.1))
+            # A daemon that is busy accepts connections but does not read them:
+            busy_server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            busy_server.bind(str(socket_path))
+            busy_server.listen()
+            try:
+                self.assertTrue(waypaperd.is_daemon_running(socket_path))
+                self.assertFalse(waypaperd.send_command(socket_path, "status", timeout=0.1)["ok"])
+                self.assertIsNone(waypaperd.open_control_socket(socket_path))
+                self.assertTrue(socket_path.exists())
+            finally:
+                busy_server.close()
+
+
+class SlideshowTests(unittest.TestCase):
+    def get_slideshow(self, interval: int | None = 600, monitors: list[str] | None = None,
+                      monitor_intervals: dict[str, int] | None = None, start: bool = True) -> waypaperd.Slideshow:
+        monitors = monitors or ["All"]
+        reloader = MagicMock(generation=1)
+        reloader.load.return_value = SimpleNamespace(
+            monitors=monitors, wallpapers=[Path(f"/{monitor}.jpg") for monitor in monitors],
+            waypaperd_cycle_length=1800, waypaperd_align_to_clock=False,
+            waypaperd_monitor_intervals=monitor_intervals or {}, waypaperd_skip_on_battery=True,
+            waypaperd_skip_when_idle=False, waypaperd_skip_command="")
+        slideshow = waypaperd.Slideshow(reloader, interval)
+        if start:
+            for schedule in slideshow.schedules:
+                slideshow.restart_timer(schedule)
+        return slideshow
+
+    def test_pause_and_resume_keep_remaining_time(self):
+        slideshow = self.get_slideshow()
+        schedule = slideshow.schedules[0]
+        status = slideshow.handle({"command": "pause"})
+        self.assertTrue(status["paused"])
+        self.assertIsNone(slideshow.get_next_event())
+        self.assertIsNone(status["next_change_at"])
+        self.assertAlmostEqual(status["next_change"], 600, delta=1)
+
+        slideshow.pause_time -= 100
+        status = slideshow.handle({"command": "resume"})
+        self.assertFalse(status["paused"])
+        self.assertAlmostEqual(schedule.deadline - waypaperd.get_boottime(), 700, delta=1)
+
+    def test_set_interval_moves_deadline_without_restart(self):
+        slideshow = self.get_slideshow()
+        schedule = slideshow.schedules[0]
+        schedule.last_change = waypaperd.get_boottime() - 50
+        status = slideshow.handle({"command": "set-interval", "interval": 60})
+        self.assertEqual(status["interval"], 60)
+        self.assertAlmostEqual(schedule.deadline - waypaperd.get_boottime(), 10, delta=1)
+        self.assertFalse(slideshow.handle({"command": "set-interval", "interval": 0})["ok"])
+
+    def test_next_and_previous_change_after_responding(self):
+        slideshow = self.get_slideshow()
+        with patch("waypaper.waypaperd.trigger_random_wallpaper", return_value=True) as trigger_random_wallpaper, \
+                patch("waypaper.waypaperd.set_wallpapers") as set_wallpapers:
+            self.assertFalse(slideshow.handle({"command": "previous"})["ok"])
+            self.assertTrue(slideshow.handle({"command": "next"})["ok"])
+            trigger_random_wallpaper.assert_not_called()
+            slideshow.on_timer()
+            trigger_random_wallpaper.assert_called_once()
+
+            self.assertTrue(slideshow.handle({"command": "previous"})["ok"])
+            self.assertLessEqual(slideshow.get_next_event(), waypaperd.get_boottime())
+            slideshow.on_timer()
+            set_wallpapers.assert_called_once_with(slideshow.reloader, [Path("/All.jpg")], ["All"])
+
+    def test_changes_missed_during_suspend_happen_once(self):
+        slideshow = self.get_slideshow(interval=60)
+        schedule = slideshow.schedules[0]
+        schedule.deadline -= 200
+        slideshow.push(schedule)
+        with patch("waypaper.waypaperd.trigger_random_wallpaper", return_value=True) as trigger_random_wallpaper, \
+                patch("waypaper.waypaperd.prefetch_random_wallpapers"):
+            slideshow.on_timer()
+            slideshow.on_timer()
+        trigger_random_wallpaper.assert_called_once()
+        self.assertEqual(schedule.missed_changes, 2)
+        self.assertEqual(slideshow.get_status()["missed_changes"], 2)
+        self.assertGreater(schedule.deadline, waypaperd.get_boottime())
+
+    def test_monitors_without_own_interval_change_together(self):
+        slideshow = self.get_slideshow(monitors=["DP-1", "DP-2"])
+        self.assertEqual([schedule.monitors for schedule in slideshow.schedules], [["DP-1", "DP-2"]])
+
+    def test_monitors_with_own_intervals_have_independent_timers(self):
+        slideshow = self.get_slideshow(interval=None, monitors=["DP-1", "DP-2", "HDMI-1"],
+                                       monitor_intervals={"DP-1": 60, "HDMI-1": 300})
+        self.assertEqual([(schedule.monitors, schedule.interval) for schedule in slideshow.schedules],
+                         [(["DP-1"], 60), (["DP-2"], 1800), (["HDMI-1"], 300)])
+        fast, slow, _ = slideshow.schedules
+        fast.deadline = slow.deadline = waypaperd.get_boottime() - 1
+        slideshow.push(fast)
+        slideshow.push(slow)
+
+        with patch("waypaper.waypaperd.trigger_random_wallpaper", return_value=True) as trigger_random_wallpaper:
+            slideshow.on_timer()
+        self.assertEqual([call.args[2] for call in trigger_random_wallpaper.call_args_list], [["DP-1"], ["DP-2"]])
+        self.assertEqual(len(slideshow.get_status()["schedules"]), 3)
+
+        status = slideshow.handle({"command": "set-interval", "interval": 90, "monitor": "HDMI-1"})
+        self.assertEqual([schedule["interval"] for schedule in status["schedules"]], [60, 1800, 90])
+        self.assertFalse(slideshow.handle({"command": "next", "monitor": "eDP-1"})["ok"])
+
+    def test_interval_of_all_monitors_keeps_own_intervals(self):
+        slideshow = self.get_slideshow(interval=None, monitors=["DP-1", "HDMI-A-1", "eDP-1"],
+                                       monitor_intervals={"DP-1": 600, "HDMI-A-1": 3600})
+        slideshow.handle({"command": "set-interval", "interval": 90, "monitor": "DP-1"})
+        status = slideshow.handle({"command": "set-interval", "interval": 900})
+        self.assertEqual([schedule["interval"] for schedule in status["schedules"]], [90, 3600, 900])
+        self.assertEqual([schedule.fixed for schedule in slideshow.schedules], [True, False, False])
+
+    def test_unknown_command(self):
+        self.assertFalse(self.get_slideshow().handle({"command": "dance"})["ok"])
+
+    def test_commands_are_served_over_socket(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            socket_path = Path(tmp_dir) / "waypaperd.sock"
+            server = waypaperd.open_control_socket(socket_path)
+            slideshow = self.get_slideshow()
+            thread = threading.Thread(target=slideshow.serve, args=(server,))
+            thread.start()
+            try:
+                self.assertIsNone(waypaperd.open_control_socket(socket_path))
+                status = waypaperd.send_command(socket_path, "status")
+                self.assertEqual(status["interval"], 600)
+                self.assertEqual(status["wallpapers"], ["/All.jpg"])
+                self.assertFalse(waypaperd.send_command(socket_path, "stop")["running"])
+            finally:
+                slideshow.running = False
+                waypaperd.send_command(socket_path, "status", timeout=0.1)
+                thread.join(5)
+                server.close()
+            self.assertIsNone(waypaperd.send_command(socket_path, "status"))
+
+    def test_throttled_changes_are_skipped_and_counted(self):
+        slideshow = self.get_slideshow(interval=60)
+        schedule = slideshow.schedules[0]
+        deadline = schedule.deadline
+        with patch("waypaper.waypaperd.trigger_random_wallpaper", return_value=True) as trigger_random_wallpaper, \
+                patch("waypaper.waypaperd.prefetch_random_wallpapers") as prefetch_random_wallpapers, \
+                patch("waypaper.throttle.is_on_battery", return_value=True):
+            schedule.deadline = waypaperd.get_boottime() + 5
+            slideshow.push(schedule)
+            slideshow.on_timer()
+            prefetch_random_wallpapers.assert_not_called()
+            self.assertEqual(slideshow.get_next_event(), schedule.deadline)
+
+            schedule.deadline = deadline = waypaperd.get_boottime() - 1
+            slideshow.push(schedule)
+            slideshow.on_timer()
+            trigger_random_wallpaper.assert_not_called()
+            self.assertEqual(schedule.deadline, deadline + 60)
+            self.assertEqual(slideshow.get_status()["skipped_changes"], {"battery": 1, "idle": 0, "command": 0})
+
+            # Changes requested by the user are never skipped:
+            slideshow.handle({"command": "next"})
+            slideshow.on_timer()
+            trigger_random_wallpaper.assert_called_once()
+            self.assertEqual(slideshow.get_status()["skipped_changes"]["battery"], 1)
 
 
 if __name__ == "__main__":
@@ -10,12 +10,15 @@ import json
 import pathlib
 import threading
 
-from waypaper.app import App
 from waypaper.changer import change_wallpaper
-from waypaper.common import get_random_file
+from waypaper.common import get_random_file, get_random_files, collect_cache_garbage, get_image_entries, get_wallpaperengine_preview, \
+    get_cached_image_path, cache_images, pack_thumbnails
+from waypaper.cache import ThumbnailPack
+from waypaper.index import IndexEntry
 from waypaper.config import Config
 from waypaper.options import BACKEND_OPTIONS, FILL_OPTIONS, get_monitor_options
 from waypaper.translations import load_language
+from waypaper.waypaperd import CONTROL_COMMANDS, is_daemon_running, send_command
 
 
 __version__ = "2.8"
@@ -40,11 +43,57 @@ parser.add_argument("--state-file", help=txt.msg_arg_statefile)
 parser.add_argument("--config-file", help=txt.msg_arg_configfile)
 parser.add_argument("--backend", help=txt.msg_arg_back, choices=BACKEND_OPTIONS)
 parser.add_argument("--list", help=txt.msg_arg_list, action='store_true')
-parser.add_argument("--monitor", help=txt.msg_arg_monitor, choices=get_monitor_options(cf.backend))
+parser.add_argument("--monitor", help=txt.msg_arg_monitor)
 parser.add_argument("--no-post-command", help=txt.msg_arg_post, action='store_true')
+parser.add_argument("--gc-cache", help=txt.msg_arg_gc_cache, action='store_true')
+parser.add_argument("--build-cache", help=txt.msg_arg_build_cache, action='store_true')
+parser.add_argument("--jobs", help=txt.msg_arg_jobs, type=int, default=0)
+parser.add_argument("--slideshow", help=txt.msg_arg_slideshow,
+                    choices=[command for command in CONTROL_COMMANDS if command != "set-interval"])
+parser.add_argument("--slideshow-interval", help=txt.msg_arg_slideshow_interval, type=int)
 args = parser.parse_args()
 
 
+def build_cache() -> None:
+    """Create missing thumbnails of the wallpaper folders and report the throughput"""
+    if cf.backend == "linux-wallpaperengine":
+        image_entries = []
+        for path in get_wallpaperengine_preview(cf.wallpaperengine_folder):
+            stat = os.stat(path)
+            image_entries.append(IndexEntry(path, stat.st_size, stat.st_mtime_ns))
+    else:
+        image_entries = get_image_entries(cf.backend, cf.image_folder_list, cf.include_subfolders,
+                                          cf.include_all_subfolders, cf.show_hidden, cf.show_gifs_only, cf.cache_dir,
+                                          revalidate_files=True)
+
+    thumbnail_format = cf.get_thumbnail_format()
+
+    # Zero byte files have no thumbnail, and only images without a thumbnail for their current version are processed:
+    image_entries = [entry for entry in image_entries if entry.size > 0]
+    uncached_sizes = {entry.path: entry.size for entry in image_entries if
+                      not get_cached_image_path(entry.path, cf.cache_dir, entry.size, entry.mtime_ns, thumbnail_format).exists()}
+    total = len(uncached_sizes)
+    print(f"{len(image_entries) - total} of {len(image_entries)} thumbnails are already cached")
+    if total:
+        start_time = time.monotonic()
+        bytes_read = 0
+        for number, image_path in enumerate(cache_images(list(uncached_sizes), cf.cache_dir, args.jobs or cf.thumbnail_workers,
+                                                             thumbnail_format), start=1):
+            bytes_read += uncached_sizes[image_path]
+            print(f"\rCaching images {number}/{total}", end="", flush=True)
+        elapsed = max(time.monotonic() - start_time, 1e-6)
+        print(f"\nCached {total} images in {elapsed:.1f} s: {total / elapsed:.1f} images/s, "
+              f"{bytes_read / 1024 / 1024:.1f} MB read ({bytes_read / 1024 / 1024 / elapsed:.1f} MB/s)")
+
+    # Add all thumbnails that are not packed yet, including those cached before the pack was enabled:
+    if cf.thumbnail_pack:
+        pack_index = ThumbnailPack(cf.cache_dir).load_index()
+        pack_thumbnails([entry.path for entry in image_entries if
+                         get_cached_image_path(entry.path, cf.cache_dir, entry.size, entry.mtime_ns,
+                                               thumbnail_format).name not in pack_index],
+                        cf.cache_dir, thumbnail_format)
+
+
 def run():
     """Read user arguments and either run GUI app or perform requested action"""
 
@@ -57,6 +106,26 @@ def run():
     cf.read_parameters_from_user_arguments(args)
     cf.check_validity()
 
+    # Monitors are only listed when one is requested, since that asks the compositor or runs a tool:
+    if args.monitor:
+        monitor_options = get_monitor_options(cf.backend)
+        if args.monitor not in monitor_options:
+            parser.error(f"argument --monitor: invalid choice: '{args.monitor}' (choose from {', '.join(monitor_options)})")
+
+    # Control the running slideshow daemon, optionally only the timer of the given monitor, and quit:
+    if args.slideshow or args.slideshow_interval:
+        response = None
+        if args.slideshow_interval:
+            response = send_command(cf.control_socket, "set-interval", interval=args.slideshow_interval,
+                                    monitor=args.monitor)
+        if args.slideshow and (response is None or response.get("ok")):
+            response = send_command(cf.control_socket, args.slideshow, monitor=args.monitor)
+        if response is None:
+            print("The slideshow daemon is not running.")
+            sys.exit(1)
+        print(json.dumps(response))
+        sys.exit(0 if response.get("ok") else 1)
+
     # Set monitor and wallpaper from user arguments:
     if args.monitor:
         monitor = args.monitor
@@ -68,7 +137,8 @@ def run():
         # Otherwise set a random wallpaper:
         else:
             wallpaper_str = get_random_file(cf.backend, cf.image_folder_list, cf.include_subfolders,
-                                            cf.include_all_subfolders, cf.cache_dir, cf.show_hidden)
+                                            cf.include_all_subfolders, cf.cache_dir, cf.show_hidden,
+                                            cf.get_selection_weights(), monitor)
             if wallpaper_str:
                 wallpaper = pathlib.Path(wallpaper_str)
             else:
@@ -91,13 +161,18 @@ def run():
 
     # Set previous wallpapers or random wallpaper:
     if args.restore or args.random:
+        # Pick distinct wallpapers for all monitors at once, so that the folders are listed only once:
+        random_wallpapers = []
+        if args.random:
+            random_wallpapers = get_random_files(cf.backend, cf.image_folder_list, cf.include_subfolders,
+                                                 cf.include_all_subfolders, cf.cache_dir, cf.show_hidden,
+                                                 count=len(cf.monitors), weights=cf.get_selection_weights(),
+                                                 monitors=cf.monitors)
+
         for index, (wallpaper, monitor) in enumerate(zip(cf.wallpapers, cf.monitors)):
-            if args.random:
-                wallpaper_str = get_random_file(cf.backend, cf.image_folder_list, cf.include_subfolders,
-                                                cf.include_all_subfolders, cf.cache_dir, cf.show_hidden)
-                if wallpaper_str:
-                    wallpaper = pathlib.Path(wallpaper_str)
-                    cf.wallpapers[index] = wallpaper
+            if index < len(random_wallpapers):
+                wallpaper = pathlib.Path(random_wallpapers[index])
+                cf.wallpapers[index] = wallpaper
 
             if cf.wallpapers[index] is None:
                 continue
@@ -112,8 +187,8 @@ def run():
         else:
             cf.save()
 
-        # On restore, restart the daemon if slideshow was enabled:
-        if args.restore and cf.slideshow_enabled:
+        # On restore, start the daemon if slideshow was enabled and it is not running yet:
+        if args.restore and cf.slideshow_enabled and not is_daemon_running(cf.control_socket):
             try:
                 subprocess.Popen(["waypaperd", str(cf.slideshow_interval * 60)])
             except FileNotFoundError:
@@ -143,12 +218,25 @@ def run():
         print(json.dumps(info))
         sys.exit(0)
 
+    # Create thumbnails without the GUI and quit:
+    if args.build_cache:
+        build_cache()
+        sys.exit(0)
+
+    # Clean up the thumbnail cache and quit:
+    if args.gc_cache:
+        result = collect_cache_garbage(cf.cache_dir, cf.cache_max_size, cf.cache_max_entries, cf.get_thumbnail_format())
+        print(f"Removed {result.removed} thumbnails ({result.freed_bytes / 1024 / 1024:.1f} MB), "
+              f"kept {result.kept} thumbnails ({result.kept_bytes / 1024 / 1024:.1f} MB)")
+        sys.exit(0)
+
     # Print the version and quit:
     if args.version:
         print(f"waypaper v.{__version__}")
         sys.exit(0)
 
-    # Start GUI:
+    # Start GUI, loading GTK only now:
+    from waypaper.app import App
     app = App(txt, cf)
     # Reload the stylesheet when SIGUSR1 is received (e.g. after a theme change):
     if hasattr(signal, 'SIGUSR1'):
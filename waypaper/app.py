@@ -2,25 +2,38 @@
 
 import threading
 import subprocess
+import time
 import sys
 import os
 import gi
 import random
-import shutil
-import imageio
 from pathlib import Path
 
+from waypaper.cache import PackRecord, ThumbnailCache, ThumbnailPack
 from waypaper.changer import change_wallpaper
 from waypaper.config import Config
-from waypaper.common import get_image_paths, get_wallpaperengine_preview, get_image_name, get_random_file, cache_image, get_cached_image_path, get_wallpaperengine_image_name
-from waypaper.options import FILL_OPTIONS, SORT_OPTIONS, SORT_DISPLAYS, VIDEO_EXTENSIONS, SWWW_TRANSITION_TYPES, SWWW_FILTER_TYPES, \
+from waypaper.index import IndexEntry
+from waypaper.common import get_image_entries, get_wallpaperengine_preview, get_image_name, get_random_file, cache_image, cache_images, get_cached_image_path, get_wallpaperengine_image_name, \
+    has_image_extension, record_cached_images, collect_cache_garbage, pack_thumbnails, load_packed_thumbnail, \
+    load_thumbnail_file
+from waypaper.options import FILL_OPTIONS, SORT_OPTIONS, SORT_DISPLAYS, SWWW_TRANSITION_TYPES, SWWW_FILTER_TYPES, \
     get_monitor_options, LINUX_WALLPAPERENGINE_FILL_OPTIONS, LINUX_WALLPAPERENGINE_CLAMP
 from waypaper.translations import Chinese, English, French, German, Polish, Russian, Belarusian, Spanish
 from waypaper.keybindings import Keys
+from waypaper.thumbnails import ThumbnailMemoryCache
+from waypaper.watcher import FolderWatcher, create_watcher
+from waypaper.waypaperd import is_daemon_running, send_command
 
 gi.require_version("Gtk", "3.0")
 from gi.repository import Gtk, GdkPixbuf, Gdk, GLib
 
+# Thumbnails are added to the grid in batches of this size, or after this many seconds:
+THUMBNAIL_BATCH_SIZE = 50
+THUMBNAIL_BATCH_INTERVAL = 0.1
+
+# Thumbnails are loaded for visible rows and this many rows around them, a few per main loop iteration:
+THUMBNAIL_PRELOAD_ROWS = 2
+THUMBNAIL_LOADS_PER_ITERATION = 8
 
 class App(Gtk.Window):
     """Main application class that controls GUI"""
@@ -36,8 +49,26 @@ class App(Gtk.Window):
         self.selected_index = 0
         self.caching_images_lock: threading.Lock = threading.Lock()
         self.loading_label: Gtk.Label | None = None
-        self.thumbnails: list[GdkPixbuf.Pixbuf] = []
         self.image_names: list[str] = []
+        self.grid_iters: dict[str, Gtk.TreeIter] = {}
+        self.processing_generation = 0
+        self.ready_thumbnails: set[str] = set()
+        # Thumbnail paths of the images, found once while processing them, so that loading does not stat the images:
+        self.cached_image_paths: dict[str, Path] = {}
+        self.pending_thumbnails: list[str] = []
+        self.last_thumbnails_flush = 0.0
+        self.thumbnails_to_load: list[str] = []
+        self.is_loading_thumbnails = False
+        self.thumbnail_cache = ThumbnailMemoryCache(self.cf.thumbnail_memory_limit * 1024 * 1024,
+                                                    self.on_thumbnail_evicted)
+        self.thumbnail_pack = ThumbnailPack(self.cf.cache_dir)
+        self.pack_index: dict[str, PackRecord] = {}
+        self.placeholder = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8, 240, 135)
+        self.placeholder.fill(0x80808040)
+        self.watcher: FolderWatcher | None = None
+        # Changes of the folders that arrive while images are processed, applied to the new listing afterwards:
+        self.folder_events_lock = threading.Lock()
+        self.queued_folder_events: list[tuple[str, str, str | None]] | None = None
         self.highlighted_image_row = 0
         self.is_enering_text = False
         self.number_of_resize = 0
@@ -145,18 +176,30 @@ class App(Gtk.Window):
         self.scrolled_window = Gtk.ScrolledWindow()
         self.scrolled_window.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
 
-        # Create a box to center the grid:
-        self.center_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
-        self.center_box.set_valign(Gtk.Align.CENTER)
-        self.center_box.set_halign(Gtk.Align.CENTER)
         self.main_box.add(self.scrolled_window)
 
-        # Create a grid layout for images:
-        self.grid = Gtk.Grid()
+        # Create an icon view for images. It only draws the visible ones, instead of a widget per image.
+        # The model stores thumbnail, tooltip markup and path:
+        self.image_store = Gtk.ListStore(GdkPixbuf.Pixbuf, str, str)
+        self.grid = Gtk.IconView.new_with_model(self.image_store)
+        self.grid.set_pixbuf_column(0)
+        self.grid.set_tooltip_column(1)
+        self.grid.set_columns(self.cf.number_of_columns)
+        self.grid.set_item_width(240)
+        self.grid.set_item_padding(5)
+        self.grid.set_margin(0)
         self.grid.set_row_spacing(0)
         self.grid.set_column_spacing(0)
-        self.center_box.add(self.grid)
-        self.scrolled_window.add(self.center_box)
+        self.grid.set_halign(Gtk.Align.CENTER)
+        self.grid.set_can_focus(False)
+        self.grid.set_selection_mode(Gtk.SelectionMode.SINGLE)
+        self.grid.set_activate_on_single_click(True)
+        self.grid.connect("item-activated", self.on_image_clicked)
+        self.scrolled_window.add(self.grid)
+
+        # Load thumbnails when they scroll into view or when the layout changes:
+        self.scrolled_window.get_vadjustment().connect("value-changed", self.on_grid_scrolled)
+        self.scrolled_window.get_vadjustment().connect("changed", self.on_grid_scrolled)
 
         # BACKEND MENU
 
@@ -695,6 +738,10 @@ class App(Gtk.Window):
         self.bottom_loading_box.add(self.loading_label)
         self.bottom_loading_box.show_all()
         
+    def update_caching_label(self, number: int, total: int) -> None:
+        if self.loading_label:
+            self.loading_label.set_text(f"{self.txt.msg_caching} {number}/{total}")
+
     def remove_caching_label(self) -> None:
         if not self.loading_label:
             return
@@ -714,132 +761,411 @@ class App(Gtk.Window):
             GLib.idle_add(self.refresh_button.set_sensitive, False)
             # Show caching label:
             GLib.idle_add(self.show_caching_label)
-            
+
+            # Follow the folders before listing them, so that no change is missed while the images are processed:
+            with self.folder_events_lock:
+                self.queued_folder_events = []
+            self.start_watcher()
+
             try:
                 self.process_images_inner()
             finally:
                 GLib.idle_add(self.refresh_button.set_sensitive, True)
-                # When image processing is done, remove caching label and display the images:
+                # When image processing is done, remove caching label:
                 GLib.idle_add(self.remove_caching_label)
-                GLib.idle_add(self.load_image_grid)
+                # Afterwards, apply the changes that happened meanwhile to the new listing image by image:
+                self.replay_folder_events()
         
     def process_images_inner(self) -> None:
         if self.cf.backend == "linux-wallpaperengine":
-            self.image_paths = get_wallpaperengine_preview(self.cf.wallpaperengine_folder)
+            image_entries = []
+            for path in get_wallpaperengine_preview(self.cf.wallpaperengine_folder):
+                stat = os.stat(path)
+                image_entries.append(IndexEntry(path, stat.st_size, stat.st_mtime_ns))
         else:
-            self.image_paths = get_image_paths(self.cf.backend, self.cf.image_folder_list, self.cf.include_subfolders,
-                                      self.cf.include_all_subfolders, self.cf.show_hidden, self.cf.show_gifs_only)
+            # Images overwritten in place need their current size and mtime to find their thumbnails:
+            image_entries = get_image_entries(self.cf.backend, self.cf.image_folder_list, self.cf.include_subfolders,
+                                              self.cf.include_all_subfolders, self.cf.show_hidden,
+                                              self.cf.show_gifs_only, self.cf.cache_dir, revalidate_files=True)
+
+        # Skip zero byte files:
+        image_entries = [entry for entry in image_entries if entry.size > 0]
 
         # Sort paths:
         if self.cf.sort_option in ["name", "namerev"]:
-            self.image_paths.sort(reverse=(self.cf.sort_option == "namerev"))
+            image_entries.sort(key=lambda x: x.path, reverse=(self.cf.sort_option == "namerev"))
         if self.cf.sort_option in ["date", "daterev"]:
-            self.image_paths.sort(key=lambda x: os.path.getmtime(x), reverse=(self.cf.sort_option == "daterev"))
+            image_entries.sort(key=lambda x: x.mtime_ns, reverse=(self.cf.sort_option == "daterev"))
         if self.cf.sort_option == "random":
-            random.shuffle(self.image_paths)
-
-        self.thumbnails = []
-        self.image_names = []
+            random.shuffle(image_entries)
+
+        # Get image names, which may or may not include parent folders:
+        image_paths: list[str] = []
+        image_names: list[str] = []
+        uncached_paths: list[str] = []
+        ready_thumbnails: set[str] = set()
+        cached_image_paths: list[Path] = []
+        thumbnail_paths: dict[str, Path] = {}
+        unpacked_paths: list[str] = []
+        pack_index = ThumbnailPack(self.cf.cache_dir).load_index() if self.cf.thumbnail_pack else {}
+        thumbnail_format = self.cf.get_thumbnail_format()
+        for entry in image_entries:
+            if self.cf.backend == 'linux-wallpaperengine':
+                image_name = get_wallpaperengine_image_name(entry.path)
+            else:
+                image_name = get_image_name(entry.path, self.cf.image_folder_list, self.cf.show_path_in_tooltip)
+            if not image_name:
+                print("Failed to get image name")
+                continue
+            image_paths.append(entry.path)
+            image_names.append(image_name)
+
+            # Thumbnails that are cached for the current version of the file can be shown as soon as they are visible.
+            # Packed thumbnails are found in the pack index without looking at the files:
+            cached_image_path = get_cached_image_path(entry.path, self.cf.cache_dir, entry.size, entry.mtime_ns,
+                                                      thumbnail_format)
+            thumbnail_paths[entry.path] = cached_image_path
+            if cached_image_path.name in pack_index:
+                ready_thumbnails.add(entry.path)
+                cached_image_paths.append(cached_image_path)
+            elif cached_image_path.exists():
+                ready_thumbnails.add(entry.path)
+                cached_image_paths.append(cached_image_path)
+                if self.cf.thumbnail_pack:
+                    unpacked_paths.append(entry.path)
+            else:
+                uncached_paths.append(entry.path)
+
+        # Show the grid right away with placeholders, which are replaced as thumbnails become available:
+        self.processing_generation += 1
+        generation = self.processing_generation
+        self.image_paths = image_paths
+        self.image_names = image_names
+        self.ready_thumbnails = ready_thumbnails
+        self.cached_image_paths = thumbnail_paths
+        self.pack_index = pack_index
+        GLib.idle_add(self.thumbnail_cache.clear)
+        GLib.idle_add(self.load_image_grid)
+
+        # Resize and cache the other images on a pool of workers, showing the progress:
+        for number, image_path in enumerate(cache_images(uncached_paths, self.cf.cache_dir, self.cf.thumbnail_workers,
+                                                         thumbnail_format), start=1):
+            GLib.idle_add(self.update_caching_label, number, len(uncached_paths))
+            self.queue_thumbnail(generation, image_path)
+        self.flush_thumbnails(generation)
+
+        # Thumbnails of the shown folders are the last to be evicted from the cache:
+        thumbnail_cache = ThumbnailCache(self.cf.cache_dir)
+        thumbnail_cache.touch(cached_image_paths)
+        if self.cf.thumbnail_pack:
+            pack_thumbnails(unpacked_paths + uncached_paths, self.cf.cache_dir, thumbnail_format)
+        if thumbnail_cache.is_gc_due():
+            collect_cache_garbage(self.cf.cache_dir, self.cf.cache_max_size, self.cf.cache_max_entries, thumbnail_format)
+        if self.cf.thumbnail_pack:
+            self.pack_index = ThumbnailPack(self.cf.cache_dir).load_index()
+
+    def queue_thumbnail(self, generation: int, image_path: str) -> None:
+        """Pass the newly cached thumbnail to the grid together with other recently cached thumbnails"""
+        self.pending_thumbnails.append(image_path)
+
+        # Updating the grid for every image would keep the main loop busy, so thumbnails are sent in batches:
+        if (len(self.pending_thumbnails) >= THUMBNAIL_BATCH_SIZE or
+                time.monotonic() - self.last_thumbnails_flush >= THUMBNAIL_BATCH_INTERVAL):
+            self.flush_thumbnails(generation)
+
+    def flush_thumbnails(self, generation: int) -> None:
+        if self.pending_thumbnails:
+            GLib.idle_add(self.update_thumbnails, generation, self.pending_thumbnails)
+        self.pending_thumbnails = []
+        self.last_thumbnails_flush = time.monotonic()
+
+    def update_thumbnails(self, generation: int, image_paths: list[str]) -> bool:
+        """Mark thumbnails as cached, so that placeholders are replaced once they are visible"""
+        # Ignore thumbnails of images that were processed before the current processing started:
+        if generation != self.processing_generation:
+            return False
+        self.ready_thumbnails.update(image_paths)
+        self.load_visible_thumbnails()
+        return False
 
-        # Possible removal from the list in the for loop will cause indexing to get thrown off.
-        # This causes image_paths to be the correct number of elements, but image_names will
-        # be off by however many zero byte files are present. To fix this a copy is made to
-        # iterate through and then the image can be saftley removed from the original lis
-        for image_path in list(self.image_paths):
+    def on_grid_scrolled(self, adjustment) -> None:
+        self.load_visible_thumbnails()
 
-            # Skip zero byte files inside the image_path:
-            if os.path.getsize(image_path) == 0:
-                self.image_paths.remove(image_path)
+    def load_visible_thumbnails(self) -> None:
+        """Find which thumbnails are in or near the viewport and load them over the next main loop iterations"""
+        visible_range = self.grid.get_visible_range()
+        if not visible_range or not visible_range[-1]:
+            return
+        start_path, end_path = visible_range[-2], visible_range[-1]
+        margin = THUMBNAIL_PRELOAD_ROWS * self.cf.number_of_columns
+        start = max(0, start_path.get_indices()[0] - margin)
+        end = min(len(self.image_store), end_path.get_indices()[0] + margin + 1)
+        self.thumbnails_to_load = [self.image_store[index][2] for index in range(start, end)]
+        if not self.is_loading_thumbnails:
+            self.is_loading_thumbnails = True
+            GLib.idle_add(self.load_next_thumbnails)
+
+    def load_next_thumbnails(self) -> bool:
+        """Load a few cached thumbnails into the grid, and keep being called while there are more"""
+        loaded = 0
+        while self.thumbnails_to_load and loaded < THUMBNAIL_LOADS_PER_ITERATION:
+            image_path = self.thumbnails_to_load.pop(0)
+
+            # Visible thumbnails are marked as recently used, so that they are evicted last:
+            if self.thumbnail_cache.get(image_path) is not None:
+                continue
+            if image_path not in self.ready_thumbnails or image_path not in self.grid_iters:
                 continue
+            loaded += 1
+            thumbnail = self.load_thumbnail(image_path)
+            if thumbnail is None:
+                continue
+            self.thumbnail_cache.put(image_path, thumbnail)
+            self.image_store.set_value(self.grid_iters[image_path], 0, thumbnail)
 
-            # If this image is not cached yet, resize and cache it:
-            cached_image_path = get_cached_image_path(image_path, self.cf.cache_dir)
-            if not cached_image_path.exists():
-                cache_image(image_path, self.cf.cache_dir)
-                
-            thumbnail: GdkPixbuf.Pixbuf | None = None
+        if self.thumbnails_to_load:
+            return True
+        self.is_loading_thumbnails = False
+        return False
 
+    def load_thumbnail(self, image_path: str) -> GdkPixbuf.Pixbuf | None:
+        """Load the thumbnail from the pack if it is there, or otherwise from its file.
+        A thumbnail that is missing, for example because the image changed, is created again in the background."""
+        cached_image_path = self.cached_image_paths.get(image_path)
+        if cached_image_path is None:
+            cached_image_path = get_cached_image_path(image_path, self.cf.cache_dir,
+                                                      thumbnail_format=self.cf.get_thumbnail_format())
+        record = self.pack_index.get(cached_image_path.name)
+        if record:
+            thumbnail = load_packed_thumbnail(self.thumbnail_pack, cached_image_path.name, record)
+            if thumbnail:
+                return thumbnail
+        try:
+            return load_thumbnail_file(cached_image_path)
+        except GLib.GError:
+            print(f"Failed to load cached thumbnail at path {cached_image_path}, creating it again")
+            self.ready_thumbnails.discard(image_path)
+            threading.Thread(target=self.add_image, args=(image_path,), daemon=True).start()
+            return None
+
+    def on_thumbnail_evicted(self, image_path: str) -> None:
+        """Release the memory of a thumbnail that was evicted by showing the placeholder instead"""
+        tree_iter = self.grid_iters.get(image_path)
+        if tree_iter:
+            self.image_store.set_value(tree_iter, 0, self.placeholder)
+
+    def start_watcher(self) -> None:
+        """Watch the folders, so that single images are added or removed without processing all images again"""
+        self.stop_watcher()
+        if self.cf.backend == "linux-wallpaperengine":
+            return
+        self.watcher = create_watcher(self.cf.image_folder_list, self.on_folder_changed, self.cf.include_subfolders,
+                                      self.cf.include_all_subfolders, self.cf.show_hidden, self.cf.cache_dir)
+        self.watcher.start()
+
+    def stop_watcher(self) -> None:
+        if self.watcher:
+            self.watcher.stop()
+            self.watcher = None
+
+    def on_folder_changed(self, event: str, path: str, new_path: str | None) -> None:
+        """Process a change reported by the folder watcher, or queue it while images are processed.
+        This is called from the watcher thread"""
+        with self.folder_events_lock:
+            if self.queued_folder_events is not None:
+                self.queued_folder_events.append((event, path, new_path))
+                return
+        self.apply_folder_change(event, path, new_path)
+
+    def replay_folder_events(self) -> None:
+        """Apply the queued changes in order, including those that arrive while they are applied"""
+        while True:
+            with self.folder_events_lock:
+                queued_folder_events = self.queued_folder_events or []
+                self.queued_folder_events = [] if queued_folder_events else None
+            if not queued_folder_events:
+                return
+            for event in queued_folder_events:
+                self.apply_folder_change(*event)
+
+    def apply_folder_change(self, event: str, path: str, new_path: str | None) -> None:
+        if event == "overflow":
+            threading.Thread(target=self.process_images).start()
+        elif event == "removed":
+            GLib.idle_add(self.remove_image, path)
+        elif event == "renamed" and new_path:
+            # The file itself did not change, so its thumbnail can be reused:
             try:
-                # Load cached thumbnail:
-                thumbnail = GdkPixbuf.Pixbuf.new_from_file(str(cached_image_path))
-                
-                if thumbnail:
-                    self.thumbnails.append(thumbnail)
-                else:
-                    print("Failed to load cached thumbnail, None returned")
-                    continue
-            except GLib.GError:
-                # This could happen before because of a race-condition, probably can't happen now, but it's not bad to check
-                print(f"Failed to load cached thumbnail at path {cached_image_path}")
-                continue
+                stat = os.stat(new_path)
+                thumbnail_format = self.cf.get_thumbnail_format()
+                old_cached_image_path = get_cached_image_path(path, self.cf.cache_dir, stat.st_size, stat.st_mtime_ns,
+                                                              thumbnail_format)
+                new_cached_image_path = get_cached_image_path(new_path, self.cf.cache_dir, stat.st_size, stat.st_mtime_ns,
+                                                              thumbnail_format)
+                os.replace(old_cached_image_path, new_cached_image_path)
+                # Otherwise the garbage collection would remove it as a thumbnail unknown to the manifest:
+                ThumbnailCache(self.cf.cache_dir).rename(old_cached_image_path, new_path, new_cached_image_path)
+            except OSError:
+                pass
+            GLib.idle_add(self.remove_image, path)
+            self.add_image(new_path)
+        elif event == "added":
+            self.add_image(path)
+
+    def add_image(self, image_path: str) -> None:
+        """Cache the thumbnail of a new or modified image and add it to the grid"""
+        if not has_image_extension(image_path, self.cf.backend):
+            return
+        if not image_path.casefold().endswith('.gif') and self.cf.show_gifs_only:
+            return
+        try:
+            if os.path.getsize(image_path) == 0:
+                return
+        except OSError:
+            return
 
-            # Get image name, which may or may not include parent folders:
-            if self.cf.backend == 'linux-wallpaperengine':
-                image_name = get_wallpaperengine_image_name(image_path)
+        # Modified images get a new cache path, so their thumbnail is created again:
+        thumbnail_format = self.cf.get_thumbnail_format()
+        cached_image_path = get_cached_image_path(image_path, self.cf.cache_dir, thumbnail_format=thumbnail_format)
+        if not cached_image_path.exists():
+            cache_image(image_path, self.cf.cache_dir, thumbnail_format)
+            record_cached_images([image_path], self.cf.cache_dir, thumbnail_format)
+        image_name = get_image_name(image_path, self.cf.image_folder_list, self.cf.show_path_in_tooltip)
+        if image_name:
+            GLib.idle_add(self.insert_image, image_path, image_name, cached_image_path)
+
+    def insert_image(self, image_path: str, image_name: str, cached_image_path: Path) -> bool:
+        """Insert a single image into the grid at the position given by the sorting"""
+        self.thumbnail_cache.remove(image_path)
+        self.cached_image_paths[image_path] = cached_image_path
+        self.ready_thumbnails.add(image_path)
+        if image_path in self.image_paths:
+            index = self.image_paths.index(image_path)
+            self.image_names[index] = image_name
+        else:
+            index = self.find_insert_position(image_path)
+            self.image_paths.insert(index, image_path)
+            self.image_names.insert(index, image_name)
+            if index <= self.selected_index < len(self.image_paths) - 1:
+                self.selected_index += 1
+
+        # Rows of a filtered grid are not at the same positions as the images, so the grid is filled again:
+        if self.search_entry.get_text():
+            self.load_image_grid()
+            return False
+        tree_iter = self.grid_iters.get(image_path)
+        if tree_iter:
+            self.image_store.set_value(tree_iter, 0, self.placeholder)
+            self.image_store.set_value(tree_iter, 1, GLib.markup_escape_text(image_name))
+        else:
+            self.grid_iters[image_path] = self.image_store.insert(
+                index, [self.placeholder, GLib.markup_escape_text(image_name), image_path])
+        self.highlight_selected_image()
+        self.load_visible_thumbnails()
+        return False
+
+    def remove_image(self, path: str) -> bool:
+        """Remove an image, or all images of a removed folder, from the grid"""
+        indices = [i for i, image_path in enumerate(self.image_paths)
+                   if image_path == path or image_path.startswith(path + os.sep)]
+        if not indices:
+            return False
+        for index in reversed(indices):
+            image_path = self.image_paths[index]
+            self.thumbnail_cache.remove(image_path)
+            self.ready_thumbnails.discard(image_path)
+            tree_iter = self.grid_iters.pop(image_path, None)
+            if tree_iter:
+                self.image_store.remove(tree_iter)
+            del self.image_paths[index]
+            del self.image_names[index]
+            if index < self.selected_index:
+                self.selected_index -= 1
+        self.selected_index = max(0, min(self.selected_index, len(self.image_paths) - 1))
+        self.highlight_selected_image()
+        self.load_visible_thumbnails()
+        return False
+
+    def find_insert_position(self, image_path: str) -> int:
+        """Find where a new image goes in the list of images that is already sorted"""
+        if self.cf.sort_option == "random":
+            return random.randint(0, len(self.image_paths))
+
+        def sort_key(path: str):
+            if self.cf.sort_option in ["date", "daterev"]:
+                try:
+                    return os.stat(path).st_mtime_ns
+                except OSError:
+                    return 0
+            return path
+
+        reverse = self.cf.sort_option in ["namerev", "daterev"]
+        new_key = sort_key(image_path)
+        low, high = 0, len(self.image_paths)
+        while low < high:
+            middle = (low + high) // 2
+            middle_key = sort_key(self.image_paths[middle])
+            if (middle_key >= new_key) if reverse else (middle_key <= new_key):
+                low = middle + 1
             else:
-                image_name = get_image_name(image_path, self.cf.image_folder_list, self.cf.show_path_in_tooltip)
-            if not image_name:
-                self.thumbnails.remove(thumbnail)
-                print("Failed to get image name")
-                continue
-            self.image_names.append(image_name)
+                high = middle
+        return low
 
-    def get_filtered_images(self) -> tuple[list[GdkPixbuf.Pixbuf], list[str], list[str]]:
-        """Filter image paths, names, and thumbnails based on the search query, if any"""
+    def get_filtered_images(self) -> tuple[list[str], list[str]]:
+        """Filter image paths and names based on the search query, if any"""
         # Read what is written in the search bar, and if nothing, return all images:
         search_query = self.search_entry.get_text().lower()
         if not search_query:
-            return self.thumbnails, self.image_names, self.image_paths
+            return self.image_names, self.image_paths
 
         # Otherwise, filter only images whos names match the search query:
         image_names = [name for name in self.image_names if search_query in name.lower()]
-        thumbnails = [self.thumbnails[i] for i in range(len(self.image_names)) if search_query in self.image_names[i].lower()]
         image_paths = [self.image_paths[i] for i in range(len(self.image_names)) if search_query in self.image_names[i].lower()]
 
-        return thumbnails, image_names, image_paths
+        return image_names, image_paths
 
 
     def load_image_grid(self) -> None:
         """Reload the grid of images"""
 
-        thumbnails, image_names, image_paths = self.get_filtered_images()
-
-        # Clear existing images:
-        for child in self.grid.get_children():
-            self.grid.remove(child)
-
-        current_y = 0
-        current_row_heights = [0] * self.cf.number_of_columns
-        for index, [thumbnail, name, path] in enumerate(zip(thumbnails, image_names, image_paths)):
-
-            row = index // self.cf.number_of_columns
-            column = index % self.cf.number_of_columns
-
-            # Calculate current y coordinate in the scroll window:
-            aspect_ratio = thumbnail.get_width() / thumbnail.get_height()
-            current_row_heights[column] = int(240 / aspect_ratio)
-            if column == 0:
-                current_y += max(current_row_heights) + 10
-                current_row_heights = [0]*self.cf.number_of_columns
-
-            # Create a button with an image and add tooltip:
-            image = Gtk.Image.new_from_pixbuf(thumbnail)
-            image.set_tooltip_text(name)
-            button = Gtk.Button()
-            if index == self.selected_index:
-                button.set_relief(Gtk.ReliefStyle.NORMAL)
-                button.get_style_context().add_class("highlighted-button")
-                self.highlighted_image_y = current_y
-            else:
-                button.set_relief(Gtk.ReliefStyle.NONE)
-            button.add(image)
+        image_names, image_paths = self.get_filtered_images()
 
-            # Add button to the grid and connect clicked event:
-            self.grid.attach(button, column, row, 1, 1)
-            button.connect("clicked", self.on_image_clicked, path)
+        # Refill the model while it is detached, so that the view does not relayout on every row.
+        # Thumbnails that are not in memory are shown as placeholders until they become visible:
+        self.grid.set_model(None)
+        self.image_store.clear()
+        self.grid_iters = {}
+        for name, path in zip(image_names, image_paths):
+            thumbnail = self.thumbnail_cache.peek(path) or self.placeholder
+            self.grid_iters[path] = self.image_store.append([thumbnail, GLib.markup_escape_text(name), path])
+        self.grid.set_model(self.image_store)
+        self.grid.set_columns(self.cf.number_of_columns)
 
+        self.highlight_selected_image()
         self.grid.show_all()
         self.toggle_zen_mode()
+        self.load_visible_thumbnails()
+
+
+    def highlight_selected_image(self) -> None:
+        """Move the highlight to the selected image, redrawing only the previously and newly highlighted items"""
+        new_path = None
+        if 0 <= self.selected_index < len(self.image_paths):
+            tree_iter = self.grid_iters.get(self.image_paths[self.selected_index])
+            if tree_iter:
+                new_path = self.image_store.get_path(tree_iter)
+        for old_path in self.grid.get_selected_items():
+            if old_path != new_path:
+                self.grid.unselect_path(old_path)
+        if new_path and not self.grid.path_is_selected(new_path):
+            self.grid.select_path(new_path)
+
+
+    def move_selection(self, index: int) -> None:
+        """Highlight another image with the keyboard and scroll to it"""
+        self.selected_index = max(0, min(index, len(self.image_paths) - 1))
+        self.highlight_selected_image()
+        self.scroll_to_selected_image()
 
 
     def toggle_zen_mode(self):
@@ -872,11 +1198,9 @@ class App(Gtk.Window):
 
     def scroll_to_selected_image(self) -> None:
         """Scroll the window to see the highlighted image"""
-        scrolled_window_height = self.scrolled_window.get_vadjustment().get_page_size()
-        # current_y = self.highlighted_image_row * 180
-        subscreen_num = self.highlighted_image_y // scrolled_window_height
-        scroll = scrolled_window_height * subscreen_num
-        self.scrolled_window.get_vadjustment().set_value(scroll)
+        selected_paths = self.grid.get_selected_items()
+        if selected_paths:
+            self.grid.scroll_to_path(selected_paths[0], False, 0, 0)
 
 
     def set_selected_wallpaper(self, path: str) -> None:
@@ -1035,21 +1359,22 @@ class App(Gtk.Window):
         self.cf.color = "#{:02X}{:02X}{:02X}".format(red, green, blue)
 
 
-    def on_image_clicked(self, widget, path: str) -> None:
+    def on_image_clicked(self, icon_view, tree_path) -> None:
         """On clicking an image, set it as a wallpaper and save"""
+        path = self.image_store[tree_path][2]
         self.selected_index = self.image_paths.index(path)
-        self.load_image_grid()
+        self.highlight_selected_image()
         self.set_selected_wallpaper(path)
 
     def on_refresh_clicked(self, widget) -> None:
-        """On clicking refresh button, clear cache"""
+        """On clicking refresh button, reprocess the images, which recaches only new and modified ones"""
         
         # Manual refreshes should just be cancelled if wallpapers are being cached
         # The button is also disabled during this operation, but it doesn't hurt to check
         if self.caching_images_lock.locked():
             return
         
-        self.clear_cache()
+        threading.Thread(target=self.process_images).start()
 
     def on_hyprland_restart(self, widget) -> None:
         # As in the new Hyprpaper Update Unloading wallpapers is not possible anymore, Hyprpaper needs to be restarted to free up memory
@@ -1081,15 +1406,22 @@ class App(Gtk.Window):
             # gSlapper doesn't support pause, so do nothing or show message
             print("Pause not supported for gSlapper")
 
-    def is_waypaperd_running(self) -> bool:
-        result = subprocess.run(["pgrep", "-f", "waypaperd"], capture_output=True)
-        return result.returncode == 0
-
     def update_slideshow_button(self) -> None:
-        if self.is_waypaperd_running():
-            self.slideshow_start_button.set_label(self.txt.msg_daemon_restart)
-        else:
-            self.slideshow_start_button.set_label(self.txt.msg_daemon_start)
+        """Show whether the daemon runs, asking it outside of the main thread"""
+        def check_daemon() -> None:
+            label = self.txt.msg_daemon_restart if is_daemon_running(self.cf.control_socket) else self.txt.msg_daemon_start
+            GLib.idle_add(self.slideshow_start_button.set_label, label)
+        threading.Thread(target=check_daemon, daemon=True).start()
+
+    def start_daemon(self, interval: int) -> None:
+        """Pass the interval to the running daemon, or start a new one. This is called outside of the main thread"""
+        if send_command(self.cf.control_socket, "set-interval", interval=interval) is not None:
+            send_command(self.cf.control_socket, "resume")
+            return
+        try:
+            subprocess.Popen(["waypaperd", str(interval)])
+        except FileNotFoundError:
+            print("Couldn't launch the daemon for automatic wallpaper change. See documentation on how to enable it.")
 
     def on_daemon_start_clicked(self, widget) -> None:
         interval_text = self.slideshow_interval_entry.get_text()
@@ -1099,18 +1431,15 @@ class App(Gtk.Window):
                 interval_minutes = 60
         except ValueError:
             interval_minutes = 60
-        subprocess.run(["pkill", "-f", "waypaperd"], capture_output=True)
-        try:
-            subprocess.Popen(["waypaperd", str(interval_minutes * 60)])
-            self.cf.slideshow_interval = interval_minutes
-            self.cf.slideshow_enabled = True
-            self.cf.save()
-            self.slideshow_start_button.set_label(self.txt.msg_daemon_restart)
-        except FileNotFoundError:
-            print("Couldn't launch the daemon for automatic wallpaper change. See documentation on how to enable it.")
+        # A running daemon only gets the new interval, otherwise a new one is started:
+        threading.Thread(target=self.start_daemon, args=(interval_minutes * 60,), daemon=True).start()
+        self.cf.slideshow_interval = interval_minutes
+        self.cf.slideshow_enabled = True
+        self.cf.save()
+        self.slideshow_start_button.set_label(self.txt.msg_daemon_restart)
 
     def on_daemon_stop_clicked(self, widget) -> None:
-        subprocess.run(["pkill", "-f", "waypaperd"], capture_output=True)
+        threading.Thread(target=send_command, args=(self.cf.control_socket, "stop"), daemon=True).start()
         self.cf.slideshow_enabled = False
         self.cf.save()
         self.slideshow_start_button.set_label(self.txt.msg_daemon_start)
@@ -1133,10 +1462,12 @@ class App(Gtk.Window):
         """Choose a random image and set it as the wallpaper"""
         if self.cf.backend == "linux-wallpaperengine":
             new_wallpaper =  get_random_file(self.cf.backend, [self.cf.wallpaperengine_folder], self.cf.include_subfolders,
-                                         self.cf.include_all_subfolders, self.cf.cache_dir)
+                                         self.cf.include_all_subfolders, self.cf.cache_dir,
+                                         weights=self.cf.get_selection_weights(), monitor=self.cf.selected_monitor)
         else:
             new_wallpaper =  get_random_file(self.cf.backend, self.cf.image_folder_list, self.cf.include_subfolders,
-                                         self.cf.include_all_subfolders, self.cf.cache_dir)
+                                         self.cf.include_all_subfolders, self.cf.cache_dir,
+                                         weights=self.cf.get_selection_weights(), monitor=self.cf.selected_monitor)
 
         if new_wallpaper:
             self.cf.select_wallpaper(new_wallpaper)
@@ -1149,10 +1480,10 @@ class App(Gtk.Window):
 
 
     def clear_cache(self) -> None:
-        """Delete cache folder and reprocess the images"""
+        """Delete the thumbnails and reprocess the images"""
+        # Lock files in the cache folder are held by other processes, so the folder itself is not removed:
         try:
-            shutil.rmtree(self.cf.cache_dir)
-            os.makedirs(self.cf.cache_dir)
+            ThumbnailPack(self.cf.cache_dir).clear()
         except OSError as e:
             print(f"{self.txt.err_cache} '{self.cf.cache_dir}': {e}")
         threading.Thread(target=self.process_images).start()
@@ -1188,41 +1519,29 @@ class App(Gtk.Window):
             self.toggle_include_subfolders()
 
         elif event.keyval in self.keys.navigation_left:
-            self.selected_index = max(self.selected_index - 1, 0)
-            self.load_image_grid()
-            self.scroll_to_selected_image()
+            self.move_selection(self.selected_index - 1)
 
         elif event.keyval in self.keys.navigation_down:
-            self.selected_index = min(self.selected_index + self.cf.number_of_columns, len(self.image_paths) - 1)
-            self.load_image_grid()
-            self.scroll_to_selected_image()
+            self.move_selection(self.selected_index + self.cf.number_of_columns)
 
         elif event.keyval in self.keys.navigation_up:
-            self.selected_index = max(self.selected_index - self.cf.number_of_columns, 0)
-            self.load_image_grid()
-            self.scroll_to_selected_image()
+            self.move_selection(self.selected_index - self.cf.number_of_columns)
 
         elif event.keyval in self.keys.navigation_right:
-            self.selected_index = min(self.selected_index + 1, len(self.image_paths) - 1)
-            self.load_image_grid()
-            self.scroll_to_selected_image()
+            self.move_selection(self.selected_index + 1)
 
         elif event.keyval in self.keys.choose_folder:
             self.choose_folder()
 
         elif event.keyval in self.keys.scroll_to_top:
-            self.selected_index = 0
-            self.load_image_grid()
-            self.scroll_to_selected_image()
+            self.move_selection(0)
 
         elif event.keyval in self.keys.zen_mode:
             self.cf.zen_mode = not self.cf.zen_mode
             self.load_image_grid()
 
         elif event.keyval in self.keys.scroll_to_bottom:
-            self.selected_index = len(self.image_paths) - 1
-            self.load_image_grid()
-            self.scroll_to_selected_image()
+            self.move_selection(len(self.image_paths) - 1)
 
         elif event.keyval in self.keys.help_page:
             message = self.txt.msg_help
@@ -0,0 +1,380 @@
+"""Module that keeps track of thumbnails in the cache folder and removes unused ones"""
+
+import fcntl
+import mmap
+import os
+import re
+import sqlite3
+import time
+import zlib
+from pathlib import Path
+from typing import Callable, NamedTuple
+
+# Thumbnails are named by the md5 hash of their source path, size, mtime and lossy codec, with the codec as extension,
+# and are written to temporary files that get a suffix with the process and thread:
+THUMBNAIL_NAME = re.compile(r"^[0-9a-f]{32}\.(png|jpg|webp|[0-9]+-[0-9]+\.tmp)$")
+
+# Thumbnails missing from the manifest are only removed after this time, since another process may be caching them:
+ORPHAN_GRACE_SECONDS = 3600
+
+# Garbage collection in the background runs at most this often:
+GC_INTERVAL_SECONDS = 24 * 3600
+
+# Space taken by thumbnails that are no longer in the manifest, after which the pack is rewritten:
+PACK_MAX_GARBAGE_RATIO = 0.5
+
+MANIFEST_SCHEMA_VERSION = 3
+
+
+class GarbageCollectionResult(NamedTuple):
+    removed: int
+    freed_bytes: int
+    kept: int
+    kept_bytes: int
+
+
+class PackRecord(NamedTuple):
+    """Location and layout of the pixels of a thumbnail in the pack"""
+    offset: int
+    length: int
+    width: int
+    height: int
+    rowstride: int
+    has_alpha: bool
+
+
+class ThumbnailCache:
+    """Manifest of thumbnails with their sources and last access times, stored in the cache folder"""
+
+    def __init__(self, cache_dir: Path, max_bytes: int = 0, max_entries: int = 0) -> None:
+        self.cache_dir = cache_dir
+        self.manifest_file = cache_dir / "thumbnails.sqlite"
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.connection: sqlite3.Connection | None = None
+
+    def open(self) -> bool:
+        """Open the manifest, recreating it if the schema is outdated"""
+        try:
+            self.connection = sqlite3.connect(self.manifest_file, timeout=10)
+            version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+            if version != MANIFEST_SCHEMA_VERSION:
+                with self.connection:
+                    # Recreating the manifest would make all thumbnails unknown, so the older versions are upgraded:
+                    if version not in (1, 2):
+                        self.connection.execute("DROP TABLE IF EXISTS thumbnails")
+                        self.connection.execute("DROP TABLE IF EXISTS state")
+                        self.connection.execute("CREATE TABLE thumbnails (name TEXT PRIMARY KEY, source TEXT, "
+                                                "size INTEGER, atime REAL, aspect REAL)")
+                        self.connection.execute("CREATE TABLE state (key TEXT PRIMARY KEY, value REAL)")
+                    else:
+                        self.connection.execute("ALTER TABLE thumbnails ADD COLUMN aspect REAL")
+                    if version != 2:
+                        self.connection.execute("DROP TABLE IF EXISTS pack")
+                        self.connection.execute("CREATE TABLE pack (name TEXT PRIMARY KEY, offset INTEGER, length INTEGER, "
+                                                "width INTEGER, height INTEGER, rowstride INTEGER, has_alpha INTEGER)")
+                    self.connection.execute(f"PRAGMA user_version = {MANIFEST_SCHEMA_VERSION}")
+            return True
+        except sqlite3.Error as e:
+            print(f"Could not open thumbnail manifest: {e}")
+            self.close()
+            return False
+
+    def close(self) -> None:
+        if self.connection:
+            self.connection.close()
+        self.connection = None
+
+    def add(self, thumbnails: list[tuple[str, Path]], aspects: dict[str, float] | None = None) -> None:
+        """Record newly cached thumbnails given as pairs of source path and thumbnail path,
+        together with the aspect ratios of the sources if they are known"""
+        rows = []
+        now = time.time()
+        aspects = aspects or {}
+        for source, thumbnail in thumbnails:
+            try:
+                rows.append((thumbnail.name, source, thumbnail.stat().st_size, now, aspects.get(source)))
+            except OSError:
+                continue
+        if not rows or not self.open():
+            return
+        try:
+            with self.connection:
+                self.connection.executemany("INSERT OR REPLACE INTO thumbnails (name, source, size, atime, aspect) "
+                                            "VALUES (?, ?, ?, ?, ?)", rows)
+        except sqlite3.Error as e:
+            print(f"Could not update thumbnail manifest: {e}")
+        finally:
+            self.close()
+
+    def rename(self, old_thumbnail: Path, source: str, thumbnail: Path) -> None:
+        """Record that the thumbnail was moved to a new name for its renamed source, keeping its other data"""
+        if not self.open():
+            return
+        try:
+            with self.connection:
+                self.connection.execute("DELETE FROM thumbnails WHERE name = ?", (thumbnail.name,))
+                updated = self.connection.execute("UPDATE thumbnails SET name = ?, source = ? WHERE name = ?",
+                                                  (thumbnail.name, source, old_thumbnail.name)).rowcount
+        except sqlite3.Error as e:
+            print(f"Could not update thumbnail manifest: {e}")
+            return
+        finally:
+            self.close()
+        if not updated:
+            self.add([(source, thumbnail)])
+
+    def touch(self, thumbnails: list[Path]) -> None:
+        """Mark thumbnails as recently used, so that they are evicted last"""
+        if not thumbnails or not self.open():
+            return
+        now = time.time()
+        try:
+            with self.connection:
+                self.connection.executemany("UPDATE thumbnails SET atime = ? WHERE name = ?",
+                                            [(now, thumbnail.name) for thumbnail in thumbnails])
+        except sqlite3.Error as e:
+            print(f"Could not update thumbnail manifest: {e}")
+        finally:
+            self.close()
+
+    def get_aspects(self) -> dict[str, float]:
+        """Read the aspect ratios of all sources with a single query"""
+        if not self.open():
+            return {}
+        try:
+            rows = self.connection.execute("SELECT source, aspect FROM thumbnails WHERE aspect > 0")
+            return {source: aspect for source, aspect in rows}
+        except sqlite3.Error as e:
+            print(f"Could not read thumbnail manifest: {e}")
+            return {}
+        finally:
+            self.close()
+
+    def is_gc_due(self) -> bool:
+        """Check if garbage was not collected for a while"""
+        if not self.open():
+            return False
+        try:
+            row = self.connection.execute("SELECT value FROM state WHERE key = 'last_gc'").fetchone()
+            return row is None or time.time() - row[0] > GC_INTERVAL_SECONDS
+        except sqlite3.Error:
+            return False
+        finally:
+            self.close()
+
+    def collect_garbage(self, get_thumbnail_path: Callable[[str, Path], Path]) -> GarbageCollectionResult:
+        """Remove thumbnails of images that were deleted or modified, thumbnails unknown to the manifest,
+        and then the least recently used thumbnails until the cache fits into its limits"""
+        removed = 0
+        freed_bytes = 0
+        if not self.open():
+            return GarbageCollectionResult(0, 0, 0, 0)
+        try:
+            with self.connection:
+                rows = self.connection.execute("SELECT name, source, size FROM thumbnails ORDER BY atime").fetchall()
+                known_names = {name for name, _, _ in rows}
+                # Packed thumbnails take space in the pack as well, which is freed once the pack is compacted:
+                packed_sizes = dict(self.connection.execute("SELECT name, length FROM pack"))
+                stale_names = []
+
+                # Sources that were deleted or modified have no use for their old thumbnails:
+                kept_rows = []
+                for name, source, size in rows:
+                    thumbnail = self.cache_dir / name
+                    if not os.path.exists(source) or get_thumbnail_path(source, self.cache_dir) != thumbnail \
+                            or not thumbnail.exists():
+                        stale_names.append(name)
+                        freed_bytes += self.remove_file(thumbnail)
+                    else:
+                        kept_rows.append((name, size + packed_sizes.get(name, 0)))
+
+                # Least recently used thumbnails are evicted while the cache exceeds its limits:
+                total_bytes = sum(size for _, size in kept_rows)
+                while kept_rows and ((self.max_bytes and total_bytes > self.max_bytes) or
+                                     (self.max_entries and len(kept_rows) > self.max_entries)):
+                    name, size = kept_rows.pop(0)
+                    stale_names.append(name)
+                    total_bytes -= size
+                    freed_bytes += self.remove_file(self.cache_dir / name)
+
+                self.connection.executemany("DELETE FROM thumbnails WHERE name = ?", [(name,) for name in stale_names])
+                self.connection.execute("INSERT OR REPLACE INTO state VALUES ('last_gc', ?)", (time.time(),))
+                removed = len(stale_names)
+
+            # Thumbnails that are not in the manifest were made by older versions or lost their record:
+            with os.scandir(self.cache_dir) as iterator:
+                for entry in iterator:
+                    if not THUMBNAIL_NAME.match(entry.name) or entry.name in known_names:
+                        continue
+                    try:
+                        if time.time() - entry.stat().st_mtime < ORPHAN_GRACE_SECONDS:
+                            continue
+                    except OSError:
+                        continue
+                    freed_bytes += self.remove_file(Path(entry.path))
+                    removed += 1
+            return GarbageCollectionResult(removed, freed_bytes, len(kept_rows), total_bytes)
+        except (sqlite3.Error, OSError) as e:
+            print(f"Could not collect garbage in the cache: {e}")
+            return GarbageCollectionResult(removed, freed_bytes, 0, 0)
+        finally:
+            self.close()
+
+    @staticmethod
+    def remove_file(path: Path) -> int:
+        """Delete the file and return the number of freed bytes"""
+        try:
+            size = path.stat().st_size
+            path.unlink()
+            return size
+        except OSError:
+            return 0
+
+
+class ThumbnailPack(ThumbnailCache):
+    """Append-only file with the pixels of thumbnails, indexed in the manifest and read through mmap.
+    Each record starts with the name of the thumbnail, followed by its pixels compressed with zlib."""
+
+    def __init__(self, cache_dir: Path) -> None:
+        super().__init__(cache_dir)
+        self.pack_file = cache_dir / "thumbnails.pack"
+        self.lock_file = cache_dir / "thumbnails.pack.lock"
+        self.mapped_file: mmap.mmap | None = None
+
+    def lock(self) -> int:
+        """Take the lock that serializes writers of the pack across processes"""
+        fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return fd
+
+    def load_index(self) -> dict[str, PackRecord]:
+        """Read the locations of all packed thumbnails with a single query"""
+        if not self.open():
+            return {}
+        try:
+            rows = self.connection.execute("SELECT name, offset, length, width, height, rowstride, has_alpha FROM pack")
+            return {row[0]: PackRecord(row[1], row[2], row[3], row[4], row[5], bool(row[6])) for row in rows}
+        except sqlite3.Error as e:
+            print(f"Could not read thumbnail pack index: {e}")
+            return {}
+        finally:
+            self.close()
+
+    def append(self, thumbnails: list[tuple[str, int, int, int, bool, bytes]]) -> None:
+        """Add thumbnails given as their name, width, height, rowstride, alpha and pixels"""
+        if not thumbnails:
+            return
+        lock_fd = self.lock()
+        try:
+            rows = []
+            with open(self.pack_file, "ab") as file:
+                offset = file.tell()
+                for name, width, height, rowstride, has_alpha, pixels in thumbnails:
+                    # Fast compression keeps the pack small, while decompressing is cheaper than decoding a PNG:
+                    data = name.encode() + zlib.compress(pixels, 1)
+                    file.write(data)
+                    rows.append((name, offset, len(data), width, height, rowstride, int(has_alpha)))
+                    offset += len(data)
+            if not self.open():
+                return
+            with self.connection:
+                self.connection.executemany("INSERT OR REPLACE INTO pack VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Could not add thumbnails to the pack: {e}")
+        finally:
+            self.close()
+            os.close(lock_fd)
+
+    def read(self, name: str, record: PackRecord) -> bytes | None:
+        """Get the pixels of the thumbnail, or None if the pack was rewritten since the index was loaded.
+        The pack is mapped again only if it grew or the record is not where the index says, so reads need no syscalls."""
+        try:
+            if self.mapped_file is None or record.offset + record.length > len(self.mapped_file):
+                self.map()
+            data = self.get_record_data(name, record)
+            if data is None:
+                # The mapping may be of a pack that was replaced by a compacted one since:
+                self.map()
+                data = self.get_record_data(name, record)
+            return zlib.decompress(data[len(name):]) if data is not None else None
+        except (OSError, ValueError, zlib.error):
+            return None
+
+    def get_record_data(self, name: str, record: PackRecord) -> bytes | None:
+        if record.offset + record.length > len(self.mapped_file):
+            return None
+        data = self.mapped_file[record.offset:record.offset + record.length]
+        return data if data[:len(name)] == name.encode() else None
+
+    def map(self) -> None:
+        self.unmap()
+        with open(self.pack_file, "rb") as file:
+            self.mapped_file = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def unmap(self) -> None:
+        if self.mapped_file is not None:
+            self.mapped_file.close()
+        self.mapped_file = None
+
+    def clear(self) -> int:
+        """Remove all thumbnails, their records and the pack, returning the number of removed thumbnails.
+        Lock files stay, since other processes may hold them, and so do the history and the folder index.
+        Raises OSError if a file cannot be removed."""
+        lock_fd = self.lock()
+        removed = 0
+        try:
+            if self.open():
+                with self.connection:
+                    self.connection.execute("DELETE FROM thumbnails")
+                    self.connection.execute("DELETE FROM pack")
+            if self.pack_file.exists():
+                self.pack_file.unlink()
+            # Temporary files belong to thumbnails that are being written, which replace them once complete:
+            with os.scandir(self.cache_dir) as iterator:
+                for entry in iterator:
+                    if THUMBNAIL_NAME.match(entry.name) and not entry.name.endswith(".tmp"):
+                        os.unlink(entry.path)
+                        removed += 1
+        except sqlite3.Error as e:
+            print(f"Could not clear thumbnail manifest: {e}")
+        finally:
+            self.close()
+            os.close(lock_fd)
+        return removed
+
+    def compact(self) -> None:
+        """Rewrite the pack without thumbnails that were removed from the cache, once they take too much space"""
+        if not self.pack_file.exists():
+            return
+        lock_fd = self.lock()
+        temp_file = self.pack_file.with_name(f"{self.pack_file.name}.{os.getpid()}.tmp")
+        try:
+            if not self.open():
+                return
+            with self.connection:
+                self.connection.execute("DELETE FROM pack WHERE name NOT IN (SELECT name FROM thumbnails)")
+                rows = self.connection.execute("SELECT name, offset, length FROM pack ORDER BY offset").fetchall()
+                live_bytes = sum(length for _, _, length in rows)
+                pack_size = self.pack_file.stat().st_size
+                if pack_size == 0 or (pack_size - live_bytes) / pack_size <= PACK_MAX_GARBAGE_RATIO:
+                    return
+
+                # Records are copied in their order in the old pack, so that the new one is written sequentially:
+                new_offsets = []
+                with open(self.pack_file, "rb") as old_file, open(temp_file, "wb") as new_file:
+                    for name, offset, length in rows:
+                        old_file.seek(offset)
+                        new_offsets.append((new_file.tell(), name))
+                        new_file.write(old_file.read(length))
+                self.connection.executemany("UPDATE pack SET offset = ? WHERE name = ?", new_offsets)
+                os.replace(temp_file, self.pack_file)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Could not compact the thumbnail pack: {e}")
+            try:
+                temp_file.unlink()
+            except OSError:
+                pass
+        finally:
+            self.close()
+            os.close(lock_fd)
@@ -1,16 +1,19 @@
 """Module that runs the system processes to change the wallpaper"""
 
+import os
 import shlex
 import subprocess
 import time
 from typing import Optional
 from pathlib import Path
-import screeninfo
 
 from waypaper.config import Config
 from waypaper.options import get_monitor_names_with_hyprctl, LINUX_WALLPAPERENGINE_CLAMP, \
     LINUX_WALLPAPERENGINE_FILL_OPTIONS
 
+# Only the start of larger files, like long videos, is read into the page cache ahead of time:
+WARM_UP_MAX_BYTES = 256 * 1024 * 1024
+
 
 def format_post_command(
         post_command: str,
@@ -360,6 +363,49 @@ def change_with_finder(image_path: Path, cf: Config, monitor: str):
     subprocess.Popen(["osascript", "-e", script])
 
 
+def warm_up_file(image_path: Path, max_bytes: int = WARM_UP_MAX_BYTES) -> int:
+    """Read the file into the page cache, so that the backend does not wait for the disk. Returns the bytes read."""
+    total = 0
+    try:
+        with open(image_path, "rb", buffering=0) as file:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(file.fileno(), 0, max_bytes, os.POSIX_FADV_WILLNEED)
+            buffer = memoryview(bytearray(1024 * 1024))
+            while total < max_bytes:
+                count = file.readinto(buffer[:max_bytes - total])
+                if not count:
+                    break
+                total += count
+    except OSError as e:
+        print(f"Could not read {image_path} ahead of time: {e}")
+    return total
+
+
+def preload_wallpaper(image_path: Path, cf: Config):
+    """Prepare the next wallpaper before it is set, reading it from the disk and,
+    for backends that support it, letting the backend decode it already"""
+    warm_up_file(image_path)
+    if cf.backend == "hyprpaper":
+        try:
+            subprocess.run(["hyprctl", "hyprpaper", "preload", str(image_path)], capture_output=True, timeout=10)
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"Could not preload {image_path} with hyprpaper: {e}")
+
+
+def get_hyprpaper_active_wallpapers() -> dict[str, str]:
+    """Get the wallpaper that hyprpaper shows on each monitor"""
+    try:
+        output = subprocess.check_output(["hyprctl", "hyprpaper", "listactive"], encoding="utf-8", timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return {}
+    active_wallpapers = {}
+    for line in output.splitlines():
+        name, separator, path = line.partition(" = ")
+        if separator:
+            active_wallpapers[name.strip()] = path.strip()
+    return active_wallpapers
+
+
 def change_with_hyprpaper(image_path: Path, cf: Config, monitor: str):
     """Change wallpaper with hyprpaper backend"""
 
@@ -379,18 +425,18 @@ def change_with_hyprpaper(image_path: Path, cf: Config, monitor: str):
         monitors = get_monitor_names_with_hyprctl()
     else:
         monitors: list = [monitor]
+    previous_wallpapers = get_hyprpaper_active_wallpapers()
 
     # Change the wallpaper one by one for each affected monitor:
     for m in monitors:
         wallpaper_command = ["hyprctl", "hyprpaper", "wallpaper", f"{m},{image_path}"]
-        unload_command = ["hyprctl", "hyprpaper", "unload", "all"]
         result: str = ""
         retry_counter: int = 0
 
-        # Since sometimes hyprpaper fails to change the wallpaper, we try until success:
+        # Since sometimes hyprpaper fails to change the wallpaper, we try until success.
+        # A wallpaper that was preloaded ahead of time is already loaded, so preloading it again does nothing:
         while result != "ok" and retry_counter < 10:
             try:
-                subprocess.check_output(unload_command, encoding="utf-8").strip()
                 subprocess.check_output(preload_command, encoding="utf-8").strip()
             except Exception:
                 pass
@@ -410,6 +456,16 @@ def change_with_hyprpaper(image_path: Path, cf: Config, monitor: str):
             except Exception:
                 retry_counter += 1
 
+    # Free only the replaced wallpapers that are not shown elsewhere, since the other loaded wallpapers
+    # may have been preloaded for the next change of another monitor:
+    replaced = {previous_wallpapers[m] for m in monitors if m in previous_wallpapers}
+    replaced -= set(get_hyprpaper_active_wallpapers().values()) | {str(image_path)}
+    for wallpaper in replaced:
+        try:
+            subprocess.run(["hyprctl", "hyprpaper", "unload", wallpaper], capture_output=True, timeout=10)
+        except (OSError, subprocess.SubprocessError):
+            pass
+
 def change_with_linux_wallpaperengine(image_path: Path, cf: Config, monitor: str):
     seek_and_destroy("linux-wallpaperengine", monitor)
 
@@ -421,6 +477,7 @@ def change_with_linux_wallpaperengine(image_path: Path, cf: Config, monitor: str
     command = ["linux-wallpaperengine"]
 
     if monitor == "All":
+        import screeninfo
         for monitor in [m.name for m in screeninfo.get_monitors()]:
             if monitor is not None:
                 command.extend(["--screen-root", monitor])
@@ -1,23 +1,34 @@
 """Module with some of the common functions, like file and image operations"""
 
+from __future__ import annotations
+
 import os
 import sys
+import functools
+import subprocess
+import threading
 from os import PathLike
 
-import gi
-import random
 import shutil
-import imageio
 import hashlib
 from pathlib import Path
-from typing import List
-from PIL import Image
+from typing import TYPE_CHECKING, Iterator, List, NamedTuple
 import json
 
-gi.require_version("Gtk", "3.0")
-from gi.repository import Gtk, GdkPixbuf, Gdk, GLib
+from waypaper.cache import GarbageCollectionResult, PackRecord, ThumbnailCache, ThumbnailPack
+from waypaper.index import FolderIndex, IndexEntry
+from waypaper.randomizer import SelectionWeights, ShuffleBag, WeightedPicker
+from waypaper.options import IMAGE_EXTENSIONS, BACKEND_OPTIONS, VIDEO_EXTENSIONS, get_monitor_aspects
+
+# GdkPixbuf, PIL, imageio and the process pool take long to import, so only the functions that create or load
+# thumbnails import them, and the command line does not wait for them:
+if TYPE_CHECKING:
+    from gi.repository import GdkPixbuf
+    from PIL import Image
 
-from waypaper.options import IMAGE_EXTENSIONS, BACKEND_OPTIONS, VIDEO_EXTENSIONS
+# Video previews show a frame at this position in seconds, which skips fade-ins, and ffmpeg is stopped after the timeout:
+VIDEO_PREVIEW_SEEK = 1
+VIDEO_PREVIEW_TIMEOUT = 10
 
 
 def has_image_extension(file_path: str, backend: str) -> bool:
@@ -27,43 +38,40 @@ def has_image_extension(file_path: str, backend: str) -> bool:
     return ext in image_extensions
 
 
+def get_image_entries(backend: str,
+                      folder_list: list[Path],
+                      include_subfolders: bool = False,
+                      include_all_subfolders: bool = False,
+                      include_hidden: bool = False,
+                      only_gifs: bool = False,
+                      cache_dir: Path | None = None,
+                      revalidate_files: bool = False) -> list[IndexEntry]:
+    """Get a list of image files with their size and mtime depending on the filters that were requested.
+    If cache_dir is provided, the folder index stored there is used to skip unchanged directories.
+    Size and mtime are current only with revalidate_files, which is needed to find their thumbnails."""
+
+    image_entries: list[IndexEntry] = []
+    for entry in FolderIndex(cache_dir).list_images(folder_list, include_subfolders,
+                                                    include_all_subfolders, include_hidden, revalidate_files):
+        if not has_image_extension(entry.path, backend):
+            continue
+        if not entry.path.casefold().endswith('.gif') and only_gifs:
+            continue
+        image_entries.append(entry)
+    return image_entries
+
+
 def get_image_paths(backend: str,
                     folder_list: list[Path],
                     include_subfolders: bool = False,
                     include_all_subfolders: bool = False,
                     include_hidden: bool = False,
-                    only_gifs: bool = False) -> list[str]:
+                    only_gifs: bool = False,
+                    cache_dir: Path | None = None) -> list[str]:
     """Get a list of file paths depending on the filters that were requested."""
-
-    image_path_list: list[str] = []
-    for folder in folder_list:
-        for root, directories, files in os.walk(folder, followlinks=True):
-
-            # Remove hidden files from consideration:
-            for directory in directories:
-                if directory.startswith('.') and not include_hidden:
-                    directories.remove(directory)
-
-            # Remove subfolders from consideration:
-            if not include_subfolders and str(root) != str(folder):
-                continue
-
-            # Remove deep folders from consideration:
-            if not include_all_subfolders and str(root) != str(folder):
-                current_depth = root.count(os.path.sep) - str(folder).count(os.path.sep)
-                if current_depth > 1:
-                    continue
-
-            # Remove files that are not images from consideration:
-            for image_name in files:
-                if image_name.startswith('.') and not include_hidden:
-                    continue
-                if not has_image_extension(image_name, backend):
-                    continue
-                if not image_name.casefold().endswith('.gif') and only_gifs:
-                    continue
-                image_path_list.append(os.path.join(root, image_name))
-    return image_path_list
+    entries = get_image_entries(backend, folder_list, include_subfolders, include_all_subfolders,
+                                include_hidden, only_gifs, cache_dir)
+    return [entry.path for entry in entries]
 
 def get_wallpaperengine_preview(wallpaperengine_folder: Path | str) -> List[str]:
     image_path_list = []
@@ -103,45 +111,55 @@ def get_random_file(backend: str,
                     include_subfolders: bool,
                     include_all_subfolders: bool,
                     cache_dir: Path,
-                    include_hidden: bool = False) -> str | None:
+                    include_hidden: bool = False,
+                    weights: SelectionWeights | None = None,
+                    monitor: str = "All") -> str | None:
     """Pick a random file from the folder and update cache"""
+    random_files = get_random_files(backend, folder_list, include_subfolders, include_all_subfolders,
+                                    cache_dir, include_hidden, count=1, weights=weights, monitors=[monitor])
+    return random_files[0] if random_files else None
+
+
+def get_random_files(backend: str,
+                     folder_list: list[Path],
+                     include_subfolders: bool,
+                     include_all_subfolders: bool,
+                     cache_dir: Path,
+                     include_hidden: bool = False,
+                     count: int = 1,
+                     weights: SelectionWeights | None = None,
+                     monitors: list[str] | None = None,
+                     picker: WeightedPicker | None = None) -> list[str]:
+    """Pick several distinct random files, for example one per monitor, listing the folders only once.
+    With weights, the picks depend on them and on how the images fit the given monitors.
+    Callers that pick again and again pass the same picker, which keeps the weights of the images between picks."""
     try:
         if backend == "linux-wallpaperengine":
             image_paths = get_wallpaperengine_preview(folder_list[0])
         else:
-            # Get all image paths from the folder:
+            # Get all image paths from the folder, where unchanged directories come from the folder index:
             image_paths = get_image_paths(backend, folder_list, include_subfolders, include_all_subfolders,
-                                          include_hidden, only_gifs=False)
-
-        # Read cache file with already used images:
-        cache_file = cache_dir / "used_wallpapers.txt"
-        if cache_file.exists():
-            with cache_file.open('r') as file:
-                used_images = [line.strip() for line in file.readlines()]
-        # Create it if the file does not exist:
-        else:
-            cache_file.touch()
-            used_images = []
-
-        # Pick a random image from unused images:
-        remaining_images = list(filter(lambda img: img not in set(used_images), image_paths))
-        if remaining_images:
-            random_image = random.choice(remaining_images)
-            used_images.append(random_image)
-        else:
-            random_image = random.choice(image_paths)
-            used_images = [random_image]
-
-        # Write the cache file:
-        with cache_file.open('w') as file:
-            for img in used_images:
-                file.write(img + '\n')
-
-        return random_image
+                                          include_hidden, only_gifs=False, cache_dir=cache_dir)
+
+        if weights is not None:
+            # Aspect ratios are only looked up if they matter, since asking for monitor sizes may run a command:
+            monitor_aspects: list[float | None] = [None] * count
+            aspects: dict[str, float] = {}
+            if weights.aspect_fit and monitors:
+                monitor_aspects = (get_monitor_aspects(backend, monitors) + monitor_aspects)[:count]
+                aspects = ThumbnailCache(cache_dir).get_aspects()
+            if picker is None:
+                picker = WeightedPicker(cache_dir, weights, aspects)
+            else:
+                picker.set_weights(weights, aspects)
+            return picker.pick_many(image_paths, monitor_aspects)
+
+        # Take the next images from the shuffled list of images that were not used yet:
+        return ShuffleBag(cache_dir).pick_many(image_paths, count)
 
     except Exception as e:
         print(f"Error getting random image: {e}")
-        return None
+        return []
 
 
 def check_installed_backends() -> List[str]:
@@ -164,45 +182,173 @@ def check_installed_backends() -> List[str]:
     return installed_backends
 
 
-def get_cached_image_path(image_path: str, cache_dir: Path) -> Path:
-    real_path_bytes = bytes(os.path.realpath(image_path), encoding="UTF-8")
-    return cache_dir / f"{hashlib.md5(real_path_bytes, usedforsecurity=False).hexdigest()}.png"
+class ThumbnailFormat(NamedTuple):
+    """Codec of cached thumbnails with its quality for jpeg and webp, and zlib compression level for png"""
+    codec: str = "png"
+    quality: int = 90
+    compression: int = 6
+
+
+THUMBNAIL_EXTENSIONS = {"png": "png", "jpeg": "jpg", "webp": "webp"}
+
+
+def get_cached_image_path(image_path: str, cache_dir: Path, size: int | None = None, mtime_ns: int | None = None,
+                          thumbnail_format: ThumbnailFormat = ThumbnailFormat()) -> Path:
+    """Get the path of the thumbnail, which changes whenever the image is modified or another codec is chosen.
+    Size and modification time are read from the file unless they are already known."""
+    if size is None or mtime_ns is None:
+        try:
+            stat = os.stat(image_path)
+            size, mtime_ns = stat.st_size, stat.st_mtime_ns
+        except OSError:
+            size, mtime_ns = 0, 0
+    key = f"{os.path.realpath(image_path)}\0{size}\0{mtime_ns}"
+    # PNG is lossless, so its compression level only changes the file size and the thumbnail is kept:
+    if thumbnail_format.codec != "png":
+        key += f"\0{thumbnail_format.codec}\0{thumbnail_format.quality}"
+    key_bytes = bytes(key, encoding="UTF-8", errors="surrogateescape")
+    extension = THUMBNAIL_EXTENSIONS.get(thumbnail_format.codec, "png")
+    return cache_dir / f"{hashlib.md5(key_bytes, usedforsecurity=False).hexdigest()}.{extension}"
+
+
+def import_gdk_pixbuf():
+    """Import GdkPixbuf and GLib, returning both of them"""
+    import gi
+    gi.require_version("GdkPixbuf", "2.0")
+    from gi.repository import GdkPixbuf, GLib
+    return GdkPixbuf, GLib
+
+
+def pixbuf_to_pil(pixbuf: GdkPixbuf.Pixbuf) -> Image.Image:
+    from PIL import Image
+    mode = "RGBA" if pixbuf.get_has_alpha() else "RGB"
+    data = pixbuf.read_pixel_bytes().get_data()
+    # The last row of a pixbuf may be shorter than the rowstride:
+    data += b"\0" * (pixbuf.get_rowstride() * pixbuf.get_height() - len(data))
+    return Image.frombytes(mode, (pixbuf.get_width(), pixbuf.get_height()), data, "raw", mode, pixbuf.get_rowstride())
+
+
+def save_pil_thumbnail(image: Image.Image, path: Path, thumbnail_format: ThumbnailFormat) -> None:
+    if thumbnail_format.codec == "jpeg":
+        image.convert("RGB").save(str(path), "JPEG", quality=thumbnail_format.quality)
+    elif thumbnail_format.codec == "webp":
+        image.save(str(path), "WEBP", quality=thumbnail_format.quality)
+    else:
+        image.save(str(path), "PNG", compress_level=thumbnail_format.compression)
+
+
+def save_thumbnail(pixbuf: GdkPixbuf.Pixbuf, path: Path, thumbnail_format: ThumbnailFormat) -> None:
+    """Save the thumbnail with the requested codec"""
+    _, GLib = import_gdk_pixbuf()
+    if thumbnail_format.codec == "jpeg":
+        pixbuf.savev(str(path), "jpeg", ["quality"], [str(thumbnail_format.quality)])
+    elif thumbnail_format.codec == "webp":
+        # Saving webp with GdkPixbuf requires an optional loader, so PIL is used without it:
+        try:
+            pixbuf.savev(str(path), "webp", ["quality"], [str(thumbnail_format.quality)])
+        except GLib.GError:
+            save_pil_thumbnail(pixbuf_to_pil(pixbuf), path, thumbnail_format)
+    else:
+        pixbuf.savev(str(path), "png", ["compression"], [str(thumbnail_format.compression)])
+
+
+def load_thumbnail_file(path: Path) -> GdkPixbuf.Pixbuf:
+    """Load a cached thumbnail of any codec, using PIL for those that GdkPixbuf has no loader for"""
+    GdkPixbuf, GLib = import_gdk_pixbuf()
+    try:
+        return GdkPixbuf.Pixbuf.new_from_file(str(path))
+    except GLib.GError:
+        from PIL import Image
+        try:
+            image = Image.open(path).convert("RGBA")
+        except OSError:
+            raise GLib.GError(f"Could not load thumbnail {path}")
+        return GdkPixbuf.Pixbuf.new_from_bytes(GLib.Bytes.new(image.tobytes()), GdkPixbuf.Colorspace.RGB, True, 8,
+                                              image.width, image.height, image.width * 4)
+
+
+@functools.cache
+def get_ffmpeg_executable() -> str | None:
+    """Find ffmpeg once per process, preferring the binary that imageio uses"""
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except (ImportError, RuntimeError):
+        return shutil.which("ffmpeg")
+
+
+def get_ffmpeg_codec_options(thumbnail_format: ThumbnailFormat) -> list[str]:
+    if thumbnail_format.codec == "jpeg":
+        # The mjpeg quantizer goes from 2 (best) to 31 (worst):
+        return ["-c:v", "mjpeg", "-q:v", str(round(31 - 29 * thumbnail_format.quality / 100))]
+    if thumbnail_format.codec == "webp":
+        return ["-c:v", "libwebp", "-quality", str(thumbnail_format.quality)]
+    return ["-c:v", "png", "-compression_level", str(thumbnail_format.compression)]
+
+
+def cache_video_frame(video_path: str, output_file: Path, width: int,
+                      thumbnail_format: ThumbnailFormat = ThumbnailFormat()) -> None:
+    """Save a frame of the video scaled to the width, letting ffmpeg seek to a keyframe and decode only that frame"""
+    for seek in (VIDEO_PREVIEW_SEEK, 0):
+        command = [get_ffmpeg_executable(), "-nostdin", "-loglevel", "error", "-y", "-threads", "1",
+                   "-ss", str(seek), "-i", video_path, "-an", "-sn", "-frames:v", "1",
+                   "-vf", f"scale={width}:-2", "-f", "image2", "-update", "1",
+                   *get_ffmpeg_codec_options(thumbnail_format), str(output_file)]
+        # A corrupt video should not stall the caching of other images:
+        result = subprocess.run(command, timeout=VIDEO_PREVIEW_TIMEOUT, capture_output=True, text=True)
+
+        # Videos shorter than the seek position produce no frame, so the start is used instead:
+        if result.returncode == 0 and output_file.exists() and output_file.stat().st_size > 0:
+            return
+    raise RuntimeError(f"ffmpeg could not extract a frame: {result.stderr.strip()}")
 
 
-def cache_image(image_path: str, cache_dir: Path) -> None:
+def cache_image(image_path: str, cache_dir: Path, thumbnail_format: ThumbnailFormat = ThumbnailFormat()) -> None:
     """Create small copies of images using various libraries depending on the file type"""
+    GdkPixbuf, _ = import_gdk_pixbuf()
+    from PIL import Image
     ext = os.path.splitext(image_path)[1].lower()
-    cache_file = get_cached_image_path(image_path, cache_dir)
+    cache_file = get_cached_image_path(image_path, cache_dir, thumbnail_format=thumbnail_format)
+    temp_file = cache_file.with_name(f"{cache_file.stem}.{os.getpid()}-{threading.get_ident()}.tmp")
     width = 240
     try:
-        # If it's a video, extract the first frame:
+        # If it's a video, extract a scaled down frame with ffmpeg, or the first frame through imageio without it:
         if ext in VIDEO_EXTENSIONS:
-            reader = imageio.get_reader(image_path)
-            first_frame = reader.get_data(0)
-            # Convert the numpy array to a PIL image:
-            pil_image = Image.fromarray(first_frame)
-            aspect_ratio = pil_image.height / pil_image.width
-            new_height = int(width * aspect_ratio)
-            resized_image = pil_image.resize((width, new_height))
-            resized_image.save(str(cache_file), "JPEG")
-            return
+            if get_ffmpeg_executable():
+                cache_video_frame(image_path, temp_file, width, thumbnail_format)
+            else:
+                import imageio
+                reader = imageio.get_reader(image_path)
+                first_frame = reader.get_data(0)
+                # Convert the numpy array to a PIL image:
+                pil_image = Image.fromarray(first_frame)
+                aspect_ratio = pil_image.height / pil_image.width
+                new_height = int(width * aspect_ratio)
+                resized_image = pil_image.resize((width, new_height))
+                save_pil_thumbnail(resized_image, temp_file, thumbnail_format)
 
         # If it's an image, create preview depending on the filetype
-        if ext == ".webp":
-            img = Image.open(image_path)
-            data = img.tobytes()
-
-            img_width, img_height = img.size
-            has_alpha = img.has_transparency_data
-            rowstride = img_width * (3 + int(has_alpha))
-
-            pixbuf = GdkPixbuf.Pixbuf.new_from_data(data, GdkPixbuf.Colorspace.RGB, has_alpha, 8, img_width, img_height, rowstride)
         else:
-            pixbuf = GdkPixbuf.Pixbuf.new_from_file(str(image_path))
-        aspect_ratio = pixbuf.get_width() / pixbuf.get_height()
-        height = int(width / aspect_ratio)
-        scaled_pixbuf = pixbuf.scale_simple(width, height, GdkPixbuf.InterpType.BILINEAR)
-        scaled_pixbuf.savev(str(cache_file), "png", [], [])
+            if ext == ".webp":
+                img = Image.open(image_path)
+                has_alpha = img.has_transparency_data
+
+                # Shrink right after decoding, so that the full size image is not converted and copied:
+                img.thumbnail((width, img.height))
+                img = img.convert("RGBA" if has_alpha else "RGB")
+                data = img.tobytes()
+
+                img_width, img_height = img.size
+                rowstride = img_width * (3 + int(has_alpha))
+
+                pixbuf = GdkPixbuf.Pixbuf.new_from_data(data, GdkPixbuf.Colorspace.RGB, has_alpha, 8, img_width, img_height, rowstride)
+            else:
+                # Loaders that can decode at a reduced resolution do so, like the JPEG loader with DCT scaling:
+                pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(str(image_path), width, -1, True)
+            aspect_ratio = pixbuf.get_width() / pixbuf.get_height()
+            height = int(width / aspect_ratio)
+            scaled_pixbuf = pixbuf.scale_simple(width, height, GdkPixbuf.InterpType.BILINEAR)
+            save_thumbnail(scaled_pixbuf, temp_file, thumbnail_format)
 
     # If image processing failed, create a black placeholder:
     except Exception as e:
@@ -210,4 +356,115 @@ def cache_image(image_path: str, cache_dir: Path) -> None:
         print(e)
         black_pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8, width, width*9/16)
         black_pixbuf.fill(0x0)
-        black_pixbuf.savev(str(cache_file), "png", [], [])
+        save_thumbnail(black_pixbuf, temp_file, thumbnail_format)
+
+    # Thumbnails appear under their final name only once complete, so other processes never read a partial file:
+    os.replace(temp_file, cache_file)
+
+
+def get_thumbnail_aspect(thumbnail_path: Path) -> float | None:
+    """Get the aspect ratio of the thumbnail, which is the one of its image, reading only the file header"""
+    from PIL import Image
+    try:
+        with Image.open(thumbnail_path) as img:
+            width, height = img.size
+        return width / height if height else None
+    except Exception:
+        return None
+
+
+def record_cached_images(image_paths: list[str], cache_dir: Path,
+                         thumbnail_format: ThumbnailFormat = ThumbnailFormat()) -> None:
+    """Add newly created thumbnails to the manifest of the cache"""
+    thumbnails = [(path, get_cached_image_path(path, cache_dir, thumbnail_format=thumbnail_format)) for path in image_paths]
+    aspects = {path: get_thumbnail_aspect(thumbnail) for path, thumbnail in thumbnails}
+    ThumbnailCache(cache_dir).add(thumbnails, {path: aspect for path, aspect in aspects.items() if aspect})
+
+
+def collect_cache_garbage(cache_dir: Path, max_size: int = 0, max_entries: int = 0,
+                          thumbnail_format: ThumbnailFormat = ThumbnailFormat()) -> GarbageCollectionResult:
+    """Remove unused thumbnails and keep the cache within the size in MB and the number of entries.
+    Thumbnails saved with another codec than the current one are unused as well."""
+    cache = ThumbnailCache(cache_dir, max_size * 1024 * 1024, max_entries)
+    result = cache.collect_garbage(functools.partial(get_cached_image_path, thumbnail_format=thumbnail_format))
+    ThumbnailPack(cache_dir).compact()
+    return result
+
+
+def pack_thumbnails(image_paths: list[str], cache_dir: Path,
+                    thumbnail_format: ThumbnailFormat = ThumbnailFormat()) -> None:
+    """Copy the pixels of cached thumbnails into the thumbnail pack"""
+    _, GLib = import_gdk_pixbuf()
+    thumbnails = []
+    for image_path in image_paths:
+        cached_image_path = get_cached_image_path(image_path, cache_dir, thumbnail_format=thumbnail_format)
+        try:
+            pixbuf = load_thumbnail_file(cached_image_path)
+        except GLib.GError:
+            continue
+        thumbnails.append((cached_image_path.name, pixbuf.get_width(), pixbuf.get_height(), pixbuf.get_rowstride(),
+                           pixbuf.get_has_alpha(), pixbuf.read_pixel_bytes().get_data()))
+    ThumbnailPack(cache_dir).append(thumbnails)
+
+
+def load_packed_thumbnail(pack: ThumbnailPack, name: str, record: PackRecord) -> GdkPixbuf.Pixbuf | None:
+    """Create a thumbnail from the pixels in the pack without decoding a file"""
+    GdkPixbuf, GLib = import_gdk_pixbuf()
+    pixels = pack.read(name, record)
+    if pixels is None:
+        return None
+    return GdkPixbuf.Pixbuf.new_from_bytes(GLib.Bytes.new(pixels), GdkPixbuf.Colorspace.RGB, record.has_alpha, 8,
+                                          record.width, record.height, record.rowstride)
+
+
+def cache_images(image_paths: list[str], cache_dir: Path, workers: int = 0,
+                 thumbnail_format: ThumbnailFormat = ThumbnailFormat()) -> Iterator[str]:
+    """Create thumbnails of several images on a pool of processes, yielding each path once it is cached.
+    The number of workers defaults to the number of CPUs."""
+    cached_paths: list[str] = []
+    try:
+        for image_path in cache_images_in_pool(image_paths, cache_dir, workers, thumbnail_format):
+            cached_paths.append(image_path)
+            yield image_path
+    finally:
+        record_cached_images(cached_paths, cache_dir, thumbnail_format)
+
+
+def cache_images_in_pool(image_paths: list[str], cache_dir: Path, workers: int,
+                         thumbnail_format: ThumbnailFormat) -> Iterator[str]:
+    workers = min(workers or os.cpu_count() or 1, len(image_paths))
+    if workers <= 1:
+        for image_path in image_paths:
+            cache_image(image_path, cache_dir, thumbnail_format)
+            yield image_path
+        return
+
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from concurrent.futures.process import BrokenProcessPool
+
+    # Forking a process that runs GTK is unsafe, so workers are started from a clean process:
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+    remaining = set(image_paths)
+    try:
+        futures = {executor.submit(cache_image, image_path, cache_dir, thumbnail_format): image_path for image_path in image_paths}
+        for future in as_completed(futures):
+            image_path = futures[future]
+            try:
+                future.result()
+            except BrokenProcessPool:
+                break
+            except Exception as e:
+                print(f"Could not generate preview for {os.path.basename(image_path)}")
+                print(e)
+            remaining.discard(image_path)
+            yield image_path
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    # If worker processes could not run, cache the rest in this process:
+    for image_path in image_paths:
+        if image_path in remaining:
+            cache_image(image_path, cache_dir, thumbnail_format)
+            yield image_path
@@ -4,11 +4,12 @@ import configparser
 import pathlib
 from argparse import Namespace
 from typing import List
-from platformdirs import user_config_path, user_pictures_path, user_cache_path, user_state_path
+from platformdirs import user_config_path, user_pictures_path, user_cache_path, user_state_path, user_runtime_path
 
 from waypaper.options import FILL_OPTIONS, SORT_OPTIONS, SWWW_TRANSITION_TYPES, SWWW_FILTER_TYPES, BACKEND_OPTIONS, \
-    LINUX_WALLPAPERENGINE_CLAMP
-from waypaper.common import check_installed_backends
+    LINUX_WALLPAPERENGINE_CLAMP, THUMBNAIL_FORMATS, RANDOM_MODES
+from waypaper.common import check_installed_backends, ThumbnailFormat
+from waypaper.randomizer import SelectionWeights
 
 
 class Config:
@@ -50,15 +51,35 @@ class Config:
         self.config_file = self.config_dir / "config.ini"
         self.state_dir = user_state_path(self.name)
         self.state_file = self.state_dir / "state.ini"
+        self.control_socket = user_runtime_path(self.name) / "waypaperd.sock"
         self.style_file = self.config_dir / "style.css"
         self.keybindings_file = self.config_dir / "keybindings.ini"
         self.use_xdg_state = False
         self.use_post_command = True
         self.show_path_in_tooltip = True
         self.waypaperd_cycle_length = 1800
+        self.waypaperd_align_to_clock = False
+        self.waypaperd_monitor_intervals: dict[str, int] = {}
+        self.waypaperd_skip_on_battery = False
+        self.waypaperd_skip_when_idle = True
+        self.waypaperd_skip_command = ""
         self.slideshow_interval = 60
         self.slideshow_enabled = False
         self.show_slideshow_panel = False
+        self.thumbnail_workers = 0
+        self.thumbnail_memory_limit = 256
+        self.cache_max_size = 1024
+        self.cache_max_entries = 0
+        self.thumbnail_pack = False
+        self.thumbnail_format = THUMBNAIL_FORMATS[0]
+        self.thumbnail_quality = 90
+        self.thumbnail_compression = 6
+        self.random_mode = RANDOM_MODES[0]
+        self.random_folder_weights: dict[pathlib.Path, float] = {}
+        self.random_favorites: list[pathlib.Path] = []
+        self.random_favorite_weight = 4.0
+        self.random_recency_half_life = 24.0
+        self.random_aspect_fit = 1.0
 
         # options for linux-wallpaperengine
         self.linux_wallpaperengine_clamp = LINUX_WALLPAPERENGINE_CLAMP[0]
@@ -79,6 +100,19 @@ class Config:
         self.state_dir.mkdir(parents=True, exist_ok=True)
 
 
+    def get_thumbnail_format(self) -> ThumbnailFormat:
+        return ThumbnailFormat(self.thumbnail_format, self.thumbnail_quality, self.thumbnail_compression)
+
+
+    def get_selection_weights(self) -> SelectionWeights | None:
+        """Settings of the weighted random selection, or None if wallpapers are shuffled"""
+        if self.random_mode != "weighted":
+            return None
+        return SelectionWeights({str(folder): weight for folder, weight in self.random_folder_weights.items()},
+                                frozenset(str(path) for path in self.random_favorites), self.random_favorite_weight,
+                                self.random_recency_half_life, self.random_aspect_fit)
+
+
     def select_wallpaper(self, path_str: str) -> None:
         self.selected_wallpaper = pathlib.Path(path_str)
 
@@ -99,6 +133,36 @@ class Config:
         return image_folder_list
 
 
+    def get_key_value_lines(self, config, option: str) -> list[tuple[str, str]]:
+        """Read lines of keys with their values, like '~/Pictures/nature = 2'"""
+        lines = []
+        for line in config.get("Settings", option, fallback="", raw=True).split("\n"):
+            key, separator, value = line.rpartition("=")
+            if separator and key.strip():
+                lines.append((key.strip(), value.strip()))
+        return lines
+
+
+    def get_folder_weights(self, config) -> dict[pathlib.Path, float]:
+        folder_weights = {}
+        for folder, weight in self.get_key_value_lines(config, "random_folder_weights"):
+            try:
+                folder_weights[pathlib.Path(folder).expanduser()] = float(weight)
+            except ValueError:
+                continue
+        return folder_weights
+
+
+    def get_monitor_intervals(self, config) -> dict[str, int]:
+        monitor_intervals = {}
+        for monitor, interval in self.get_key_value_lines(config, "waypaperd_monitor_intervals"):
+            try:
+                monitor_intervals[monitor] = int(interval)
+            except ValueError:
+                continue
+        return monitor_intervals
+
+
     def read(self) -> None:
         """Load data from the config.ini or use default if it does not exist"""
         config = configparser.ConfigParser()
@@ -128,9 +192,25 @@ class Config:
         self.use_xdg_state = config.getboolean("Settings", "use_xdg_state", fallback=self.use_xdg_state)
         self.show_path_in_tooltip = config.getboolean("Settings", "show_path_in_tooltip", fallback=self.show_path_in_tooltip)
         self.waypaperd_cycle_length = int(config.get("Settings", "waypaperd_cycle_length", fallback=self.waypaperd_cycle_length))
+        self.waypaperd_align_to_clock = config.getboolean("Settings", "waypaperd_align_to_clock", fallback=self.waypaperd_align_to_clock)
+        self.waypaperd_skip_on_battery = config.getboolean("Settings", "waypaperd_skip_on_battery", fallback=self.waypaperd_skip_on_battery)
+        self.waypaperd_skip_when_idle = config.getboolean("Settings", "waypaperd_skip_when_idle", fallback=self.waypaperd_skip_when_idle)
+        self.waypaperd_skip_command = config.get("Settings", "waypaperd_skip_command", fallback=self.waypaperd_skip_command)
         self.slideshow_interval = config.getint("Settings", "slideshow_interval", fallback=self.slideshow_interval)
         self.slideshow_enabled = config.getboolean("Settings", "slideshow_enabled", fallback=self.slideshow_enabled)
         self.show_slideshow_panel = config.getboolean("Settings", "show_slideshow_panel", fallback=self.show_slideshow_panel)
+        self.thumbnail_workers = config.getint("Settings", "thumbnail_workers", fallback=self.thumbnail_workers)
+        self.thumbnail_memory_limit = config.getint("Settings", "thumbnail_memory_limit", fallback=self.thumbnail_memory_limit)
+        self.cache_max_size = config.getint("Settings", "cache_max_size", fallback=self.cache_max_size)
+        self.cache_max_entries = config.getint("Settings", "cache_max_entries", fallback=self.cache_max_entries)
+        self.thumbnail_pack = config.getboolean("Settings", "thumbnail_pack", fallback=self.thumbnail_pack)
+        self.thumbnail_format = config.get("Settings", "thumbnail_format", fallback=self.thumbnail_format)
+        self.thumbnail_quality = config.getint("Settings", "thumbnail_quality", fallback=self.thumbnail_quality)
+        self.thumbnail_compression = config.getint("Settings", "thumbnail_compression", fallback=self.thumbnail_compression)
+        self.random_mode = config.get("Settings", "random_mode", fallback=self.random_mode)
+        self.random_favorite_weight = config.getfloat("Settings", "random_favorite_weight", fallback=self.random_favorite_weight)
+        self.random_recency_half_life = config.getfloat("Settings", "random_recency_half_life", fallback=self.random_recency_half_life)
+        self.random_aspect_fit = config.getfloat("Settings", "random_aspect_fit", fallback=self.random_aspect_fit)
         self.style_file = config.get("Settings", "stylesheet", fallback=self.style_file)
         self.keybindings_file = pathlib.Path(config.get("Settings", "keybindings", fallback=self.keybindings_file)).expanduser()
         self.wallpaperengine_folder = pathlib.Path(config.get("Settings", "wallpaperengine_folder", fallback=self.wallpaperengine_folder)).expanduser()
@@ -149,7 +229,11 @@ class Config:
         # Read and convert strings representing lists and paths:
         monitors_str = config.get("Settings", "monitors", fallback=self.selected_monitor, raw=True)
         wallpapers_str = config.get("Settings", "wallpaper", fallback="", raw=True)
+        favorites_str = config.get("Settings", "random_favorites", fallback="", raw=True)
         self.image_folder_list = self.get_image_folder_list("Settings", config)
+        self.random_folder_weights = self.get_folder_weights(config)
+        self.waypaperd_monitor_intervals = self.get_monitor_intervals(config)
+        self.random_favorites = [pathlib.Path(path).expanduser() for path in favorites_str.split("\n") if path.strip()]
         if monitors_str:
             self.monitors = [str(monitor) for monitor in monitors_str.split("\n")]
         if wallpapers_str:
@@ -213,8 +297,33 @@ class Config:
             self.swww_transition_fps = 60
         if int(self.waypaperd_cycle_length) <= 0:
             self.waypaperd_cycle_length = 1800
+        self.waypaperd_monitor_intervals = {monitor: interval for monitor, interval in self.waypaperd_monitor_intervals.items()
+                                            if interval > 0}
         if self.slideshow_interval <= 0:
             self.slideshow_interval = 60
+        if self.thumbnail_workers < 0:
+            self.thumbnail_workers = 0
+        if self.thumbnail_memory_limit <= 0:
+            self.thumbnail_memory_limit = 256
+        if self.cache_max_size < 0:
+            self.cache_max_size = 0
+        if self.cache_max_entries < 0:
+            self.cache_max_entries = 0
+        if self.thumbnail_format not in THUMBNAIL_FORMATS:
+            self.thumbnail_format = THUMBNAIL_FORMATS[0]
+        if not 1 <= self.thumbnail_quality <= 100:
+            self.thumbnail_quality = 90
+        if not 0 <= self.thumbnail_compression <= 9:
+            self.thumbnail_compression = 6
+        if self.random_mode not in RANDOM_MODES:
+            self.random_mode = RANDOM_MODES[0]
+        if self.random_favorite_weight < 0:
+            self.random_favorite_weight = 4.0
+        if self.random_recency_half_life < 0:
+            self.random_recency_half_life = 24.0
+        if self.random_aspect_fit < 0:
+            self.random_aspect_fit = 1.0
+        self.random_folder_weights = {folder: weight for folder, weight in self.random_folder_weights.items() if weight >= 0}
 
 
     def attribute_selected_wallpaper(self) -> None:
@@ -294,9 +403,30 @@ class Config:
         config.set("Settings", "zen_mode", str(self.zen_mode))
         config.set("Settings", "post_command", self.post_command)
         config.set("Settings", "waypaperd_cycle_length", str(self.waypaperd_cycle_length))
+        config.set("Settings", "waypaperd_align_to_clock", str(self.waypaperd_align_to_clock))
+        config.set("Settings", "waypaperd_monitor_intervals",
+                   "\n".join(f"{monitor} = {interval}" for monitor, interval in self.waypaperd_monitor_intervals.items()))
+        config.set("Settings", "waypaperd_skip_on_battery", str(self.waypaperd_skip_on_battery))
+        config.set("Settings", "waypaperd_skip_when_idle", str(self.waypaperd_skip_when_idle))
+        config.set("Settings", "waypaperd_skip_command", self.waypaperd_skip_command)
         config.set("Settings", "slideshow_interval", str(self.slideshow_interval))
         config.set("Settings", "slideshow_enabled", str(self.slideshow_enabled))
         config.set("Settings", "show_slideshow_panel", str(self.show_slideshow_panel))
+        config.set("Settings", "thumbnail_workers", str(self.thumbnail_workers))
+        config.set("Settings", "thumbnail_memory_limit", str(self.thumbnail_memory_limit))
+        config.set("Settings", "cache_max_size", str(self.cache_max_size))
+        config.set("Settings", "cache_max_entries", str(self.cache_max_entries))
+        config.set("Settings", "thumbnail_pack", str(self.thumbnail_pack))
+        config.set("Settings", "thumbnail_format", str(self.thumbnail_format))
+        config.set("Settings", "thumbnail_quality", str(self.thumbnail_quality))
+        config.set("Settings", "thumbnail_compression", str(self.thumbnail_compression))
+        config.set("Settings", "random_mode", self.random_mode)
+        config.set("Settings", "random_folder_weights",
+                   "\n".join(f"{self.shorten_path(folder)} = {weight:g}" for folder, weight in self.random_folder_weights.items()))
+        config.set("Settings", "random_favorites", "\n".join(self.shorten_path(path) for path in self.random_favorites))
+        config.set("Settings", "random_favorite_weight", str(self.random_favorite_weight))
+        config.set("Settings", "random_recency_half_life", str(self.random_recency_half_life))
+        config.set("Settings", "random_aspect_fit", str(self.random_aspect_fit))
         config.set("Settings", "number_of_columns", str(self.number_of_columns))
         config.set("Settings", "swww_transition_type", str(self.swww_transition_type))
         config.set("Settings", "swww_filter", str(self.swww_filter))
@@ -0,0 +1,207 @@
+"""Module with a persistent index of wallpaper folders, so that unchanged directories are not rescanned"""
+
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterator, NamedTuple
+
+from waypaper.options import IMAGE_EXTENSIONS, VIDEO_EXTENSIONS
+
+
+# Only files with these extensions are stored, the backend-specific filtering happens on lookup:
+INDEXED_EXTENSIONS: set[str] = set(VIDEO_EXTENSIONS).union(*IMAGE_EXTENSIONS.values())
+
+# Directories modified this recently are rescanned next time, since a file could still be added
+# within the same mtime tick (some network filesystems only have one second resolution):
+RACY_MTIME_SECONDS = 2
+
+INDEX_SCHEMA_VERSION = 1
+
+
+class IndexEntry(NamedTuple):
+    """Image file as stored in the index. Size and mtime are those of the last scan of its directory,
+    which is not modified when a file is overwritten in place, unless the listing was made with revalidate_files."""
+    path: str
+    size: int
+    mtime_ns: int
+
+
+class FolderIndex:
+    """Index of image files kept in the cache folder and revalidated by directory mtimes"""
+
+    def __init__(self, cache_dir: Path | None) -> None:
+        self.index_file = cache_dir / "folder_index.sqlite" if cache_dir else None
+        self.connection: sqlite3.Connection | None = None
+
+    def open(self) -> None:
+        """Open the index database, recreating it if the schema is outdated"""
+        if self.index_file is None:
+            return
+        try:
+            self.connection = sqlite3.connect(self.index_file, timeout=10)
+            version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+            if version != INDEX_SCHEMA_VERSION:
+                with self.connection:
+                    self.connection.execute("DROP TABLE IF EXISTS directories")
+                    self.connection.execute("DROP TABLE IF EXISTS entries")
+                    self.connection.execute("CREATE TABLE directories (path TEXT PRIMARY KEY, mtime_ns INTEGER)")
+                    self.connection.execute("CREATE TABLE entries (dir TEXT, name TEXT, is_dir INTEGER, "
+                                            "size INTEGER, mtime_ns INTEGER, ext TEXT, PRIMARY KEY (dir, name))")
+                    self.connection.execute(f"PRAGMA user_version = {INDEX_SCHEMA_VERSION}")
+        except sqlite3.Error as e:
+            print(f"Could not open folder index, scanning without it: {e}")
+            self.close()
+
+    def close(self) -> None:
+        if self.connection:
+            self.connection.close()
+        self.connection = None
+
+    def list_directory(self, path: str, revalidate_files: bool = False) -> tuple[list[str], list[IndexEntry]]:
+        """Return subdirectories and image files of the directory, rescanning it only if its mtime changed.
+        With revalidate_files, the files of a stored listing are checked too, which saves only reading the directory."""
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return [], []
+
+        # Use the stored listing if the directory did not change since it was indexed:
+        if self.connection:
+            row = self.connection.execute("SELECT mtime_ns FROM directories WHERE path = ?", (path,)).fetchone()
+            if row and row[0] == mtime_ns:
+                subdirs: list[str] = []
+                files: list[IndexEntry] = []
+                query = "SELECT name, is_dir, size, mtime_ns FROM entries WHERE dir = ? ORDER BY rowid"
+                for name, is_dir, size, file_mtime_ns in self.connection.execute(query, (path,)):
+                    if is_dir:
+                        subdirs.append(name)
+                    else:
+                        files.append(IndexEntry(os.path.join(path, name), size, file_mtime_ns))
+                if revalidate_files:
+                    files = self.revalidate_files(path, files)
+                return subdirs, files
+
+        subdirs, files = self.scan_directory(path)
+        if self.connection:
+            self.store_directory(path, mtime_ns, subdirs, files)
+        return subdirs, files
+
+    def revalidate_files(self, path: str, files: list[IndexEntry]) -> list[IndexEntry]:
+        """Update the size and mtime of files that were overwritten in place since the directory was indexed"""
+        current: list[IndexEntry] = []
+        for file in files:
+            try:
+                stat = os.stat(file.path)
+            except OSError:
+                continue
+            current.append(IndexEntry(file.path, stat.st_size, stat.st_mtime_ns))
+        changed = [(entry.size, entry.mtime_ns, path, os.path.basename(entry.path))
+                   for entry, file in zip(current, files) if entry != file]
+        if changed:
+            try:
+                with self.connection:
+                    self.connection.executemany("UPDATE entries SET size = ?, mtime_ns = ? WHERE dir = ? AND name = ?",
+                                                changed)
+            except sqlite3.Error as e:
+                print(f"Could not update folder index: {e}")
+        return current
+
+    @staticmethod
+    def scan_directory(path: str) -> tuple[list[str], list[IndexEntry]]:
+        """Read the directory from disk"""
+        subdirs: list[str] = []
+        files: list[IndexEntry] = []
+        try:
+            with os.scandir(path) as iterator:
+                for entry in iterator:
+                    try:
+                        if entry.is_dir():
+                            subdirs.append(entry.name)
+                            continue
+                        if os.path.splitext(entry.name)[1].lower() not in INDEXED_EXTENSIONS:
+                            continue
+                        stat = entry.stat()
+                        files.append(IndexEntry(entry.path, stat.st_size, stat.st_mtime_ns))
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+        return subdirs, files
+
+    def store_directory(self, path: str, mtime_ns: int, subdirs: list[str], files: list[IndexEntry]) -> None:
+        """Replace the stored listing of the directory and forget subdirectories that disappeared"""
+        if time.time() - mtime_ns / 1e9 < RACY_MTIME_SECONDS:
+            mtime_ns = -1
+        try:
+            with self.connection:
+                old_subdirs = [row[0] for row in self.connection.execute(
+                    "SELECT name FROM entries WHERE dir = ? AND is_dir = 1", (path,))]
+                for name in set(old_subdirs) - set(subdirs):
+                    self.forget_tree(os.path.join(path, name))
+                self.connection.execute("DELETE FROM entries WHERE dir = ?", (path,))
+                self.connection.executemany(
+                    "INSERT INTO entries VALUES (?, ?, 1, 0, 0, '')",
+                    [(path, name) for name in subdirs])
+                self.connection.executemany(
+                    "INSERT INTO entries VALUES (?, ?, 0, ?, ?, ?)",
+                    [(path, os.path.basename(f.path), f.size, f.mtime_ns, os.path.splitext(f.path)[1].lower())
+                     for f in files])
+                self.connection.execute("INSERT OR REPLACE INTO directories VALUES (?, ?)", (path, mtime_ns))
+        except sqlite3.Error as e:
+            print(f"Could not update folder index: {e}")
+
+    def forget_tree(self, path: str) -> None:
+        """Remove the directory and everything below it from the index"""
+        pattern = path.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + os.sep + "%"
+        self.connection.execute("DELETE FROM directories WHERE path = ? OR path LIKE ? ESCAPE '\\'", (path, pattern))
+        self.connection.execute("DELETE FROM entries WHERE dir = ? OR dir LIKE ? ESCAPE '\\'", (path, pattern))
+
+    def walk(self,
+             folder: Path,
+             include_subfolders: bool = False,
+             include_all_subfolders: bool = False,
+             include_hidden: bool = False,
+             revalidate_files: bool = False) -> Iterator[IndexEntry]:
+        """Yield image files of the folder in the same order as a top-down os.walk would"""
+        if not include_subfolders:
+            max_depth = 0
+        elif not include_all_subfolders:
+            max_depth = 1
+        else:
+            max_depth = -1
+
+        stack = [(str(folder), 0)]
+        while stack:
+            path, depth = stack.pop()
+            subdirs, files = self.list_directory(path, revalidate_files)
+            for file in files:
+                if os.path.basename(file.path).startswith('.') and not include_hidden:
+                    continue
+                yield file
+
+            # Descend into subfolders if requested:
+            if depth == max_depth:
+                continue
+            for name in reversed(subdirs):
+                if name.startswith('.') and not include_hidden:
+                    continue
+                stack.append((os.path.join(path, name), depth + 1))
+
+    def list_images(self,
+                    folder_list: list[Path],
+                    include_subfolders: bool = False,
+                    include_all_subfolders: bool = False,
+                    include_hidden: bool = False,
+                    revalidate_files: bool = False) -> list[IndexEntry]:
+        """Get all indexed files from the folders, updating the index where directories changed.
+        Files are checked one by one only with revalidate_files, for callers that need their current size and mtime."""
+        self.open()
+        try:
+            entries: list[IndexEntry] = []
+            for folder in folder_list:
+                entries.extend(self.walk(folder, include_subfolders, include_all_subfolders, include_hidden,
+                                         revalidate_files))
+            return entries
+        finally:
+            self.close()
@@ -10,6 +10,8 @@ FILL_OPTIONS: List[str] = ["fill", "stretch", "fit", "center", "tile"]
 LINUX_WALLPAPERENGINE_FILL_OPTIONS: List[str] = ["fill", "stretch", "fit", "default"]
 SORT_OPTIONS: List[str] = ["name", "namerev", "date", "daterev", "random"]
 SORT_DISPLAYS: Dict[str, str] = {"name": "Name ↓", "namerev": "Name ↑", "date": "Date ↓", "daterev": "Date ↑", "random": "Random"}
+THUMBNAIL_FORMATS: List[str] = ["png", "jpeg", "webp"]
+RANDOM_MODES: List[str] = ["shuffle", "weighted"]
 
 VIDEO_EXTENSIONS: List[str] = ['.webm', '.mkv', '.flv', '.vob', '.ogv', '.ogg', '.rrc', '.gifv', '.mng', '.mov',
                                '.avi', '.qt', '.wmv', '.yuv', '.rm', '.asf', '.amv', '.mp4', '.m4p', '.m4v',
@@ -119,3 +121,27 @@ def get_monitor_options(backend) -> List[str]:
     """Get a list of available monitors for the CLI."""
     mons = get_monitors(backend)
     return ["All"] + mons if mons else ["All"]
+
+
+def get_monitor_aspects(backend, monitor_names: List[str]) -> List[float | None]:
+    """Get the aspect ratio of each monitor, where "All" stands for the first monitor.
+    Returns None for monitors that are not found or if an error occurs."""
+    sizes: dict[str, tuple[int, int]] = {}
+    try:
+        if backend == "hyprpaper":
+            monitors_info = subprocess.run(["hyprctl", "monitors", "-j"], capture_output=True, text=True, check=True)
+            for monitor in json.loads(monitors_info.stdout):
+                # Odd transforms rotate the monitor by 90 or 270 degrees:
+                width, height = monitor["width"], monitor["height"]
+                sizes[monitor["name"]] = (height, width) if monitor.get("transform", 0) % 2 else (width, height)
+        else:
+            from screeninfo import get_monitors as _get_monitors
+            sizes = {m.name: (m.width, m.height) for m in _get_monitors()}
+    except Exception as e:
+        print(f"Error fetching monitor sizes: {e}")
+
+    aspects: List[float | None] = []
+    for name in monitor_names:
+        size = sizes.get(name) if name != "All" else next(iter(sizes.values()), None)
+        aspects.append(size[0] / size[1] if size and size[1] else None)
+    return aspects
@@ -0,0 +1,388 @@
+"""Module that picks random wallpapers, either without repeating them until all were shown or by their weights"""
+
+import contextlib
+import fcntl
+import math
+import os
+import random
+import time
+import zlib
+from pathlib import Path
+from typing import Iterator, NamedTuple
+
+
+# The history is compacted to its most recent entries once it grows over this size:
+HISTORY_MAX_BYTES = 256 * 1024
+HISTORY_KEEP_ENTRIES = 1000
+
+# Weighted picks are not part of a shuffle bag, so they are logged with this fingerprint instead:
+WEIGHTED_FINGERPRINT = "weighted"
+
+
+class HistoryEntry(NamedTuple):
+    """Picked wallpaper together with the position in the shuffle bag after the pick"""
+    timestamp: float
+    fingerprint: str
+    offset: int
+    path: str
+
+    def to_bytes(self) -> bytes:
+        return f"{self.timestamp:.3f}\t{self.fingerprint}\t{self.offset}\t".encode() + os.fsencode(self.path) + b"\n"
+
+    @staticmethod
+    def from_bytes(line: bytes) -> "HistoryEntry":
+        timestamp, fingerprint, offset, path = line.rstrip(b"\n").split(b"\t", 3)
+        return HistoryEntry(float(timestamp), fingerprint.decode(), int(offset), os.fsdecode(path))
+
+
+class HistoryLog:
+    """Append-only log of picked wallpapers shared by the GUI, the CLI and the daemon.
+    Writers hold an exclusive lock, and a partially written last line after a crash is ignored."""
+
+    def __init__(self, cache_dir: Path) -> None:
+        self.log_file = cache_dir / "history.log"
+        self.lock_file = cache_dir / "history.lock"
+
+    @contextlib.contextmanager
+    def lock(self) -> Iterator[None]:
+        # The lock is taken on a separate file, since compaction replaces the log file:
+        fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def read_tail(self, count: int) -> list[HistoryEntry]:
+        """Get the last complete entries, reading only the end of the log"""
+        try:
+            with self.log_file.open("rb") as file:
+                size = file.seek(0, os.SEEK_END)
+                chunk_size = 4096
+                while True:
+                    start = max(0, size - chunk_size)
+                    file.seek(start)
+                    lines = file.read(size - start).split(b"\n")
+                    # The last item is empty for a complete log, or a partially written line:
+                    complete_lines = lines[1:-1] if start > 0 else lines[:-1]
+                    if len(complete_lines) >= count or start == 0:
+                        break
+                    chunk_size *= 4
+        except OSError:
+            return []
+
+        entries = []
+        for line in complete_lines[-count:]:
+            try:
+                entries.append(HistoryEntry.from_bytes(line))
+            except ValueError:
+                continue
+        return entries
+
+    def last(self) -> HistoryEntry | None:
+        entries = self.read_tail(1)
+        return entries[0] if entries else None
+
+    def append(self, entries: list[HistoryEntry]) -> None:
+        """Add entries with a single write, and compact the log once it is too long. Call with the lock held."""
+        with self.log_file.open("ab") as file:
+            # Start on a new line if the previous writer crashed in the middle of a line:
+            if file.tell() > 0 and not self.ends_with_newline():
+                file.write(b"\n")
+            file.write(b"".join(entry.to_bytes() for entry in entries))
+            file.flush()
+            size = file.tell()
+        if size > HISTORY_MAX_BYTES:
+            self.compact()
+
+    def ends_with_newline(self) -> bool:
+        with self.log_file.open("rb") as file:
+            file.seek(-1, os.SEEK_END)
+            return file.read(1) == b"\n"
+
+    def compact(self) -> None:
+        """Keep only the most recent entries, replacing the log atomically. Call with the lock held."""
+        entries = self.read_tail(HISTORY_KEEP_ENTRIES)
+        temp_file = self.log_file.with_name(f"{self.log_file.name}.{os.getpid()}.tmp")
+        with temp_file.open("wb") as file:
+            file.write(b"".join(entry.to_bytes() for entry in entries))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_file, self.log_file)
+
+
+def get_fingerprint(paths: list[str]) -> str:
+    """Identify the set of paths regardless of their order, which may change when folders are rescanned"""
+    checksum = 0
+    for path in paths:
+        checksum = (checksum + zlib.crc32(os.fsencode(path))) % (1 << 64)
+    return f"{len(paths)}-{checksum:016x}"
+
+
+class ShuffleBag:
+    """Random permutation of the wallpapers stored in the cache folder, which is read one line at a time.
+    The bag is shuffled again once all wallpapers were picked or when the wallpapers change."""
+
+    def __init__(self, cache_dir: Path) -> None:
+        self.bag_file = cache_dir / "shuffle_bag.txt"
+        self.history = HistoryLog(cache_dir)
+
+    def read_used(self, state: HistoryEntry) -> set[str]:
+        """Get wallpapers that were already picked from the current bag"""
+        try:
+            with self.bag_file.open("rb") as file:
+                if file.readline().strip().decode() != state.fingerprint:
+                    return set()
+                used_bytes = file.read(max(0, state.offset - file.tell()))
+        except (OSError, ValueError):
+            return set()
+        return {os.fsdecode(line) for line in used_bytes.splitlines()}
+
+    def refill(self, paths: list[str], fingerprint: str, used: set[str], avoid: set[str]) -> int:
+        """Write a new permutation of the wallpapers that were not used yet, and return the offset of its start.
+        Wallpapers to avoid, like those that were just shown, are moved to the end of the permutation."""
+        remaining = [path for path in paths if path not in used]
+        if not remaining:
+            remaining = list(paths)
+        random.shuffle(remaining)
+        remaining.sort(key=lambda path: path in avoid)
+
+        header = f"{fingerprint}\n".encode()
+        temp_file = self.bag_file.with_name(f"{self.bag_file.name}.{os.getpid()}.tmp")
+        with temp_file.open("wb") as file:
+            file.write(header)
+            file.write(b"".join(os.fsencode(path) + b"\n" for path in remaining))
+        os.replace(temp_file, self.bag_file)
+        return len(header)
+
+    def pick(self, paths: list[str]) -> str | None:
+        """Take the next wallpaper from the bag, which is shuffled again if the wallpapers changed"""
+        picks = self.pick_many(paths, 1)
+        return picks[0] if picks else None
+
+    def pick_many(self, paths: list[str], count: int) -> list[str]:
+        """Take several wallpapers from the bag at once, which are distinct if there are enough wallpapers"""
+        paths = [path for path in paths if "\n" not in path]
+        if not paths:
+            return []
+        fingerprint = get_fingerprint(paths)
+
+        # Concurrent picks, for example by the daemon and the GUI, take turns so that they never get the same line:
+        with self.history.lock():
+            state = self.history.last()
+            last_pick = state.path if state else ""
+            if state is None or state.fingerprint != fingerprint:
+                used = self.read_used(state) if state else set()
+                offset = self.refill(paths, fingerprint, used, {last_pick})
+            else:
+                offset = state.offset
+
+            entries: list[HistoryEntry] = []
+            picks: list[str] = []
+            for _ in range(count):
+                line = self.read_line(offset)
+                if not line:
+                    # Do not show the same wallpaper twice in a row when the bag starts over:
+                    offset = self.refill(paths, fingerprint, set(), set(picks) | {last_pick})
+                    line = self.read_line(offset)
+                offset += len(line)
+                last_pick = os.fsdecode(line.rstrip(b"\n"))
+                picks.append(last_pick)
+                entries.append(HistoryEntry(time.time(), fingerprint, offset, last_pick))
+
+            self.history.append(entries)
+        return picks
+
+    def read_line(self, offset: int) -> bytes:
+        try:
+            with self.bag_file.open("rb") as file:
+                file.seek(offset)
+                return file.readline()
+        except OSError:
+            return b""
+
+
+class SelectionWeights(NamedTuple):
+    """Settings of the weighted random selection"""
+    folder_weights: dict[str, float]
+    favorites: frozenset[str]
+    favorite_weight: float = 4.0
+    recency_half_life: float = 24.0
+    aspect_fit: float = 1.0
+
+
+class FenwickTree:
+    """Prefix sums of weights that allow to change a weight and to find a weighted position in O(log n)"""
+
+    def __init__(self, weights: list[float]) -> None:
+        self.weights = list(weights)
+        self.tree = [0.0] + self.weights
+        for index in range(1, len(self.tree)):
+            parent = index + (index & -index)
+            if parent < len(self.tree):
+                self.tree[parent] += self.tree[index]
+
+    def __len__(self) -> int:
+        return len(self.weights)
+
+    def total(self) -> float:
+        """Sum of all weights"""
+        total = 0.0
+        index = len(self.weights)
+        while index > 0:
+            total += self.tree[index]
+            index -= index & -index
+        return total
+
+    def set(self, position: int, weight: float) -> None:
+        delta = weight - self.weights[position]
+        self.weights[position] = weight
+        index = position + 1
+        while index < len(self.tree):
+            self.tree[index] += delta
+            index += index & -index
+
+    def find(self, value: float) -> int:
+        """Get the position whose range of prefix sums contains the value, which is between 0 and the total"""
+        position = 0
+        step = 1 << len(self.weights).bit_length()
+        while step:
+            if position + step < len(self.tree) and self.tree[position + step] <= value:
+                position += step
+                value -= self.tree[position]
+            step >>= 1
+        # Rounding errors of changed weights could end the search on a weight that was set to zero:
+        while position < len(self.weights) - 1 and self.weights[position] <= 0:
+            position += 1
+        return min(position, len(self.weights) - 1)
+
+
+class WeightedPicker:
+    """Random selection weighted by folders, favorites, the time since a wallpaper was shown,
+    and how well its aspect ratio fits the monitor. The picks are logged in the same history as the shuffle bag.
+    The weights of a listing are kept in one Fenwick tree per monitor aspect ratio, so that a picker that is kept
+    between picks, like the one of waypaperd, only updates the wallpapers that were shown recently."""
+
+    def __init__(self, cache_dir: Path, weights: SelectionWeights, aspects: dict[str, float] | None = None) -> None:
+        self.history = HistoryLog(cache_dir)
+        self.weights = weights
+        self.aspects = aspects or {}
+        # Nested folders are matched before the folders that contain them:
+        self.folders = sorted(weights.folder_weights, key=len, reverse=True)
+        self.fingerprint: str | None = None
+        self.paths: list[str] = []
+        self.positions: dict[str, int] = {}
+        self.base_weights: list[float] = []
+        self.trees: dict[float | None, FenwickTree] = {}
+        # Factors applied in the trees to wallpapers that were shown recently or just picked:
+        self.adjusted: dict[int, float] = {}
+
+    def set_weights(self, weights: SelectionWeights, aspects: dict[str, float] | None = None) -> None:
+        """Change the settings and the known aspect ratios, which computes the weights again if they differ"""
+        aspects = aspects or {}
+        if weights == self.weights and aspects == self.aspects:
+            return
+        self.weights = weights
+        self.aspects = aspects
+        self.folders = sorted(weights.folder_weights, key=len, reverse=True)
+        self.fingerprint = None
+
+    def get_folder_weight(self, path: str) -> float:
+        for folder in self.folders:
+            if path.startswith(folder.rstrip(os.sep) + os.sep):
+                return self.weights.folder_weights[folder]
+        return 1.0
+
+    def get_base_weight(self, path: str) -> float:
+        """Weight of the wallpaper by its folder and whether it is a favorite"""
+        weight = self.get_folder_weight(path)
+        if path in self.weights.favorites:
+            weight *= self.weights.favorite_weight
+        return max(weight, 0.0)
+
+    def get_recency_factor(self, age: float | None) -> float:
+        """Recently shown wallpapers start with no chance and get it back with the half-life"""
+        if age is None or self.weights.recency_half_life <= 0:
+            return 1.0
+        return 1 - 0.5 ** (max(age, 0) / 3600 / self.weights.recency_half_life)
+
+    def get_weight(self, path: str, age: float | None) -> float:
+        """Weight of the wallpaper that was shown the given number of seconds ago, or never"""
+        return self.get_base_weight(path) * self.get_recency_factor(age)
+
+    def get_aspect_fit(self, path: str, monitor_aspect: float | None) -> float:
+        """Factor that decreases with the difference of the aspect ratios, and does not penalize unknown images"""
+        image_aspect = self.aspects.get(path)
+        if not monitor_aspect or not image_aspect or not self.weights.aspect_fit:
+            return 1.0
+        return math.exp(-self.weights.aspect_fit * abs(math.log(image_aspect / monitor_aspect)))
+
+    def load_paths(self, paths: list[str]) -> None:
+        """Compute the weights of the wallpapers, unless they are the same as at the last pick"""
+        paths = [path for path in paths if "\n" not in path]
+        fingerprint = get_fingerprint(paths)
+        if fingerprint == self.fingerprint:
+            return
+        self.fingerprint = fingerprint
+        self.paths = paths
+        self.positions = {path: position for position, path in enumerate(paths)}
+        self.base_weights = [self.get_base_weight(path) for path in paths]
+        self.trees = {}
+        self.adjusted = {}
+
+    def get_tree(self, monitor_aspect: float | None) -> FenwickTree:
+        """Weights for monitors of the aspect ratio, built once per listing"""
+        tree = self.trees.get(monitor_aspect)
+        if tree is None:
+            weights = [weight * self.get_aspect_fit(path, monitor_aspect)
+                       for path, weight in zip(self.paths, self.base_weights)]
+            for position, factor in self.adjusted.items():
+                weights[position] *= factor
+            tree = self.trees[monitor_aspect] = FenwickTree(weights)
+        return tree
+
+    def adjust(self, position: int, factor: float) -> None:
+        """Multiply the weight of the wallpaper by the factor in all trees"""
+        for monitor_aspect, tree in self.trees.items():
+            tree.set(position, self.base_weights[position] * self.get_aspect_fit(self.paths[position], monitor_aspect) * factor)
+        if factor == 1.0:
+            self.adjusted.pop(position, None)
+        else:
+            self.adjusted[position] = factor
+
+    def pick_many(self, paths: list[str], monitor_aspects: list[float | None]) -> list[str]:
+        """Pick distinct wallpapers, one for each of the monitors given by their aspect ratio"""
+        self.load_paths(paths)
+        if not self.paths:
+            return []
+
+        with self.history.lock():
+            now = time.time()
+            # Only the wallpapers in the history, which is kept short, and those adjusted before need new weights:
+            factors = dict.fromkeys(self.adjusted, 1.0)
+            for entry in self.history.read_tail(HISTORY_KEEP_ENTRIES):
+                position = self.positions.get(entry.path)
+                if position is not None:
+                    factors[position] = self.get_recency_factor(now - entry.timestamp)
+            for position, factor in factors.items():
+                self.adjust(position, factor)
+
+            # Monitors with the same aspect ratio share a tree, and picked wallpapers are removed from all trees:
+            entries: list[HistoryEntry] = []
+            picks: list[str] = []
+            for monitor_aspect in monitor_aspects:
+                tree = self.get_tree(monitor_aspect)
+                total = tree.total()
+                position = tree.find(random.random() * total) if total > 0 else None
+                # Rounding errors of updated weights can leave a tiny total when all weights are zero:
+                if position is None or tree.weights[position] <= 0:
+                    # All wallpapers have no weight or were already picked, so any other one is fine:
+                    picked_positions = {self.positions[path] for path in picks}
+                    remaining = [position for position in range(len(self.paths)) if position not in picked_positions]
+                    position = random.choice(remaining or range(len(self.paths)))
+                self.adjust(position, 0.0)
+                picks.append(self.paths[position])
+                entries.append(HistoryEntry(now, WEIGHTED_FINGERPRINT, 0, self.paths[position]))
+
+            self.history.append(entries)
+        return picks
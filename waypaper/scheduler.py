@@ -0,0 +1,97 @@
+"""Module with the clock and the timer of waypaperd, which keep counting while the computer is suspended"""
+
+import ctypes
+import ctypes.util
+import math
+import os
+import time
+
+CLOCK_BOOTTIME = 7
+TFD_NONBLOCK = 0o4000
+TFD_CLOEXEC = 0o2000000
+TFD_TIMER_ABSTIME = 1
+
+# Without a timerfd, select waits at most this long, so that a deadline passed during suspend is noticed soon after:
+FALLBACK_MAX_TIMEOUT = 60.0
+
+
+class Timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+
+class Itimerspec(ctypes.Structure):
+    _fields_ = [("it_interval", Timespec), ("it_value", Timespec)]
+
+
+def get_boottime() -> float:
+    """Seconds since boot including the time spent in suspend, or the monotonic clock where that is not available"""
+    if hasattr(time, "CLOCK_BOOTTIME"):
+        return time.clock_gettime(time.CLOCK_BOOTTIME)
+    return time.monotonic()
+
+
+def get_next_deadline(previous: float, interval: float, now: float) -> tuple[float, int]:
+    """Advance the deadline by whole intervals, so that the schedule does not drift by the time the changes take.
+    Returns the new deadline and the number of deadlines that were missed, for example during suspend."""
+    if previous + interval > now:
+        return previous + interval, 0
+    missed = math.floor((now - previous) / interval)
+    return previous + (missed + 1) * interval, missed
+
+
+def get_aligned_deadline(interval: float, now: float) -> float:
+    """Deadline on the boot clock for the next multiple of the interval on the local wall clock,
+    so that an interval of an hour fires on the hour"""
+    wall_time = time.time()
+    local_time = wall_time + time.localtime(wall_time).tm_gmtoff
+    next_boundary = (math.floor(local_time / interval) + 1) * interval
+    return now + next_boundary - local_time
+
+
+class DeadlineTimer:
+    """Timer at an absolute time of the boot clock that select can wait on.
+    It is a timerfd on Linux, and elsewhere the deadline is turned into a timeout of select."""
+
+    def __init__(self) -> None:
+        self.fd = -1
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            self.fd = self.libc.timerfd_create(CLOCK_BOOTTIME, TFD_NONBLOCK | TFD_CLOEXEC)
+        except (OSError, AttributeError):
+            self.fd = -1
+        self.deadline: float | None = None
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def set(self, deadline: float | None) -> None:
+        """Arm the timer, or disarm it with None"""
+        self.deadline = deadline
+        if self.fd < 0:
+            return
+        value = Timespec(0, 0)
+        if deadline is not None:
+            # A zero value would disarm the timer, so deadlines are at least one nanosecond after boot:
+            nanoseconds = max(1, round(deadline * 1e9))
+            value = Timespec(nanoseconds // 10**9, nanoseconds % 10**9)
+        spec = Itimerspec(Timespec(0, 0), value)
+        if self.libc.timerfd_settime(self.fd, TFD_TIMER_ABSTIME, ctypes.byref(spec), None) < 0:
+            raise OSError(ctypes.get_errno(), "timerfd_settime failed")
+
+    def get_timeout(self) -> float | None:
+        """Timeout for select, which is not needed if select waits on the timerfd"""
+        if self.fd >= 0 or self.deadline is None:
+            return None
+        return min(max(0.0, self.deadline - get_boottime()), FALLBACK_MAX_TIMEOUT)
+
+    def clear(self) -> None:
+        """Consume the expiration after select reported the timer as readable"""
+        try:
+            os.read(self.fd, 8)
+        except (BlockingIOError, OSError):
+            pass
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+        self.fd = -1
@@ -0,0 +1,108 @@
+"""Module that decides whether waypaperd should skip a wallpaper change, based on cheap local signals"""
+
+import logging
+import pathlib
+import subprocess
+
+LOG = logging.getLogger(__name__)
+
+POWER_SUPPLY_DIR = pathlib.Path("/sys/class/power_supply")
+
+LOGIND_NAME = "org.freedesktop.login1"
+LOGIND_SESSION_INTERFACE = "org.freedesktop.login1.Session"
+LOGIND_USER_INTERFACE = "org.freedesktop.login1.User"
+LOGIND_AUTO_SESSION = "/org/freedesktop/login1/session/auto"
+
+# Skip commands that hang must not stall the slideshow:
+SKIP_COMMAND_TIMEOUT = 5
+
+SKIP_REASONS = ["battery", "idle", "command"]
+
+
+def read_sysfs_value(path: pathlib.Path) -> str:
+    try:
+        return path.read_text().strip()
+    except OSError:
+        return ""
+
+
+def is_on_battery(power_supply_dir: pathlib.Path = POWER_SUPPLY_DIR) -> bool:
+    """Whether the computer runs on a discharging battery without any online external power.
+    Batteries of devices like wireless mice are ignored."""
+    discharging = False
+    try:
+        supplies = list(power_supply_dir.iterdir())
+    except OSError:
+        return False
+    for supply in supplies:
+        supply_type = read_sysfs_value(supply / "type")
+        if supply_type == "Battery":
+            if read_sysfs_value(supply / "scope") == "Device":
+                continue
+            discharging = discharging or read_sysfs_value(supply / "status") == "Discharging"
+        elif read_sysfs_value(supply / "online") == "1":
+            return False
+    return discharging
+
+
+def run_skip_command(command: str) -> bool:
+    """Whether the user command asks to skip the change by exiting with zero status"""
+    try:
+        return subprocess.run(command, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                              timeout=SKIP_COMMAND_TIMEOUT).returncode == 0
+    except (OSError, subprocess.TimeoutExpired) as e:
+        LOG.warning("Skip command failed: %s", e)
+        return False
+
+
+class ThrottlePolicy:
+    """Checks that tell waypaperd to skip changes that nobody would see or that cost too much right now.
+    They are ordered from the cheapest, reading a few files in sysfs, to the user command, which starts a process."""
+
+    def __init__(self, power_supply_dir: pathlib.Path = POWER_SUPPLY_DIR) -> None:
+        self.power_supply_dir = power_supply_dir
+        self.bus = None
+        self.session_path: str | None = None
+        self.logind_available = True
+
+    def get_logind_property(self, path: str, interface: str, name: str):
+        from gi.repository import Gio, GLib
+        if self.bus is None:
+            self.bus = Gio.bus_get_sync(Gio.BusType.SYSTEM, None)
+        reply = self.bus.call_sync(LOGIND_NAME, path, "org.freedesktop.DBus.Properties", "Get",
+                                   GLib.Variant("(ss)", (interface, name)), GLib.VariantType("(v)"),
+                                   Gio.DBusCallFlags.NONE, 1000, None)
+        return reply.unpack()[0]
+
+    def get_session_path(self) -> str:
+        """Graphical session of the user, since a daemon started by systemd does not belong to any session itself"""
+        if self.session_path is None:
+            _, path = self.get_logind_property("/org/freedesktop/login1/user/self", LOGIND_USER_INTERFACE, "Display")
+            self.session_path = path if path and path != "/" else LOGIND_AUTO_SESSION
+        return self.session_path
+
+    def is_idle(self) -> bool:
+        """Whether logind reports the session as idle or locked, or False if logind cannot be asked"""
+        if not self.logind_available:
+            return False
+        try:
+            path = self.get_session_path()
+            return bool(self.get_logind_property(path, LOGIND_SESSION_INTERFACE, "LockedHint") or
+                        self.get_logind_property(path, LOGIND_SESSION_INTERFACE, "IdleHint"))
+        except Exception as e:
+            # The session can end while the daemon keeps running, otherwise logind is not there at all:
+            if self.session_path is None:
+                LOG.info("Idle state of the session is not available, changes are not skipped when idle: %s", e)
+                self.logind_available = False
+            self.session_path = None
+            return False
+
+    def get_skip_reason(self, cf) -> str | None:
+        """Reason to skip the wallpaper change according to the config, or None to change it"""
+        if cf.waypaperd_skip_on_battery and is_on_battery(self.power_supply_dir):
+            return "battery"
+        if cf.waypaperd_skip_when_idle and self.is_idle():
+            return "idle"
+        if cf.waypaperd_skip_command and run_skip_command(cf.waypaperd_skip_command):
+            return "command"
+        return None
@@ -0,0 +1,61 @@
+"""Module with the in-memory cache of thumbnails that are shown in the GUI"""
+
+from collections import OrderedDict
+from typing import Any, Callable
+
+
+def get_pixbuf_size(pixbuf: Any) -> int:
+    """Number of bytes used by the pixels of the pixbuf"""
+    return pixbuf.get_rowstride() * pixbuf.get_height()
+
+
+class ThumbnailMemoryCache:
+    """Least recently used thumbnails kept in memory within a budget of bytes"""
+
+    def __init__(self, limit_bytes: int, on_evict: Callable[[str], None] | None = None) -> None:
+        self.limit_bytes = limit_bytes
+        self.on_evict = on_evict
+        self.pixbufs: OrderedDict[str, Any] = OrderedDict()
+        self.sizes: dict[str, int] = {}
+        self.total_bytes = 0
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.pixbufs
+
+    def __len__(self) -> int:
+        return len(self.pixbufs)
+
+    def get(self, key: str) -> Any:
+        """Return the thumbnail and mark it as recently used"""
+        pixbuf = self.pixbufs.get(key)
+        if pixbuf is not None:
+            self.pixbufs.move_to_end(key)
+        return pixbuf
+
+    def peek(self, key: str) -> Any:
+        """Return the thumbnail without changing the order of eviction"""
+        return self.pixbufs.get(key)
+
+    def put(self, key: str, pixbuf: Any) -> None:
+        """Add the thumbnail and evict the least recently used ones that do not fit into the budget"""
+        self.remove(key)
+        self.pixbufs[key] = pixbuf
+        self.sizes[key] = get_pixbuf_size(pixbuf)
+        self.total_bytes += self.sizes[key]
+
+        # The thumbnail that was just added is always kept, even if it alone exceeds the budget:
+        while self.total_bytes > self.limit_bytes and len(self.pixbufs) > 1:
+            old_key, _ = self.pixbufs.popitem(last=False)
+            self.total_bytes -= self.sizes.pop(old_key)
+            if self.on_evict:
+                self.on_evict(old_key)
+
+    def remove(self, key: str) -> None:
+        if key in self.pixbufs:
+            del self.pixbufs[key]
+            self.total_bytes -= self.sizes.pop(key)
+
+    def clear(self) -> None:
+        self.pixbufs.clear()
+        self.sizes.clear()
+        self.total_bytes = 0
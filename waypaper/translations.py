@@ -21,6 +21,11 @@ class English:
         self.msg_arg_configfile = "specify a custom file to store the application configuration"
         self.msg_arg_monitor = "specify desired monitor using its name"
         self.msg_arg_post = "prevents running post_command set in config"
+        self.msg_arg_gc_cache = "removes unused thumbnails and keeps the cache within its size limit"
+        self.msg_arg_build_cache = "creates missing thumbnails of the wallpaper folders without opening the GUI"
+        self.msg_arg_jobs = "number of parallel processes used to create thumbnails"
+        self.msg_arg_slideshow = "send a command to the running slideshow daemon and print its status"
+        self.msg_arg_slideshow_interval = "change the interval of the running slideshow daemon, in seconds"
         self.msg_arg_show_path_in_tooltip = "show the relative path in the tooltip"
 
         self.msg_select = "Select"
@@ -101,6 +106,11 @@ class German:
         self.msg_arg_configfile = "specify a custom file to store the application configuration"
         self.msg_arg_monitor = "geben Sie den gewünschten Monitor mit seinem Namen an"
         self.msg_arg_post = "verhindert das Ausführen des in der Konfiguration festgelegten post_command"
+        self.msg_arg_gc_cache = "removes unused thumbnails and keeps the cache within its size limit"
+        self.msg_arg_build_cache = "creates missing thumbnails of the wallpaper folders without opening the GUI"
+        self.msg_arg_jobs = "number of parallel processes used to create thumbnails"
+        self.msg_arg_slideshow = "send a command to the running slideshow daemon and print its status"
+        self.msg_arg_slideshow_interval = "change the interval of the running slideshow daemon, in seconds"
         self.msg_arg_show_path_in_tooltip = "zeigt den relativen Pfad im Tooltip an"
         self.msg_show_path_in_tooltip = "Pfad im Tooltip anzeigen"
 
@@ -180,6 +190,11 @@ class French:
         self.msg_arg_configfile = "specify a custom file to store the application configuration"
         self.msg_arg_monitor = "spécifiez le moniteur souhaité en utilisant son nom"
         self.msg_arg_post = "empêche l'exécution de post_command défini dans la configuration"
+        self.msg_arg_gc_cache = "removes unused thumbnails and keeps the cache within its size limit"
+        self.msg_arg_build_cache = "creates missing thumbnails of the wallpaper folders without opening the GUI"
+        self.msg_arg_jobs = "number of parallel processes used to create thumbnails"
+        self.msg_arg_slideshow = "send a command to the running slideshow daemon and print its status"
+        self.msg_arg_slideshow_interval = "change the interval of the running slideshow daemon, in seconds"
         self.msg_arg_show_path_in_tooltip = "afficher le chemin relatif dans l'infobulle"
 
         self.msg_select = "Sélectionner"
@@ -258,6 +273,11 @@ class Polish:
         self.msg_arg_configfile = "specify a custom file to store the application configuration"
         self.msg_arg_monitor = "ustaw pożądany monitor używając jego nazwy"
         self.msg_arg_post = "zapobiega uruchomieniu post_command ustawionego w konfiguracji"
+        self.msg_arg_gc_cache = "removes unused thumbnails and keeps the cache within its size limit"
+        self.msg_arg_build_cache = "creates missing thumbnails of the wallpaper folders without opening the GUI"
+        self.msg_arg_jobs = "number of parallel processes used to create thumbnails"
+        self.msg_arg_slideshow = "send a command to the running slideshow daemon and print its status"
+        self.msg_arg_slideshow_interval = "change the interval of the running slideshow daemon, in seconds"
         self.msg_arg_show_path_in_tooltip = "pokaż względną ścieżkę w podpowiedzi"
 
         self.msg_select = "Wybierz"
@@ -337,6 +357,11 @@ class Russian:
         self.msg_arg_configfile = "specify a custom file to store the application configuration"
         self.msg_arg_monitor = "указать имя монитора для которого устанавливаются обои"
         self.msg_arg_post = "предотвратить выполнение post_command"
+        self.msg_arg_gc_cache = "removes unused thumbnails and keeps the cache within its size limit"
+        self.msg_arg_build_cache = "creates missing thumbnails of the wallpaper folders without opening the GUI"
+        self.msg_arg_jobs = "number of parallel processes used to create thumbnails"
+        self.msg_arg_slideshow = "send a command to the running slideshow daemon and print its status"
+        self.msg_arg_slideshow_interval = "change the interval of the running slideshow daemon, in seconds"
         self.msg_arg_show_path_in_tooltip = "показывать относительный путь в подсказке"
         self.msg_zen = "Режим Дзэн"
         self.msg_zen_enter = "Вы входите в режим Дзэн.\nНажмите z, чтобы вернуться в обычный режим."
@@ -416,6 +441,11 @@ class Belarusian:
         self.msg_arg_configfile = "specify a custom file to store the application configuration"
         self.msg_arg_monitor = "określ żądany monitor, używając jego nazwy"
         self.msg_arg_post = "перашкаджае запуску post_command, зададзенага ў канфігурацыі"
+        self.msg_arg_gc_cache = "removes unused thumbnails and keeps the cache within its size limit"
+        self.msg_arg_build_cache = "creates missing thumbnails of the wallpaper folders without opening the GUI"
+        self.msg_arg_jobs = "number of parallel processes used to create thumbnails"
+        self.msg_arg_slideshow = "send a command to the running slideshow daemon and print its status"
+        self.msg_arg_slideshow_interval = "change the interval of the running slideshow daemon, in seconds"
         self.msg_arg_show_path_in_tooltip = "паказваць адносны шлях у падказцы"
 
         self.msg_select = "Выбраць"
@@ -495,6 +525,11 @@ class Ukrainian:
         self.msg_arg_configfile = "вкажіть файл для зберігання конфігурації программи"
         self.msg_arg_monitor = "вкажіть бажанний монітор за його назвою"
         self.msg_arg_post = "запобігає запуску post_command"
+        self.msg_arg_gc_cache = "removes unused thumbnails and keeps the cache within its size limit"
+        self.msg_arg_build_cache = "creates missing thumbnails of the wallpaper folders without opening the GUI"
+        self.msg_arg_jobs = "number of parallel processes used to create thumbnails"
+        self.msg_arg_slideshow = "send a command to the running slideshow daemon and print its status"
+        self.msg_arg_slideshow_interval = "change the interval of the running slideshow daemon, in seconds"
         self.msg_arg_show_path_in_tooltip = "показати відносний шлях у підказці"
 
         self.msg_select = "Вибрати"
@@ -575,6 +610,11 @@ class Chinese:
         self.msg_arg_configfile = "指定用于存储应用程序配置的自定义文件"
         self.msg_arg_monitor = "通过其名称指定所需的显示器"
         self.msg_arg_post = "阻止运行配置中设置的 post_command"
+        self.msg_arg_gc_cache = "removes unused thumbnails and keeps the cache within its size limit"
+        self.msg_arg_build_cache = "creates missing thumbnails of the wallpaper folders without opening the GUI"
+        self.msg_arg_jobs = "number of parallel processes used to create thumbnails"
+        self.msg_arg_slideshow = "send a command to the running slideshow daemon and print its status"
+        self.msg_arg_slideshow_interval = "change the interval of the running slideshow daemon, in seconds"
         self.msg_arg_show_path_in_tooltip = "在工具提示中显示相对路径"
 
         self.msg_select = "选择"
@@ -653,6 +693,11 @@ class TraditionalChinese:
         self.msg_arg_configfile = "指定用於儲存程式配置文件的自定文件"
         self.msg_arg_monitor = "用螢幕的名稱來選擇壁紙在那一個螢幕顯示"
         self.msg_arg_post = "停止更換壁紙後運行的命令"
+        self.msg_arg_gc_cache = "removes unused thumbnails and keeps the cache within its size limit"
+        self.msg_arg_build_cache = "creates missing thumbnails of the wallpaper folders without opening the GUI"
+        self.msg_arg_jobs = "number of parallel processes used to create thumbnails"
+        self.msg_arg_slideshow = "send a command to the running slideshow daemon and print its status"
+        self.msg_arg_slideshow_interval = "change the interval of the running slideshow daemon, in seconds"
         self.msg_arg_show_path_in_tooltip = "在工具提示中顯示相對路徑"
 
         self.msg_select = "選擇"
@@ -732,6 +777,11 @@ class Spanish:
         self.msg_arg_configfile = "specify a custom file to store the application configuration"
         self.msg_arg_monitor = "especifique el monitor deseado usando su nombre"
         self.msg_arg_post = "impide ejecutar el post_command definido en la configuración"
+        self.msg_arg_gc_cache = "removes unused thumbnails and keeps the cache within its size limit"
+        self.msg_arg_build_cache = "creates missing thumbnails of the wallpaper folders without opening the GUI"
+        self.msg_arg_jobs = "number of parallel processes used to create thumbnails"
+        self.msg_arg_slideshow = "send a command to the running slideshow daemon and print its status"
+        self.msg_arg_slideshow_interval = "change the interval of the running slideshow daemon, in seconds"
         self.msg_arg_show_path_in_tooltip = "mostrar la ruta relativa en la información sobre herramientas"
 
         self.msg_select = "Selecciona"
@@ -810,6 +860,11 @@ class Turkish:
         self.msg_arg_configfile = "specify a custom file to store the application configuration"
         self.msg_arg_monitor = "istenen monitörü adıyla belirt"
         self.msg_arg_post = "ayar dosyasında tanımlı post_command komutunu çalıştırmayı engeller"
+        self.msg_arg_gc_cache = "removes unused thumbnails and keeps the cache within its size limit"
+        self.msg_arg_build_cache = "creates missing thumbnails of the wallpaper folders without opening the GUI"
+        self.msg_arg_jobs = "number of parallel processes used to create thumbnails"
+        self.msg_arg_slideshow = "send a command to the running slideshow daemon and print its status"
+        self.msg_arg_slideshow_interval = "change the interval of the running slideshow daemon, in seconds"
         self.msg_arg_show_path_in_tooltip = "ipucunda göreli yolu göster"
 
         self.msg_select = "Seç"
@@ -888,6 +943,11 @@ class Japanese:
         self.msg_arg_configfile = "specify a custom file to store the application configuration"
         self.msg_arg_monitor = "モニター名を指定して対象のモニターを選択"
         self.msg_arg_post = "設定ファイルで指定された post_command の実行を防止"
+        self.msg_arg_gc_cache = "removes unused thumbnails and keeps the cache within its size limit"
+        self.msg_arg_build_cache = "creates missing thumbnails of the wallpaper folders without opening the GUI"
+        self.msg_arg_jobs = "number of parallel processes used to create thumbnails"
+        self.msg_arg_slideshow = "send a command to the running slideshow daemon and print its status"
+        self.msg_arg_slideshow_interval = "change the interval of the running slideshow daemon, in seconds"
         self.msg_arg_show_path_in_tooltip = "ツールチップに相対パスを表示"
 
         self.msg_select = "選択"
@@ -977,6 +1037,11 @@ class Finnish:
         self.msg_arg_configfile = "specify a custom file to store the application configuration"
         self.msg_arg_monitor = "määritä haluttu näyttö nimen avulla"
         self.msg_arg_post = "estää suorittamasta post_command asetettu configssa"
+        self.msg_arg_gc_cache = "removes unused thumbnails and keeps the cache within its size limit"
+        self.msg_arg_build_cache = "creates missing thumbnails of the wallpaper folders without opening the GUI"
+        self.msg_arg_jobs = "number of parallel processes used to create thumbnails"
+        self.msg_arg_slideshow = "send a command to the running slideshow daemon and print its status"
+        self.msg_arg_slideshow_interval = "change the interval of the running slideshow daemon, in seconds"
         self.msg_arg_show_path_in_tooltip = "näytä relatiivipolku tool-tipissä"
 
         self.msg_select = "Valitse"
@@ -1057,6 +1122,11 @@ class PortugueseBrazilian:
         self.msg_arg_configfile = "Especifica um arquivo personalizado para armazenar a configuração do aplicativo"
         self.msg_arg_monitor = "Especifica o monitor desejado usando seu nome"
         self.msg_arg_post = "Previne a execução do post_command definido no arquivo de configuração"
+        self.msg_arg_gc_cache = "removes unused thumbnails and keeps the cache within its size limit"
+        self.msg_arg_build_cache = "creates missing thumbnails of the wallpaper folders without opening the GUI"
+        self.msg_arg_jobs = "number of parallel processes used to create thumbnails"
+        self.msg_arg_slideshow = "send a command to the running slideshow daemon and print its status"
+        self.msg_arg_slideshow_interval = "change the interval of the running slideshow daemon, in seconds"
         self.msg_arg_show_path_in_tooltip = "Mostra o caminho relativo no tooltip"
 
         self.msg_select = "Selecionar"
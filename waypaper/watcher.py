@@ -0,0 +1,278 @@
+"""Module that watches wallpaper folders and reports added, removed and renamed files"""
+
+import abc
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+
+from waypaper.index import FolderIndex, IndexEntry
+
+# Called as callback(event, path, new_path) with event being "added", "removed", "renamed" or "overflow".
+# A "removed" event for a directory means that everything below that path is gone,
+# and "overflow" means that events were lost and the folders should be rescanned:
+WatcherCallback = Callable[[str, str, str | None], None]
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+MOVE_TIMEOUT = 0.05
+
+
+class FolderWatcher(abc.ABC):
+    """Base class of watchers that follow the same folder filters as the folder index"""
+
+    def __init__(self,
+                 folder_list: list[Path],
+                 callback: WatcherCallback,
+                 include_subfolders: bool = False,
+                 include_all_subfolders: bool = False,
+                 include_hidden: bool = False) -> None:
+        self.folder_list = folder_list
+        self.callback = callback
+        self.include_subfolders = include_subfolders
+        self.include_all_subfolders = include_all_subfolders
+        self.include_hidden = include_hidden
+        self.stop_event = threading.Event()
+        self.thread: threading.Thread | None = None
+
+    def max_depth(self) -> int:
+        if not self.include_subfolders:
+            return 0
+        if not self.include_all_subfolders:
+            return 1
+        return -1
+
+    def is_visible(self, name: str) -> bool:
+        return self.include_hidden or not name.startswith('.')
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
+    @abc.abstractmethod
+    def run(self) -> None:
+        """Report the changes of the folders until the watcher is stopped"""
+
+
+class PollingWatcher(FolderWatcher):
+    """Watcher that periodically compares the folder listing, cheap thanks to the folder index.
+    Polls only stat the directories, and files are checked one by one on the much longer revalidation interval."""
+
+    def __init__(self, *args, cache_dir: Path | None = None, interval: float = 5.0,
+                 revalidate_interval: float = 300.0, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.index = FolderIndex(cache_dir)
+        self.interval = interval
+        self.revalidate_interval = revalidate_interval
+
+    def snapshot(self, revalidate_files: bool = False) -> dict[str, IndexEntry]:
+        # Files overwritten in place do not change their directory, so only revalidation finds them:
+        entries = self.index.list_images(self.folder_list, self.include_subfolders, self.include_all_subfolders,
+                                         self.include_hidden, revalidate_files=revalidate_files)
+        return {entry.path: entry for entry in entries}
+
+    def run(self) -> None:
+        previous = self.snapshot()
+        last_revalidation = time.monotonic()
+        while not self.stop_event.wait(self.interval):
+            revalidate_files = time.monotonic() - last_revalidation >= self.revalidate_interval
+            if revalidate_files:
+                last_revalidation = time.monotonic()
+            previous = self.poll(previous, revalidate_files)
+
+    def poll(self, previous: dict[str, IndexEntry], revalidate_files: bool = False) -> dict[str, IndexEntry]:
+        """Compare the folders with the previous snapshot, report the differences and return the new snapshot"""
+        current = self.snapshot(revalidate_files)
+        removed = [previous[path] for path in previous.keys() - current.keys()]
+        added = [current[path] for path in current.keys() - previous.keys()]
+        changed = [path for path in current.keys() & previous.keys() if current[path] != previous[path]]
+
+        # A file that disappeared and an identical one that appeared is most likely a rename:
+        removed_by_stat = {(entry.size, entry.mtime_ns): entry.path for entry in removed}
+        for entry in added:
+            old_path = removed_by_stat.pop((entry.size, entry.mtime_ns), None)
+            if old_path:
+                self.callback("renamed", old_path, entry.path)
+            else:
+                self.callback("added", entry.path, None)
+        for path in removed_by_stat.values():
+            self.callback("removed", path, None)
+        for path in changed:
+            self.callback("added", path, None)
+        return current
+
+
+class InotifyWatcher(FolderWatcher):
+    """Watcher that receives events from the Linux kernel through inotify"""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches: dict[int, tuple[str, int]] = {}
+        try:
+            for folder in self.folder_list:
+                self.add_watches(str(folder), 0)
+        except OSError:
+            os.close(self.fd)
+            raise
+        self.wake_read, self.wake_write = os.pipe()
+
+    def add_watches(self, path: str, depth: int) -> None:
+        """Watch the directory and its subdirectories within the requested depth"""
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            # Running out of watches should make us fall back to polling:
+            if error == 28:
+                raise OSError(error, "inotify watch limit reached")
+            return
+        self.watches[wd] = (path, depth)
+        if depth == self.max_depth():
+            return
+        try:
+            with os.scandir(path) as iterator:
+                for entry in iterator:
+                    if entry.is_dir() and self.is_visible(entry.name):
+                        self.add_watches(entry.path, depth + 1)
+        except OSError:
+            pass
+
+    def remove_watches(self, path: str) -> None:
+        """Stop watching the directory and its subdirectories, for example after it was moved away"""
+        for wd, (directory, _) in list(self.watches.items()):
+            if directory == path or directory.startswith(path + os.sep):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+
+    def report_new_directory(self, path: str, depth: int) -> None:
+        """Start watching a directory that appeared and report the files that it already contains"""
+        max_depth = self.max_depth()
+        if max_depth != -1 and depth > max_depth:
+            return
+        try:
+            self.add_watches(path, depth)
+        except OSError as e:
+            print(f"Could not watch {path}: {e}")
+        recursive = max_depth == -1
+        for entry in FolderIndex(None).walk(Path(path), recursive, recursive, self.include_hidden):
+            self.callback("added", entry.path, None)
+
+    def stop(self) -> None:
+        super().stop()
+        try:
+            os.write(self.wake_write, b"\0")
+        except OSError:
+            pass
+
+    def run(self) -> None:
+        pending_moves: dict[int, tuple[str, bool]] = {}
+        try:
+            while not self.stop_event.is_set():
+                # Wait shortly for the counterpart of moves, otherwise the file has left the watched tree:
+                timeout = MOVE_TIMEOUT if pending_moves else None
+                readable, _, _ = select.select([self.fd, self.wake_read], [], [], timeout)
+                if self.stop_event.is_set():
+                    break
+                if not readable:
+                    for old_path, is_dir in pending_moves.values():
+                        if is_dir:
+                            self.remove_watches(old_path)
+                        self.callback("removed", old_path, None)
+                    pending_moves.clear()
+                if self.fd not in readable:
+                    continue
+                try:
+                    data = os.read(self.fd, 65536)
+                except BlockingIOError:
+                    continue
+                self.process_events(data, pending_moves)
+        finally:
+            os.close(self.fd)
+            os.close(self.wake_read)
+            os.close(self.wake_write)
+
+    def process_events(self, data: bytes, pending_moves: dict[int, tuple[str, bool]]) -> None:
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                self.callback("overflow", "", None)
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if wd not in self.watches or not name or not self.is_visible(name):
+                continue
+            directory, depth = self.watches[wd]
+            path = os.path.join(directory, name)
+
+            if mask & IN_MOVED_FROM:
+                pending_moves[cookie] = (path, bool(mask & IN_ISDIR))
+            elif mask & IN_MOVED_TO:
+                old_path, _ = pending_moves.pop(cookie, (None, False))
+                if old_path and not mask & IN_ISDIR:
+                    self.callback("renamed", old_path, path)
+                    continue
+                if mask & IN_ISDIR:
+                    # Files of a renamed directory are reported again under their new paths:
+                    if old_path:
+                        self.remove_watches(old_path)
+                        self.callback("removed", old_path, None)
+                    self.report_new_directory(path, depth + 1)
+                else:
+                    self.callback("added", path, None)
+            elif mask & IN_CREATE:
+                # Regular files are reported once they are fully written, but links never get closed:
+                if mask & IN_ISDIR:
+                    self.report_new_directory(path, depth + 1)
+                elif os.path.islink(path):
+                    self.callback("added", path, None)
+            elif mask & IN_CLOSE_WRITE:
+                self.callback("added", path, None)
+            elif mask & IN_DELETE:
+                if mask & IN_ISDIR:
+                    self.remove_watches(path)
+                self.callback("removed", path, None)
+
+
+def create_watcher(folder_list: list[Path],
+                   callback: WatcherCallback,
+                   include_subfolders: bool = False,
+                   include_all_subfolders: bool = False,
+                   include_hidden: bool = False,
+                   cache_dir: Path | None = None) -> FolderWatcher:
+    """Create an inotify watcher on Linux, or a polling watcher if inotify is not available"""
+    args = (folder_list, callback, include_subfolders, include_all_subfolders, include_hidden)
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(*args)
+        except (OSError, AttributeError) as e:
+            print(f"Could not watch folders with inotify, falling back to polling: {e}")
+    return PollingWatcher(*args, cache_dir=cache_dir)
@@ -1,16 +1,44 @@
-"""Small daemon that periodically triggers `waypaper --random`."""
+"""Small daemon that periodically sets random wallpapers, like `waypaper --random` but in the same process.
+It is controlled through a Unix socket, where each request and response is a line of JSON."""
 
 import argparse
+import collections
+import fcntl
+import heapq
+import itertools
+import json
 import logging
-import subprocess
-import sys
+import os
+import pathlib
+import select
+import socket
+import threading
 import time
-from typing import Sequence
+from typing import Any, NamedTuple, Sequence
 
+from waypaper.changer import change_wallpaper, preload_wallpaper
+from waypaper.common import get_random_files
 from waypaper.config import Config
+from waypaper.randomizer import SelectionWeights, WeightedPicker
+from waypaper.scheduler import DeadlineTimer, get_aligned_deadline, get_boottime, get_next_deadline
+from waypaper.throttle import SKIP_REASONS, ThrottlePolicy
 
 LOG = logging.getLogger(__name__)
 
+# The next wallpapers are picked and read this long before they are set:
+PREFETCH_LEAD_SECONDS = 10
+
+# Number of earlier wallpapers that the previous command can go back to:
+PREVIOUS_MAX_ENTRIES = 50
+
+CONTROL_COMMANDS = ["next", "previous", "pause", "resume", "set-interval", "status", "stop"]
+
+
+class Prefetched(NamedTuple):
+    """Wallpapers picked ahead of time, with the version of the config they were picked with"""
+    generation: int
+    wallpapers: list[str]
+
 
 def positive_interval(value: str) -> int:
     interval = int(value)
@@ -33,50 +61,511 @@ def parse_args(argv: Sequence[str] | None = None) -> argparse.Namespace:
     return parser.parse_args(list(argv) if argv is not None else None)
 
 
-def read_config_interval() -> int:
-    config = Config()
-    config.read()
-    config.check_validity()
-    return int(config.waypaperd_cycle_length)
+class ConfigReloader:
+    """Waypaper config that is read once and then again only when the config or state file changes"""
+
+    def __init__(self, config: Config | None = None) -> None:
+        self.config = config if config is not None else Config()
+        self.mtimes: tuple[int, int] | None = None
+        self.generation = 0
+        # The daemon picks from the same wallpapers again and again, so the weighted picker keeps their weights:
+        self.picker = WeightedPicker(self.config.cache_dir, SelectionWeights({}, frozenset()))
+
+    def get_mtimes(self) -> tuple[int, int]:
+        mtimes = []
+        for path in (self.config.config_file, self.config.state_file):
+            try:
+                mtimes.append(pathlib.Path(path).stat().st_mtime_ns)
+            except OSError:
+                mtimes.append(0)
+        return mtimes[0], mtimes[1]
 
+    def load(self) -> Config:
+        """Get the config, reading its files again if they were modified since the last time"""
+        mtimes = self.get_mtimes()
+        if mtimes != self.mtimes:
+            self.config.read()
+            self.config.read_state()
+            self.config.check_validity()
+            if self.mtimes is not None:
+                LOG.info("Configuration changed, reloaded it.")
+            self.mtimes = mtimes
+            self.generation += 1
+        return self.config
 
-def resolve_interval(interval: int | None) -> int:
+    def save(self) -> None:
+        """Save the config without treating it as modified by the user"""
+        if self.config.use_xdg_state:
+            self.config.save_state_file()
+        else:
+            self.config.save()
+        self.mtimes = self.get_mtimes()
+
+
+def resolve_interval(interval: int | None, config: Config) -> int:
     if interval is not None:
         return interval
-    return read_config_interval()
+    return int(config.waypaperd_cycle_length)
 
 
-def build_waypaper_command() -> list[str]:
-    return [sys.executable, "-m", "waypaper", "--random"]
+def pick_random_wallpapers(cf: Config, monitors: list[str] | None = None,
+                           picker: WeightedPicker | None = None) -> list[str]:
+    """Pick one random wallpaper for each of the monitors, all monitors by default"""
+    monitors = cf.monitors if monitors is None else monitors
+    folders = [cf.wallpaperengine_folder] if cf.backend == "linux-wallpaperengine" else cf.image_folder_list
+    return get_random_files(cf.backend, folders, cf.include_subfolders, cf.include_all_subfolders,
+                            cf.cache_dir, cf.show_hidden, count=len(monitors),
+                            weights=cf.get_selection_weights(), monitors=monitors, picker=picker)
 
 
-def trigger_random_wallpaper(command: Sequence[str] | None = None) -> int:
-    result = subprocess.run(
-        list(command) if command is not None else build_waypaper_command(),
-        check=False,
-    )
-    if result.returncode == 0:
-        LOG.info("Random wallpaper command completed successfully.")
+def preload_wallpapers(wallpapers: list[str], cf: Config) -> None:
+    for wallpaper in wallpapers:
+        preload_wallpaper(pathlib.Path(wallpaper), cf)
+
+
+def prefetch_random_wallpapers(reloader: ConfigReloader, monitors: list[str] | None = None) -> Prefetched:
+    """Pick the next wallpapers and preload them in the background, so that setting them does not wait for the disk"""
+    cf = reloader.load()
+    wallpapers = pick_random_wallpapers(cf, monitors, reloader.picker)
+    threading.Thread(target=preload_wallpapers, args=(wallpapers, cf), daemon=True).start()
+    return Prefetched(reloader.generation, wallpapers)
+
+
+def trigger_random_wallpaper(reloader: ConfigReloader, prefetched: Prefetched | None = None,
+                             monitors: list[str] | None = None) -> bool:
+    """Set random wallpapers on the monitors, all monitors by default, and save them,
+    returning whether any wallpaper was found.
+    Prefetched wallpapers are used unless the config changed or they were removed in the meantime."""
+    cf = reloader.load()
+    monitors = cf.monitors if monitors is None else monitors
+    if prefetched and prefetched.generation == reloader.generation and \
+            len(prefetched.wallpapers) == len(monitors) and all(map(os.path.exists, prefetched.wallpapers)):
+        random_wallpapers = prefetched.wallpapers
     else:
-        LOG.warning("Random wallpaper command exited with status %s.", result.returncode)
-    return result.returncode
+        random_wallpapers = pick_random_wallpapers(cf, monitors, reloader.picker)
+    if not random_wallpapers:
+        LOG.warning("Could not get random wallpaper.")
+        return False
+    set_wallpapers(reloader, random_wallpapers, monitors)
+    return True
+
+
+def set_wallpapers(reloader: ConfigReloader, wallpapers: Sequence[str | pathlib.Path],
+                   monitors: list[str] | None = None) -> None:
+    """Set the wallpapers on the monitors in their order, all monitors by default, and save them"""
+    cf = reloader.load()
+    monitors = cf.monitors if monitors is None else monitors
+    for wallpaper, monitor in zip(wallpapers, monitors):
+        wallpaper = pathlib.Path(wallpaper)
+        index = cf.monitors.index(monitor) if monitor in cf.monitors else len(cf.monitors)
+        if index < len(cf.wallpapers):
+            cf.wallpapers[index] = wallpaper
+        elif index < len(cf.monitors):
+            cf.wallpapers.extend([wallpaper] * (index + 1 - len(cf.wallpapers)))
+        change_wallpaper(wallpaper, cf, monitor)
+    reloader.save()
+
+
+def get_current_wallpapers(cf: Config, monitors: list[str]) -> list[pathlib.Path]:
+    """Wallpapers that are shown on the monitors, or an empty list if some of them are unknown"""
+    indices = [cf.monitors.index(monitor) for monitor in monitors if monitor in cf.monitors]
+    if len(indices) != len(monitors) or any(index >= len(cf.wallpapers) for index in indices):
+        return []
+    return [cf.wallpapers[index] for index in indices]
+
+
+def is_daemon_running(socket_path: pathlib.Path) -> bool:
+    """Check if a daemon listens on the control socket, without waiting for it to answer"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(str(socket_path))
+            return True
+        except OSError:
+            return False
+
+
+def send_command(socket_path: pathlib.Path, command: str, timeout: float = 2.0, **params: Any) -> dict | None:
+    """Send a request to the running daemon and return its response, or None if no daemon is running.
+    A daemon that is busy, for example setting a wallpaper, and does not answer in time is still running."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        try:
+            client.connect(str(socket_path))
+        except OSError:
+            return None
+        try:
+            client.sendall(json.dumps({"command": command, **params}).encode() + b"\n")
+            with client.makefile("rb") as file:
+                line = file.readline()
+            return json.loads(line)
+        except (OSError, ValueError):
+            return {"ok": False, "error": "The slideshow daemon did not answer in time"}
+
+
+def lock_daemon(socket_path: pathlib.Path) -> int | None:
+    """Take the lock that only one daemon holds while it runs, returning its file descriptor,
+    or None if another daemon holds it. The lock is released by the system when the process exits."""
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(socket_path.with_suffix(".lock"), os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def open_control_socket(socket_path: pathlib.Path) -> socket.socket | None:
+    """Listen on the control socket, or return None if another daemon already does.
+    It is called with the daemon lock held, so that two daemons never replace the socket of each other."""
+    if is_daemon_running(socket_path):
+        return None
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    # A socket left by a daemon that was killed has nobody listening on it:
+    try:
+        socket_path.unlink()
+    except FileNotFoundError:
+        pass
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(socket_path))
+    os.chmod(socket_path, 0o600)
+    server.listen()
+    return server
+
+
+class MonitorSchedule:
+    """Timer of the wallpaper changes of monitors that change together"""
+
+    def __init__(self, monitors: list[str], interval: int, fixed: bool, now: float) -> None:
+        self.monitors = monitors
+        self.interval = interval
+        # Intervals set through the control socket stay until the daemon restarts, others follow the config:
+        self.fixed = fixed
+        # The monitor has its own interval in the config, which the interval of all monitors does not change:
+        self.own_interval = False
+        self.last_change = now
+        self.deadline = now
+        self.prefetched: Prefetched | None = None
+        # Reason to skip the next change, found when it would be prefetched:
+        self.skip_reason: str | None = None
+        # The next change was requested through the control socket, so it is never skipped:
+        self.requested = False
+        self.missed_changes = 0
+        self.skipped_changes = dict.fromkeys(SKIP_REASONS, 0)
+        self.version = 0
+
+    def get_lead(self) -> float:
+        return min(PREFETCH_LEAD_SECONDS, self.interval / 2)
+
+    def get_next_event(self) -> float:
+        """Time when the next wallpapers are prefetched or set"""
+        return self.deadline if self.prefetched or self.skip_reason else self.deadline - self.get_lead()
+
+    def restart_timer(self, align_to_clock: bool, scheduled: float | None = None) -> None:
+        """Schedule the next change after the one that was due at the scheduled time, or that was requested now.
+        Deadlines missed during suspend are skipped, so that only one change happens after resuming."""
+        now = get_boottime()
+        self.last_change = now if scheduled is None else scheduled
+        self.deadline, missed = get_next_deadline(self.last_change, self.interval, now)
+        if missed:
+            self.missed_changes += missed
+            LOG.info("Skipped %s wallpaper changes that were missed, for example during suspend.", missed)
+        if align_to_clock:
+            self.deadline = get_aligned_deadline(self.interval, now)
+        LOG.info("Next wallpaper on %s in %.0f seconds.", ", ".join(self.monitors), self.deadline - now)
+
+    def set_interval(self, interval: int, fixed: bool) -> None:
+        """Change the interval while keeping the time of the last change"""
+        self.interval = interval
+        self.fixed = fixed
+        self.deadline = max(get_boottime(), self.last_change + interval)
+        self.prefetched = None
+        self.skip_reason = None
+
+    def get_status(self, paused_remaining: float | None) -> dict:
+        remaining = paused_remaining if paused_remaining is not None else max(0.0, self.deadline - get_boottime())
+        return {
+            "monitors": list(self.monitors),
+            "interval": self.interval,
+            "next_change": round(remaining, 1),
+            "next_change_at": None if paused_remaining is not None else round(time.time() + remaining, 1),
+            "missed_changes": self.missed_changes,
+            "skipped_changes": dict(self.skipped_changes),
+        }
+
+
+class Slideshow:
+    """Timers of the wallpaper changes, which are controlled by requests from the control socket.
+    Monitors with their own interval in the config change independently, and the others change together.
+    The timers are kept in a heap, so the event loop only looks at the one that is due next.
+    Times are on the boot clock, which keeps counting while the computer is suspended."""
+
+    def __init__(self, reloader: ConfigReloader, interval: int | None = None) -> None:
+        self.reloader = reloader
+        self.fixed_interval = interval
+        self.interval = resolve_interval(interval, reloader.load())
+        self.schedules: list[MonitorSchedule] = []
+        self.heap: list[tuple[float, int, int, MonitorSchedule]] = []
+        self.counter = itertools.count()
+        self.config_generation = -1
+        self.policy = ThrottlePolicy()
+        self.pause_time: float | None = None
+        self.running = True
+        self.go_back = False
+        self.previous: collections.deque[tuple[list[str], list[pathlib.Path]]] = \
+            collections.deque(maxlen=PREVIOUS_MAX_ENTRIES)
+        self.update_schedules()
+
+    @property
+    def paused(self) -> bool:
+        return self.pause_time is not None
+
+    def update_schedules(self) -> None:
+        """Create the timers of the monitors in the config, keeping those that did not change"""
+        cf = self.reloader.load()
+        if self.reloader.generation == self.config_generation:
+            return
+        self.config_generation = self.reloader.generation
+        if self.fixed_interval is None:
+            self.interval = resolve_interval(None, cf)
+
+        # Without intervals for single monitors, all monitors change together:
+        monitor_intervals = cf.waypaperd_monitor_intervals
+        if any(monitor in monitor_intervals for monitor in cf.monitors):
+            groups = [([monitor], monitor_intervals.get(monitor)) for monitor in cf.monitors]
+        else:
+            groups = [(list(cf.monitors), None)]
+
+        existing = {tuple(schedule.monitors): schedule for schedule in self.schedules}
+        now = get_boottime()
+        self.schedules = []
+        for monitors, monitor_interval in groups:
+            interval = monitor_interval or self.interval
+            schedule = existing.get(tuple(monitors))
+            if schedule is None:
+                # New monitors get a wallpaper right away, others keep their timers:
+                schedule = MonitorSchedule(monitors, interval, False, now)
+            elif not schedule.fixed and schedule.interval != interval:
+                schedule.set_interval(interval, False)
+            schedule.own_interval = monitor_interval is not None
+            schedule.prefetched = None
+            schedule.skip_reason = None
+            self.schedules.append(schedule)
+        self.heap = []
+        for schedule in self.schedules:
+            self.push(schedule)
+
+    def push(self, schedule: MonitorSchedule) -> None:
+        """Put the next event of the schedule into the heap, which makes its older entries outdated"""
+        schedule.version += 1
+        heapq.heappush(self.heap, (schedule.get_next_event(), next(self.counter), schedule.version, schedule))
+
+    def peek(self) -> tuple[float, MonitorSchedule] | None:
+        while self.heap and self.heap[0][2] != self.heap[0][3].version:
+            heapq.heappop(self.heap)
+        return (self.heap[0][0], self.heap[0][3]) if self.heap else None
+
+    def get_schedules(self, monitor: str | None) -> list[MonitorSchedule]:
+        if monitor is None:
+            return self.schedules
+        return [schedule for schedule in self.schedules if monitor in schedule.monitors]
+
+    def get_next_event(self) -> float | None:
+        """Time when the next wallpapers are prefetched or set, or None while paused"""
+        if self.go_back:
+            return get_boottime()
+        if self.paused:
+            return None
+        top = self.peek()
+        return top[0] if top else None
+
+    def on_timer(self) -> None:
+        """Prefetch or change the wallpapers of the timers that are due"""
+        if self.go_back:
+            self.go_back = False
+            if self.previous:
+                monitors, wallpapers = self.previous.pop()
+                set_wallpapers(self.reloader, wallpapers, monitors)
+                for schedule in self.schedules:
+                    if set(schedule.monitors) & set(monitors):
+                        self.restart_timer(schedule)
+            return
+        if self.paused:
+            return
+        self.update_schedules()
+        while (top := self.peek()) and top[0] <= get_boottime():
+            _, schedule = top
+            if get_boottime() >= schedule.deadline:
+                self.change(schedule)
+            else:
+                self.prefetch(schedule)
+
+    def prefetch(self, schedule: MonitorSchedule) -> None:
+        """Prefetch the next wallpapers, unless the change is going to be skipped"""
+        if not schedule.requested:
+            schedule.skip_reason = self.policy.get_skip_reason(self.reloader.load())
+        if schedule.skip_reason is None:
+            schedule.prefetched = prefetch_random_wallpapers(self.reloader, schedule.monitors)
+        self.push(schedule)
+
+    def change(self, schedule: MonitorSchedule) -> None:
+        """Set the next wallpapers, or skip the change if the policy checked now or before prefetching tells so"""
+        cf = self.reloader.load()
+        reason = schedule.skip_reason
+        if not schedule.requested and schedule.prefetched is None and reason is None:
+            reason = self.policy.get_skip_reason(cf)
+        if reason and not schedule.requested:
+            schedule.skipped_changes[reason] += 1
+            LOG.info("Skipped the wallpaper change on %s because of %s.", ", ".join(schedule.monitors), reason)
+            self.restart_timer(schedule, schedule.deadline)
+            return
+        current_wallpapers = get_current_wallpapers(cf, schedule.monitors)
+        if trigger_random_wallpaper(self.reloader, schedule.prefetched, schedule.monitors) and current_wallpapers:
+            self.previous.append((list(schedule.monitors), current_wallpapers))
+        self.restart_timer(schedule, schedule.deadline)
+
+    def restart_timer(self, schedule: MonitorSchedule, scheduled: float | None = None) -> None:
+        schedule.prefetched = None
+        schedule.skip_reason = None
+        schedule.requested = False
+        schedule.restart_timer(self.reloader.load().waypaperd_align_to_clock, scheduled)
+        self.push(schedule)
+
+    def handle(self, request: dict) -> dict:
+        """Carry out a request and respond with the status. Wallpapers are changed after responding.
+        The next and set-interval commands apply to the timer of the requested monitor, or to all timers."""
+        command = request.get("command")
+        monitor = request.get("monitor")
+        schedules = self.get_schedules(monitor)
+        if monitor is not None and not schedules:
+            return {"ok": False, "error": f"The slideshow does not change monitor {monitor}"}
+        now = get_boottime()
+        if command == "next":
+            self.resume(now)
+            for schedule in schedules:
+                schedule.deadline = now
+                schedule.requested = True
+                self.push(schedule)
+        elif command == "previous":
+            if not self.previous:
+                return {"ok": False, "error": "There is no previous wallpaper"}
+            self.go_back = True
+        elif command == "pause" and not self.paused:
+            self.pause_time = now
+        elif command == "resume":
+            self.resume(now)
+        elif command == "set-interval":
+            try:
+                interval = positive_interval(str(request.get("interval")))
+            except (ValueError, argparse.ArgumentTypeError):
+                return {"ok": False, "error": "The interval must be a positive number of seconds"}
+            if monitor is None:
+                # Monitors with their own interval keep it, and the others follow the new interval of all monitors:
+                self.fixed_interval = self.interval = interval
+                schedules = [schedule for schedule in schedules if not schedule.fixed and not schedule.own_interval]
+            for schedule in schedules:
+                schedule.set_interval(interval, monitor is not None)
+                self.push(schedule)
+        elif command == "stop":
+            self.running = False
+        elif command not in CONTROL_COMMANDS:
+            return {"ok": False, "error": f"Unknown command: {command}"}
+        return {"ok": True, **self.get_status()}
+
+    def resume(self, now: float) -> None:
+        """Continue the timers with the time that was remaining when they were paused"""
+        if self.pause_time is None:
+            return
+        for schedule in self.schedules:
+            schedule.deadline += now - self.pause_time
+            schedule.last_change += now - self.pause_time
+            self.push(schedule)
+        self.pause_time = None
+
+    def get_status(self) -> dict:
+        cf = self.reloader.load()
+        schedules = [schedule.get_status(max(0.0, schedule.deadline - self.pause_time) if self.paused else None)
+                     for schedule in self.schedules]
+        next_schedule = min(schedules, key=lambda status: status["next_change"], default=None)
+        return {
+            "pid": os.getpid(),
+            "running": self.running,
+            "paused": self.paused,
+            "interval": self.interval,
+            "next_change": next_schedule["next_change"] if next_schedule else None,
+            "next_change_at": next_schedule["next_change_at"] if next_schedule else None,
+            "missed_changes": sum(schedule.missed_changes for schedule in self.schedules),
+            "skipped_changes": {reason: sum(schedule.skipped_changes[reason] for schedule in self.schedules)
+                                for reason in SKIP_REASONS},
+            "monitors": list(cf.monitors),
+            "wallpapers": [str(wallpaper) for wallpaper in cf.wallpapers],
+            "schedules": schedules,
+        }
+
+    def serve(self, server: socket.socket) -> None:
+        """Wait for requests until the next timer event, and stop once requested"""
+        timer = DeadlineTimer()
+        try:
+            while self.running:
+                timer.set(self.get_next_event())
+                readable, _, _ = select.select([server, timer] if timer.fileno() >= 0 else [server], [], [],
+                                               timer.get_timeout())
+                if timer in readable:
+                    timer.clear()
+                if server in readable:
+                    self.accept(server)
+                self.on_timer()
+        finally:
+            timer.close()
+
+    def accept(self, server: socket.socket) -> None:
+        connection, _ = server.accept()
+        with connection:
+            try:
+                # A client that does not send its request in time does not block the slideshow:
+                connection.settimeout(1)
+                with connection.makefile("rb") as file:
+                    request = json.loads(file.readline(64 * 1024))
+                response = self.handle(request if isinstance(request, dict) else {})
+            except ValueError:
+                response = {"ok": False, "error": "The request is not valid JSON"}
+            except OSError as e:
+                LOG.warning("Could not read control request: %s", e)
+                return
+            try:
+                connection.sendall(json.dumps(response).encode() + b"\n")
+            except OSError as e:
+                LOG.warning("Could not answer control request: %s", e)
 
 
 def main(argv: Sequence[str] | None = None) -> int:
     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
     args = parse_args(argv)
-    interval = resolve_interval(args.interval)
-    command = build_waypaper_command()
+    reloader = ConfigReloader()
+    socket_path = pathlib.Path(reloader.load().control_socket)
+    lock_fd = lock_daemon(socket_path)
+    server = open_control_socket(socket_path) if lock_fd is not None else None
+    if server is None:
+        LOG.error("waypaperd is already running, control it with `waypaper --slideshow`.")
+        if lock_fd is not None:
+            os.close(lock_fd)
+        return 1
 
-    LOG.info("Starting waypaperd with interval=%s seconds.", interval)
+    slideshow = Slideshow(reloader, args.interval)
+    LOG.info("Starting waypaperd with interval=%s seconds, listening on %s.", slideshow.interval, socket_path)
     try:
-        while True:
-            trigger_random_wallpaper(command)
-            LOG.info("Sleeping for %s seconds.", interval)
-            time.sleep(interval)
+        slideshow.serve(server)
+        LOG.info("waypaperd stopped.")
     except KeyboardInterrupt:
         LOG.info("waypaperd interrupted, exiting cleanly.")
-        return 0
+    finally:
+        server.close()
+        try:
+            socket_path.unlink()
+        except OSError:
+            pass
+        os.close(lock_fd)
+    return 0
 
 
 if __name__ == "__main__":